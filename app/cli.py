@@ -0,0 +1,128 @@
+"""Maintenance commands for the indexes of this deployment.
+
+Uses the same settings (``.env``) as the server::
+
+    python -m app.cli reencode --dimensions 512 --quantization int8
+    python -m app.cli snapshot export
+    python -m app.cli snapshot import data/snapshots/<id>
+"""
+import argparse
+import json
+import logging
+from pathlib import Path
+
+from app.core.config import settings
+from app.services import snapshot
+from app.services.service import RAGService
+from app.services.vectorstore import QUANTIZATIONS
+
+
+def reencode(service, args):
+    names = args.collection or service.collection_names()
+    if not names:
+        print("No collection to re-encode")
+        return
+    for name in names:
+        n = service.reencode(name, dimensions=args.dimensions,
+                             quantization=args.quantization)
+        print(f"{name}: {n} vectors re-encoded")
+    if args.dimensions and args.dimensions != settings.EMBEDDING_DIMENSIONS:
+        print(f"Set EMBEDDING_DIMENSIONS={args.dimensions} before "
+              f"restarting the server, so queries match the index")
+    if (args.quantization
+            and args.quantization != settings.VECTOR_QUANTIZATION):
+        print(f"Set VECTOR_QUANTIZATION={args.quantization} so new "
+              f"collections are encoded the same way")
+
+
+def snapshot_export(service, args):
+    path = args.output or (Path(settings.SNAPSHOT_DIR)
+                           / snapshot.new_snapshot_id())
+    manifest = snapshot.export_snapshot(service, path, args.collection)
+    for name, info in manifest["collections"].items():
+        print(f"{name}: {info['count']} rows, fingerprint "
+              f"{info['fingerprint'][:12]}")
+    print(f"Snapshot written to {path}")
+
+
+def snapshot_import(service, args):
+    result = snapshot.import_snapshot(service, args.path, since=args.since)
+    for name, counts in result.items():
+        print(f"{name}: {counts['upserted']} rows written, "
+              f"{counts['deleted']} deleted"
+              + (" (BM25 index restored)" if counts["bm25_restored"]
+                 else ""))
+
+
+def snapshot_diff(service, args):
+    changes = snapshot.diff_snapshots(args.old, args.new)
+    if args.ids:
+        print(json.dumps(changes, indent=2))
+        return
+    for name, diff in changes.items():
+        print(f"{name}: +{len(diff['added'])} -{len(diff['removed'])} "
+              f"~{len(diff['changed'])} ={diff['unchanged']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli",
+                                     description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser(
+        "reencode",
+        help="truncate and/or quantize the stored vectors in place",
+    )
+    cmd.add_argument("--dimensions", type=int,
+                     help="keep the first N dimensions (re-normalised)")
+    cmd.add_argument("--quantization", choices=QUANTIZATIONS,
+                     help="first-pass encoding (mmap backend only)")
+    cmd.add_argument("--collection", action="append",
+                     help="only this collection (repeatable; default: "
+                          "COLLECTION_NAME with all its shards and tenants)")
+    cmd.set_defaults(run=reencode)
+
+    cmd = commands.add_parser(
+        "snapshot", help="export, import or compare index snapshots",
+    )
+    actions = cmd.add_subparsers(dest="action", required=True)
+    sub = actions.add_parser(
+        "export", help="write ids, vectors, texts and metadata of every "
+                       "collection to a snapshot directory",
+    )
+    sub.add_argument("--output", help="snapshot directory (default: "
+                                      "SNAPSHOT_DIR/<new snapshot id>)")
+    sub.add_argument("--collection", action="append",
+                     help="only this collection (repeatable)")
+    sub.set_defaults(run=snapshot_export)
+    sub = actions.add_parser(
+        "import", help="load a snapshot into this node's indexes",
+    )
+    sub.add_argument("path")
+    sub.add_argument("--since", help="snapshot the node was last synced "
+                                     "to: only write what changed since")
+    sub.set_defaults(run=snapshot_import)
+    sub = actions.add_parser(
+        "diff", help="rows added, removed and changed between snapshots",
+    )
+    sub.add_argument("old")
+    sub.add_argument("new")
+    sub.add_argument("--ids", action="store_true",
+                     help="print the ids as JSON instead of counts")
+    sub.set_defaults(run=snapshot_diff)
+
+    args = parser.parse_args(argv)
+    if args.command == "reencode" and not (args.dimensions
+                                           or args.quantization):
+        parser.error("reencode needs --dimensions and/or --quantization")
+    logging.basicConfig(level=logging.INFO,
+                        format="%(levelname)s %(name)s: %(message)s")
+    service = RAGService.from_settings(settings)
+    try:
+        args.run(service, args)
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,146 @@
+from typing import Literal, Optional
+
 from pydantic_settings import BaseSettings
 
 
+# Credentials each role needs: OCR + embeddings to ingest, query
+# embeddings + the router to answer.
+ROLE_CREDENTIALS = {
+    "ingest": ("MISTRAL_API_KEY", "OPENAI_API_KEY"),
+    "query": ("OPENAI_API_KEY", "ROUTER_API_KEY"),
+}
+ROLE_CREDENTIALS["all"] = tuple(dict.fromkeys(
+    ROLE_CREDENTIALS["ingest"] + ROLE_CREDENTIALS["query"]
+))
+
+
+def require(value, name):
+    """Return *value*, the credential *name*, or raise ``RuntimeError``."""
+    if not value:
+        raise RuntimeError(
+            f"Missing {name} – set it in the environment or the .env file"
+        )
+    return value
+
+
 class Settings(BaseSettings):
-    MISTRAL_API_KEY: str
-    UPLOAD_DIR: str
-    OPENAI_API_KEY: str
-    ROUTER_API_KEY: str
+    # Keys are optional here so any replica can import the app; the ones its
+    # ROLE needs are checked by create_app(), the others on first use.
+    MISTRAL_API_KEY: Optional[str] = None
+    UPLOAD_DIR: str = "data/uploads"
+    OPENAI_API_KEY: Optional[str] = None
+    ROUTER_API_KEY: Optional[str] = None
+
+    # "all", "ingest" (POST/DELETE /documents only) or "query" (/question)
+    ROLE: Literal["all", "ingest", "query"] = "all"
+    # build clients / tokenizers in a background thread after startup
+    WARMUP: bool = True
+    # add the X-Timing stage breakdown to every response, not only to
+    # requests that send an X-Timing header
+    TIMING_HEADER: bool = False
+    # requests a worker serves at once; more are answered 503 with
+    # Retry-After instead of queueing behind slow upstream calls (0 = off)
+    MAX_IN_FLIGHT: int = 32
+    RETRY_AFTER: int = 2  # seconds, sent with those 503s
+    # /admin endpoints (index snapshots) need "Authorization: Bearer
+    # <ADMIN_TOKEN>"; they are disabled while it is unset
+    ADMIN_TOKEN: Optional[str] = None
+
+    # vector store
+    VECTOR_BACKEND: str = "chroma"  # "chroma" or "mmap"
+    CHROMA_DIR: str = "data/chroma_db"
+    MMAP_INDEX_DIR: str = "data/mmap_index"
+    IVF_THRESHOLD: int = 50_000  # mmap: switch from exact search to IVF
+    IVF_N_PROBE: int = 8  # mmap: IVF lists scanned per query
+    # mmap: compact vector copy for a first pass ("none", "int8", "binary");
+    # the best k * QUANTIZED_RESCORE rows are rescored with full vectors
+    VECTOR_QUANTIZATION: Literal["none", "int8", "binary"] = "none"
+    QUANTIZED_RESCORE: int = 10
+    COLLECTION_NAME: str = "documents"
+    # >1 spreads documents over that many collections (by file name) and
+    # fans searches out to all of them; set it before ingesting anything
+    SHARDS: int = 1
+    LEXICAL_INDEX_DIR: str = "data/lexical"  # BM25 index per collection
+    SNAPSHOT_DIR: str = "data/snapshots"  # exported index snapshots
+    RETRIEVAL_WORKERS: int = 16  # threads for parallel search fan-out
+    # post-retrieval: re-select top_k from MMR_FETCH_K candidates with
+    # maximal marginal relevance (1.0 = plain top-k), then merge chunks
+    # that follow each other on a page into one de-overlapped passage
+    MMR_LAMBDA: float = 0.7
+    MMR_FETCH_K: int = 20
+    MERGE_ADJACENT_CHUNKS: bool = True
+
+    # POST /question/batch
+    GENERATION_CONCURRENCY: int = 8  # chat completions in flight at once
+    BATCH_MAX_QUESTIONS: int = 256
+
+    # chunking (a change re-chunks cached OCR instead of re-running it)
+    CHUNK_SIZE: int = 1000
+    CHUNK_OVERLAP: int = 200
+
+    # background ingestion (POST /documents returns a job id)
+    JOBS_DIR: str = "data/jobs"
+    INGEST_WORKERS: int = 4
+    OCR_CONCURRENCY: int = 2
+    # read the PDF text layer locally, OCR only scanned / garbled pages
+    LOCAL_TEXT_EXTRACTION: bool = True
+    # large documents are OCR'd as page-range shards in parallel, each
+    # retried on its own (0 = one OCR call per document)
+    OCR_SHARD_PAGES: int = 16
+    OCR_SHARD_CONCURRENCY: int = 4  # per document, times OCR_CONCURRENCY
+    OCR_MAX_RETRIES: int = 3
+    # ask OCR for page images and keep them under UPLOAD_DIR/images
+    OCR_IMAGES: bool = False
+    EMBED_CONCURRENCY: int = 2
+
+    # embedding dispatch inside one document (see embedder.embed_json_file)
+    EMBED_MAX_IN_FLIGHT: int = 4
+    EMBED_MAX_BATCH_TOKENS: int = 16_000
+
+    # models / upstreams
+    EMBEDDING_MODEL: str = "text-embedding-3-small"
+    # shorter vectors from the model (e.g. 512); existing collections must
+    # be converted with `python -m app.cli reencode --dimensions N`
+    EMBEDDING_DIMENSIONS: Optional[int] = None
+    EMBEDDING_BASE_URL: Optional[str] = None  # e.g. a local fake for tests
+    CHAT_MODEL: str = "openai/gpt-4.1-nano"
+    ROUTER_BASE_URL: str = "https://router.requesty.ai/v1"
+    # seconds before an upstream call is abandoned (streamed answers: the
+    # longest wait for the next token); failures map to 502/504.  A query
+    # waits at most about (UPSTREAM_MAX_RETRIES + 1) x timeout per call.
+    EMBEDDING_TIMEOUT: float = 20.0
+    CHAT_TIMEOUT: float = 60.0
+    OCR_TIMEOUT: float = 300.0
+    UPSTREAM_MAX_RETRIES: int = 2  # query embedding / chat client retries
+
+    # keep-alive HTTP pool shared by the OpenAI/router clients
+    HTTP_MAX_CONNECTIONS: int = 20
+    HTTP_MAX_KEEPALIVE: int = 10
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+
+    # (model, text hash) -> vector cache in front of the embedding API
+    EMBEDDING_CACHE_PATH: str = "data/embedding_cache.sqlite3"
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 500_000
+    EMBEDDING_CACHE_MEMORY_ENTRIES: int = 10_000
+
+    # POST /question answers reused for questions whose embedding has at
+    # least this cosine similarity (same filters / tenant / mode); stale
+    # once a source document is re-ingested.  0 entries disables it.
+    ANSWER_CACHE_THRESHOLD: float = 0.95
+    ANSWER_CACHE_MAX_ENTRIES: int = 1024
+    ANSWER_CACHE_TTL: float = 3600.0  # seconds
 
     class Config:
         env_file = ".env"
 
+    def require(self, name):
+        """Return the credential *name* or raise ``RuntimeError``."""
+        return require(getattr(self, name), name)
+
+    def missing_credentials(self):
+        """Credentials required by ``ROLE`` that are not set."""
+        return [name for name in ROLE_CREDENTIALS[self.ROLE]
+                if not getattr(self, name)]
+
 
 settings = Settings()
@@ -1,10 +1,31 @@
+import logging
+import math
 import os
+import threading
+import time
+from pathlib import Path
 
-from flask import Flask, send_from_directory
+import httpx
+from flask import (Flask, Response, g, jsonify, request,
+                   send_from_directory)
+from werkzeug.exceptions import HTTPException
 
 from app.core.config import settings  # load .env / secrets
+from app.routers.admin import admin_bp
 from app.routers.documents import documents_bp
 from app.routers.question import question_bp
+from app.services import metrics, snapshot
+from app.services.ingest import ingest_pdf
+from app.services.jobs import JobQueue
+from app.services.ocr_store import OCRStore
+from app.services.service import RAGService
+
+logger = logging.getLogger(__name__)
+
+# Cheap endpoints that stay reachable while the worker is saturated, so
+# probes and scrapers can still see what is going on.
+UNLIMITED_ENDPOINTS = {"prometheus_metrics", "stats", "favicon",
+                       "index_html", "static"}
 
 
 def create_app() -> Flask:
@@ -12,9 +33,30 @@ def create_app() -> Flask:
     # global config
     app.config["UPLOAD_DIR"] = settings.UPLOAD_DIR  # e.g. "data/uploads"
 
-    # register blueprints
-    app.register_blueprint(documents_bp)
-    app.register_blueprint(question_bp)
+    # only the credentials this replica's role uses are required
+    missing = settings.missing_credentials()
+    if missing:
+        raise RuntimeError(
+            f"ROLE={settings.ROLE} needs {', '.join(missing)} – set them in "
+            f"the environment or the .env file"
+        )
+
+    # long-lived clients (Chroma, embeddings, router) shared by all requests;
+    # they are built on first use or by the warm-up thread below
+    service = RAGService.from_settings(settings)
+    app.extensions["rag"] = service
+
+    if settings.ROLE in ("all", "ingest"):
+        _setup_ingestion(app, service)
+        app.register_blueprint(documents_bp)
+    if settings.ROLE in ("all", "query"):
+        app.register_blueprint(question_bp)
+    _setup_admin(app, service)
+    app.register_blueprint(admin_bp)
+
+    if settings.WARMUP:
+        threading.Thread(target=service.warm, args=(settings.ROLE,),
+                         name="warm-up", daemon=True).start()
 
     # @app.route("/", methods=["GET"])
     # def index():
@@ -26,14 +68,168 @@ def create_app() -> Flask:
     def index_html():
         return send_from_directory("static", "index.html")
 
+    # per-stage timings: Prometheus histograms + optional X-Timing header
+    @app.before_request
+    def start_timing():
+        g.request_start = time.perf_counter()
+        g.timings = metrics.collect()
+
+    @app.after_request
+    def finish_timing(response):
+        # streamed bodies are still being sent: this is time to first byte
+        elapsed = time.perf_counter() - g.request_start
+        rule = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_SECONDS.observe(elapsed, rule, request.method,
+                                     response.status_code)
+        if settings.TIMING_HEADER or "X-Timing" in request.headers:
+            response.headers["X-Timing"] = metrics.timing_header(
+                {**g.timings, "total": elapsed}
+            )
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def prometheus_metrics():
+        return Response(metrics.REGISTRY.render(),
+                        mimetype="text/plain; version=0.0.4")
+
+    # cache counters etc. of the shared service
+    @app.route("/stats", methods=["GET"])
+    def stats():
+        return jsonify(app.extensions["rag"].stats()), 200
+
     # prevent 404 on favicon.ico request
     @app.route("/favicon.ico")
     def favicon():
         return "", 204
 
+    # after the timing hooks, so rejected requests are timed too
+    _setup_serving(app)
+
     return app
 
 
+def _setup_serving(app):
+    """In-flight limit (503 + Retry-After) and JSON errors for failures."""
+    slots = (threading.BoundedSemaphore(settings.MAX_IN_FLIGHT)
+             if settings.MAX_IN_FLIGHT > 0 else None)
+
+    @app.before_request
+    def acquire_slot():
+        if slots is None or request.endpoint in UNLIMITED_ENDPOINTS:
+            return None
+        if not slots.acquire(blocking=False):
+            return _error(503, "Server busy, retry later",
+                          settings.RETRY_AFTER)
+        g.in_flight = True
+        return None
+
+    # runs once a streamed body has been sent completely
+    @app.teardown_request
+    def release_slot(exc):
+        if g.pop("in_flight", False):
+            slots.release()
+
+    @app.errorhandler(Exception)
+    def upstream_error(exc):
+        if isinstance(exc, HTTPException):
+            return exc
+        status, detail, retry_after = _classify(exc)
+        if status == 500:
+            logger.exception("Unhandled error on %s %s", request.method,
+                             request.path)
+        else:
+            logger.warning("%s %s failed: %s", request.method, request.path,
+                           detail)
+        return _error(status, detail, retry_after)
+
+
+def _classify(exc):
+    """``(status, detail, retry_after)`` for an exception a view raised.
+
+    Upstream timeouts become 504, upstream throttling 503 (with the
+    provider's Retry-After when it sent one), other upstream failures 502.
+    """
+    import openai
+
+    if isinstance(exc, (openai.APITimeoutError, httpx.TimeoutException)):
+        return 504, "Upstream service timed out", None
+    if isinstance(exc, openai.RateLimitError):
+        try:
+            retry_after = math.ceil(float(
+                exc.response.headers.get("retry-after")
+            ))
+        except (TypeError, ValueError):
+            retry_after = settings.RETRY_AFTER
+        return 503, "Upstream service is rate limiting", retry_after
+    if isinstance(exc, (openai.APIConnectionError, httpx.TransportError)):
+        return 502, "Upstream service unreachable", None
+    if isinstance(exc, openai.APIStatusError):
+        return 502, f"Upstream service answered {exc.status_code}", None
+    if isinstance(exc, openai.OpenAIError):
+        return 502, f"Upstream service failed: {exc}", None
+    return 500, "Internal server error", None
+
+
+def _error(status, detail, retry_after=None):
+    response = jsonify({"detail": detail})
+    response.status_code = status
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+def _setup_ingestion(app, service):
+    """Background OCR ➜ chunk ➜ embed pipeline behind POST /documents."""
+    store = OCRStore(Path(settings.UPLOAD_DIR) / ".ocr")
+    app.extensions["ocr_store"] = store  # DELETE /documents cleans it up
+    chunk_params = {
+        "chunk_size": settings.CHUNK_SIZE,
+        "chunk_overlap": settings.CHUNK_OVERLAP,
+    }
+    image_dir = (Path(settings.UPLOAD_DIR) / "images"
+                 if settings.OCR_IMAGES else None)
+
+    def process(entry, stage):
+        return ingest_pdf(entry["path"], entry["filename"], entry["digest"],
+                          service, store, chunk_params, stage=stage,
+                          max_batch_tokens=settings.EMBED_MAX_BATCH_TOKENS,
+                          local_text=settings.LOCAL_TEXT_EXTRACTION,
+                          image_dir=image_dir, tags=entry.get("tags"),
+                          tenant=entry.get("tenant"))
+
+    app.extensions["jobs"] = JobQueue(
+        settings.JOBS_DIR,
+        process,
+        workers=settings.INGEST_WORKERS,
+        stage_limits={
+            "ocr": settings.OCR_CONCURRENCY,
+            "embedding": settings.EMBED_CONCURRENCY,
+        },
+    )
+
+
+def _setup_admin(app, service):
+    """Background snapshot imports behind POST /admin/snapshots/<id>/import.
+
+    One import runs at a time; each is a job with a single entry, so its
+    state is kept (and an interrupted import resumed) like an ingestion's.
+    """
+    root = Path(settings.SNAPSHOT_DIR)
+
+    def process(entry, stage):
+        since = entry.get("since")
+        with stage("import"):
+            result = snapshot.import_snapshot(
+                service, root / entry["snapshot_id"],
+                since=root / since if since else None,
+            )
+        return {"collections": result}
+
+    app.extensions["admin_jobs"] = JobQueue(
+        Path(settings.JOBS_DIR) / "admin", process, workers=1,
+    )
+
+
 if __name__ == "__main__":
     app = create_app()
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
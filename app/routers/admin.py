@@ -0,0 +1,88 @@
+import hmac
+from pathlib import Path
+
+from flask import Blueprint, current_app, jsonify, request, url_for
+
+from app.core.config import settings
+from app.schemas.document import JobAccepted
+from app.schemas.snapshot import (SnapshotImportJob, SnapshotImportRequest,
+                                  SnapshotInfo)
+from app.services import snapshot
+
+admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
+
+
+@admin_bp.before_request
+def require_token():
+    if not settings.ADMIN_TOKEN:
+        return jsonify({"detail": "admin endpoints are disabled; set "
+                                  "ADMIN_TOKEN to enable them"}), 403
+    sent = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(sent, f"Bearer {settings.ADMIN_TOKEN}"):
+        return jsonify({"detail": "invalid admin token"}), 401
+    return None
+
+
+@admin_bp.route("/snapshots", methods=["GET"])
+def list_snapshots():
+    body = [SnapshotInfo.from_manifest(m).model_dump()
+            for m in snapshot.list_snapshots(settings.SNAPSHOT_DIR)]
+    return jsonify(body), 200
+
+
+@admin_bp.route("/snapshots", methods=["POST"])
+def export_snapshot():
+    path = Path(settings.SNAPSHOT_DIR) / snapshot.new_snapshot_id()
+    try:
+        manifest = snapshot.export_snapshot(current_app.extensions["rag"],
+                                            path)
+    except RuntimeError as exc:  # kept changing during the export
+        return jsonify({"detail": str(exc)}), 409
+    body = SnapshotInfo.from_manifest(manifest).model_dump()
+
+    return jsonify(body), 201
+
+
+@admin_bp.route("/snapshots/<snapshot_id>/import", methods=["POST"])
+def import_snapshot(snapshot_id):
+    try:
+        payload = SnapshotImportRequest(**(request.get_json(silent=True)
+                                           or {}))
+    except Exception as exc:
+        return jsonify({"detail": str(exc)}), 400
+    root = Path(settings.SNAPSHOT_DIR)
+    if not snapshot.is_snapshot_id(snapshot_id):
+        return jsonify({"detail": f"snapshot {snapshot_id} not found"}), 404
+    for name in (snapshot_id, payload.since):
+        if name is not None and not (root / name).is_dir():
+            return jsonify({"detail": f"snapshot {name} not found"}), 404
+
+    try:
+        snapshot.check_snapshot(current_app.extensions["rag"],
+                                root / snapshot_id)
+    except ValueError as exc:  # other model, shard count or format
+        return jsonify({"detail": str(exc)}), 409
+
+    # imports take minutes: run them off the request thread, one at a time
+    job_id = current_app.extensions["admin_jobs"].submit([{
+        "filename": snapshot_id,
+        "snapshot_id": snapshot_id,
+        "since": payload.since,
+    }])
+    body = JobAccepted(
+        message="Snapshot import queued",
+        job_id=job_id,
+        status_url=url_for("admin.import_status", job_id=job_id),
+    ).model_dump()
+
+    return jsonify(body), 202
+
+
+@admin_bp.route("/jobs/<job_id>", methods=["GET"])
+def import_status(job_id):
+    job = current_app.extensions["admin_jobs"].get(job_id)
+    if job is None:
+        return jsonify({"detail": f"job {job_id} not found"}), 404
+
+    body = SnapshotImportJob.from_job(job).model_dump()
+    return jsonify(body), 200
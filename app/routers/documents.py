@@ -1,12 +1,12 @@
-import tempfile
 from pathlib import Path
 from typing import List
 
-from flask import Blueprint, current_app, jsonify, request
-from werkzeug.utils import secure_filename
+from flask import Blueprint, current_app, jsonify, request, url_for
 
-from app.schemas.document import DocumentsResponse
-from app.services import chunker, embedder, extractor
+from app.schemas.document import (DeleteResponse, JobAccepted, JobStatus,
+                                  UploadOptions)
+from app.services import ingest
+from app.services.ocr_store import save_upload
 
 documents_bp = Blueprint("documents", __name__, url_prefix="/documents")
 
@@ -21,39 +21,81 @@ def upload_documents():
     if not files:
         return jsonify({"detail": "no files sent"}), 400
 
-    docs_indexed = 0
-    total_chunks = 0
+    for uf in files:
+        if uf.mimetype != ALLOWED_MIMETYPE:
+            return jsonify({"detail": f"{uf.filename} is not a PDF"}), 415
+
+    # tags: repeated fields and/or comma-separated values
+    try:
+        options = UploadOptions(
+            tags=[tag for field in request.form.getlist("tags")
+                  for tag in field.split(",") if tag.strip()],
+            tenant=request.form.get("tenant") or None,
+        )
+    except Exception as exc:
+        return jsonify({"detail": str(exc)}), 400
+
     uploads_dir = Path(current_app.config.get("UPLOAD_DIR", "data/uploads"))
+    if options.tenant is not None:  # tenants never share uploads or logs
+        uploads_dir = uploads_dir / "tenants" / options.tenant
     uploads_dir.mkdir(parents=True, exist_ok=True)
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        tmpdir = Path(tmpdir)
+    # store (and hash) every upload now; OCR ➜ chunks ➜ vectors run later
+    entries = []
+    for uf in files:
+        digest, pdf_path = save_upload(uf.stream, uploads_dir)
+        entries.append({
+            "filename": uf.filename,
+            "path": str(pdf_path),
+            "digest": digest,
+            "tags": sorted(set(options.tags)),
+            "tenant": options.tenant,
+        })
 
-        for uf in files:
-            if uf.mimetype != ALLOWED_MIMETYPE:
-                return jsonify({"detail": f"{uf.filename} is not a PDF"}), 415
+    job_id = current_app.extensions["jobs"].submit(entries)
+    body = JobAccepted(
+        message="Documents queued for processing",
+        job_id=job_id,
+        status_url=url_for("documents.job_status", job_id=job_id),
+    ).model_dump()
 
-            safe_name = secure_filename(uf.filename)
+    return jsonify(body), 202
 
-            pdf_path = uploads_dir / safe_name
-            uf.save(pdf_path)
 
-            # -- OCR ➜ markdown -------------------------------------------------
-            ocr_json = extractor.extract_pdf(pdf_path)
-            # -- markdown ➜ overlapping chunks -------------------------------
-            chunks = chunker.chunk_markdown_pages(ocr_json, uf.filename)
-            chunk_file = pdf_path.with_suffix(".chunks.json")
-            chunker.save_chunks(chunks, chunk_file)
-            total_chunks += len(chunks)
-            # -- chunks ➜ Chroma vectors --------------------------------------
-            embedder.embed_json_file(chunk_file)
+@documents_bp.route("/<path:filename>", methods=["DELETE"])
+def delete_document(filename):
+    try:
+        tenant = UploadOptions(tenant=request.args.get("tenant")).tenant
+    except Exception as exc:
+        return jsonify({"detail": str(exc)}), 400
 
-            docs_indexed += 1
+    uploads_dir = Path(current_app.config.get("UPLOAD_DIR", "data/uploads"))
+    if tenant is not None:
+        uploads_dir = uploads_dir / "tenants" / tenant
 
-    body = DocumentsResponse(
-        message="Documents processed successfully",
-        documents_indexed=docs_indexed,
-        total_chunks=total_chunks,
+    service = current_app.extensions["rag"]
+    n_vectors, n_files = ingest.delete_document(
+        service, current_app.extensions["ocr_store"], filename, uploads_dir,
+        tenant=tenant,
+    )
+    if not n_vectors and not n_files:
+        return jsonify({"detail": f"{filename} is not indexed"}), 404
+
+    service.refresh()
+    body = DeleteResponse(
+        message="Document removed from the index",
+        filename=filename,
+        vectors_deleted=n_vectors,
+        files_deleted=n_files,
     ).model_dump()
+    return jsonify(body), 200
+
+
+@documents_bp.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = current_app.extensions["jobs"].get(job_id)
+    if job is None:
+        return jsonify({"detail": f"job {job_id} not found"}), 404
 
-    return jsonify(body), 201
+    body = JobStatus.from_job(job).model_dump()
+    return jsonify(body), 200
@@ -1,11 +1,38 @@
-from flask import Blueprint, jsonify, request
+import itertools
+import json
 
-from app.schemas.question import QuestionRequest, QuestionResponse
+from flask import (Blueprint, Response, current_app, jsonify, request,
+                   stream_with_context)
+
+from app.core.config import settings
+from app.schemas.question import (QuestionBatchRequest, QuestionBatchResponse,
+                                  QuestionRequest, QuestionResponse)
 from app.services import retriever
 
 question_bp = Blueprint("question", __name__, url_prefix="/question")
 
 
+def _wants_stream():
+    """``?stream=true`` or an ``Accept`` header preferring event streams."""
+    flag = request.args.get("stream", "").lower()
+    if flag in ("1", "true", "yes"):
+        return True
+    best = request.accept_mimetypes.best_match(
+        ["application/json", "text/event-stream"]
+    )
+    return best == "text/event-stream"
+
+
+def _filters(payload):
+    if payload.filters is None:
+        return None
+    return payload.filters.model_dump(exclude_none=True) or None
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @question_bp.route("", methods=["POST"])
 def ask_question():
     try:
@@ -13,7 +40,54 @@ def ask_question():
     except Exception as exc:
         return jsonify({"detail": str(exc)}), 400
 
-    result = retriever.answer_question(payload.question)
+    service = current_app.extensions["rag"]
+    kwargs = dict(
+        collection_name=service.collection_name,
+        service=service,
+        retrieval=payload.retrieval,
+        filters=_filters(payload),
+        tenant=payload.tenant,
+    )
+
+    if _wants_stream():
+        events = retriever.stream_answer(payload.question, **kwargs)
+        # retrieval runs up to the first event: failing there still gets
+        # a proper error status instead of a broken 200 stream
+        first = next(events)
+        body = (_sse(event, data)
+                for event, data in itertools.chain([first], events))
+        return Response(
+            stream_with_context(body),
+            mimetype="text/event-stream",
+            # keep proxies (nginx) from buffering the stream
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    result = retriever.answer_question(payload.question, **kwargs)
     body = QuestionResponse(**result).model_dump()
 
     return jsonify(body), 200
+
+
+@question_bp.route("/batch", methods=["POST"])
+def ask_questions():
+    try:
+        payload = QuestionBatchRequest(**(request.get_json(force=True) or {}))
+    except Exception as exc:
+        return jsonify({"detail": str(exc)}), 400
+    if len(payload.questions) > settings.BATCH_MAX_QUESTIONS:
+        return jsonify({"detail": f"At most {settings.BATCH_MAX_QUESTIONS} "
+                                  "questions per batch"}), 413
+
+    service = current_app.extensions["rag"]
+    results = retriever.answer_questions(
+        [(q.question, q.retrieval, _filters(q), q.tenant)
+         for q in payload.questions],
+        collection_name=service.collection_name,
+        top_k=payload.top_k,
+        service=service,
+        generate=payload.generate,
+    )
+    body = QuestionBatchResponse(results=results).model_dump()
+
+    return jsonify(body), 200
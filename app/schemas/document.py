@@ -1,7 +1,95 @@
-from pydantic import BaseModel, Field
+from typing import Annotated, Dict, List, Optional
+
+from pydantic import BaseModel, Field, StringConstraints
+
+# Both end up in metadata keys / collection names, hence the tight charset.
+# (The pattern is checked before stripping and lower-casing.)
+Tag = Annotated[str, StringConstraints(
+    strip_whitespace=True, to_lower=True,
+    pattern=r"^\s*[A-Za-z0-9][A-Za-z0-9_-]{0,63}\s*$",
+)]
+Tenant = Annotated[str, StringConstraints(
+    pattern=r"^[A-Za-z0-9](?:[A-Za-z0-9_-]{0,62}[A-Za-z0-9])?$",
+)]
+
+
+class UploadOptions(BaseModel):
+    """Optional form fields of POST /documents."""
+    tags: List[Tag] = Field(
+        default_factory=list,
+        description="Stored on every chunk; filter questions with them.",
+    )
+    tenant: Optional[Tenant] = Field(
+        default=None,
+        description="Index the documents in this tenant's own collections.",
+    )
 
 
 class DocumentsResponse(BaseModel):
     message: str = Field(example="Documents processed successfully")
     documents_indexed: int
+    documents_cached: int = Field(
+        default=0,
+        description="Documents whose OCR (or whole index entry) was reused "
+                    "from the local content-hash store.",
+    )
     total_chunks: int
+
+
+class DeleteResponse(BaseModel):
+    message: str = Field(example="Document removed from the index")
+    filename: str
+    vectors_deleted: int
+    files_deleted: int = Field(
+        default=0,
+        description="Chunk logs and uploads removed with it; the OCR pages "
+                    "go with the last upload of a PDF.",
+    )
+
+
+class JobAccepted(BaseModel):
+    message: str = Field(example="Documents queued for processing")
+    job_id: str
+    status_url: str
+
+
+class JobFile(BaseModel):
+    filename: str
+    stage: str = Field(
+        description="queued, ocr, embedding, done, cached or failed"
+    )
+    timings: Dict[str, float] = Field(
+        default_factory=dict, description="Seconds spent in each stage."
+    )
+    n_chunks: Optional[int] = None
+    error: Optional[str] = None
+
+
+class JobStatus(DocumentsResponse):
+    job_id: str
+    status: str = Field(description="queued, running, done, partial or failed")
+    created_at: float
+    finished_at: Optional[float] = None
+    files: List[JobFile]
+
+    @classmethod
+    def from_job(cls, job):
+        files = [JobFile(**f) for f in job["files"]]
+        finished = [f for f in files if f.stage in ("done", "cached")]
+        return cls(
+            message={
+                "queued": "Documents queued for processing",
+                "running": "Documents are being processed",
+                "done": "Documents processed successfully",
+                "partial": "Some documents failed",
+                "failed": "Documents could not be processed",
+            }[job["status"]],
+            documents_indexed=len(finished),
+            documents_cached=sum(f.stage == "cached" for f in files),
+            total_chunks=sum(f.n_chunks or 0 for f in finished),
+            job_id=job["job_id"],
+            status=job["status"],
+            created_at=job["created_at"],
+            finished_at=job["finished_at"],
+            files=files,
+        )
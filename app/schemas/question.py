@@ -1,10 +1,67 @@
-from pydantic import BaseModel
+from typing import List, Literal, Optional, Union
+
+from pydantic import BaseModel, Field, model_validator
+
+from app.schemas.document import Tag, Tenant
+
+
+class QuestionFilters(BaseModel):
+    """Restrict retrieval to some documents, pages or tags."""
+    filename: Optional[Union[str, List[str]]] = Field(
+        default=None, description="One file name or a list of them.",
+    )
+    page_from: Optional[int] = Field(default=None, ge=1)
+    page_to: Optional[int] = Field(default=None, ge=1)
+    tags: Optional[List[Tag]] = Field(
+        default=None, description="Chunks carrying any of these tags.",
+    )
+
+    @model_validator(mode="after")
+    def _check_pages(self):
+        if (self.page_from is not None and self.page_to is not None
+                and self.page_from > self.page_to):
+            raise ValueError("page_from must not be after page_to")
+        return self
 
 
 class QuestionRequest(BaseModel):
     question: str
+    retrieval: Literal["hybrid", "vector", "lexical"] = Field(
+        default="hybrid",
+        description="hybrid = BM25 + vectors fused with RRF; lexical skips "
+                    "the embedding call (part numbers, error codes).",
+    )
+    filters: Optional[QuestionFilters] = None
+    tenant: Optional[Tenant] = Field(
+        default=None, description="Search this tenant's documents.",
+    )
 
 
 class QuestionResponse(BaseModel):
     answer: str
     sources: list
+    cached: bool = Field(
+        default=False,
+        description="Answered from the cache of similar questions.",
+    )
+
+
+class QuestionBatchRequest(BaseModel):
+    questions: List[QuestionRequest] = Field(min_length=1)
+    top_k: int = Field(default=4, ge=1, le=100)
+    generate: bool = Field(
+        default=True,
+        description="false = retrieval only: sources without an answer.",
+    )
+
+
+class QuestionBatchItem(BaseModel):
+    """One answer of a batch; ``error`` is set instead when it failed."""
+    answer: Optional[str] = None
+    sources: list = []
+    cached: bool = False
+    error: Optional[str] = None
+
+
+class QuestionBatchResponse(BaseModel):
+    results: List[QuestionBatchItem]
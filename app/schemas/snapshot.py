@@ -0,0 +1,74 @@
+from typing import Annotated, Dict, Optional
+
+from pydantic import BaseModel, Field, StringConstraints
+
+SnapshotId = Annotated[str, StringConstraints(
+    pattern=r"^\d{8}T\d{6}Z-[0-9a-f]{8}$",
+)]
+
+
+class SnapshotInfo(BaseModel):
+    snapshot_id: str
+    created_at: str
+    embedding_model: str
+    collections: Dict[str, int] = Field(
+        description="Rows per collection (tenants and shards included).",
+    )
+
+    @classmethod
+    def from_manifest(cls, manifest):
+        return cls(
+            snapshot_id=manifest["snapshot_id"],
+            created_at=manifest["created_at"],
+            embedding_model=manifest["embedding_model"],
+            collections={name: info["count"] for name, info
+                         in manifest["collections"].items()},
+        )
+
+
+class SnapshotImportRequest(BaseModel):
+    since: Optional[SnapshotId] = Field(
+        default=None,
+        description="Snapshot this node was last synced to: only the rows "
+                    "that changed since are written.",
+    )
+
+
+class CollectionImport(BaseModel):
+    upserted: int
+    deleted: int
+    bm25_restored: bool = Field(
+        description="The snapshot's BM25 index was copied in instead of "
+                    "indexing the texts again.",
+    )
+
+
+class SnapshotImportJob(BaseModel):
+    job_id: str
+    snapshot_id: str
+    since: Optional[str] = None
+    status: str = Field(description="queued, running, done or failed")
+    created_at: float
+    finished_at: Optional[float] = None
+    timings: Dict[str, float] = Field(
+        default_factory=dict, description="Seconds spent importing.",
+    )
+    collections: Optional[Dict[str, CollectionImport]] = Field(
+        default=None, description="Set once the import is done.",
+    )
+    error: Optional[str] = None
+
+    @classmethod
+    def from_job(cls, job):
+        entry = job["files"][0]
+        return cls(
+            job_id=job["job_id"],
+            snapshot_id=entry["snapshot_id"],
+            since=entry.get("since"),
+            status=job["status"],
+            created_at=job["created_at"],
+            finished_at=job["finished_at"],
+            timings=entry["timings"],
+            collections=entry.get("collections"),
+            error=entry["error"],
+        )
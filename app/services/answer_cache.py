@@ -0,0 +1,168 @@
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from app.services.metrics import CACHE
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """In-process semantic cache of generated answers.
+
+    Entries are found by the cosine similarity of the question embedding
+    (at least *threshold*) among the entries of the same *scope*, i.e. the
+    same collection, tenant, filters and retrieval settings.  Each entry
+    remembers the version of every file its sources came from (see
+    :meth:`~app.services.lexical.BM25Index.file_versions`); a hit whose
+    files have been re-ingested or deleted since is dropped instead of
+    served.  The cache holds at most *max_entries* (least recently used
+    first out), each for at most *ttl* seconds.
+
+    Embeddings live in one preallocated matrix, next to arrays of the
+    creation time and scope hash of every slot, so a lookup is a mask over
+    those arrays and one matrix-vector product over the slots it selects.
+    Expired entries are skipped by the mask and released on the next
+    :meth:`put`.  Every worker process has its own cache.
+    """
+
+    def __init__(self, threshold=0.95, max_entries=1024, ttl=3600.0):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._vectors = None  # (max_entries, dim), allocated on first put
+        self._created = None  # per slot, -inf while free
+        self._scopes = None  # hash of every slot's scope
+        self._entries = {}  # slot -> entry dict
+        self._lru = OrderedDict()  # slots, least recently used first
+        self._free = []  # unused slots
+
+    def get(self, vector, scope, file_versions):
+        """Return ``(answer, sources)`` of a similar question, or *None*.
+
+        *file_versions* maps file names to their current versions and is
+        only called for a candidate hit.
+        """
+        q = _unit(vector)
+        with self._lock:
+            slot = self._best(q, scope, time.monotonic())
+            entry = self._entries.get(slot) if slot is not None else None
+        if entry is not None:
+            current = file_versions(list(entry["versions"]))
+            if current != entry["versions"]:
+                logger.debug("Cached answer to %r is stale",
+                             entry["question"])
+                self._drop(slot, entry)
+                entry = None
+        if entry is None:
+            self._count("miss")
+            return None
+        with self._lock:
+            if slot in self._lru:
+                self._lru.move_to_end(slot)
+        self._count("hit")
+        return entry["answer"], copy.deepcopy(entry["sources"])
+
+    def put(self, vector, scope, question, answer, sources, versions):
+        """Remember *answer* and *sources* for *question* within *scope*.
+
+        *versions* are the ``{filename: version}`` of the sources' files
+        at retrieval time.
+        """
+        if self.max_entries <= 0:
+            return
+        q = _unit(vector)
+        entry = {"scope": scope, "question": question, "answer": answer,
+                 "sources": copy.deepcopy(sources), "versions": versions}
+        now = time.monotonic()
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(q):
+                self._vectors = np.zeros((self.max_entries, len(q)),
+                                         dtype=np.float32)
+                self._created = np.empty(self.max_entries)
+                self._scopes = np.zeros(self.max_entries, dtype=np.int64)
+                self._reset()
+            expired = np.isfinite(self._created) & (
+                self._created < now - self.ttl
+            )
+            for slot in np.flatnonzero(expired).tolist():
+                self._release(slot)
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot, _ = self._lru.popitem(last=False)
+            self._vectors[slot] = q
+            self._created[slot] = now
+            self._scopes[slot] = hash(scope)
+            self._entries[slot] = entry
+            self._lru[slot] = None
+
+    def clear(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._reset()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
+
+    # ------------------------------------------------------------------
+    def _best(self, q, scope, now):
+        if not self._entries or self._vectors.shape[1] != len(q):
+            return None
+        slots = np.flatnonzero((self._scopes == hash(scope))
+                               & (self._created >= now - self.ttl))
+        if not len(slots):
+            return None
+        sims = self._vectors[slots] @ q
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None
+        slot = int(slots[best])
+        # a hash collision with another scope is not a hit
+        return slot if self._entries[slot]["scope"] == scope else None
+
+    def _reset(self):
+        self._created.fill(-np.inf)
+        self._entries.clear()
+        self._lru.clear()
+        self._free = list(range(self.max_entries - 1, -1, -1))
+
+    def _release(self, slot):
+        del self._entries[slot]
+        self._lru.pop(slot, None)
+        self._created[slot] = -np.inf
+        self._free.append(slot)
+
+    def _drop(self, slot, entry):
+        with self._lock:
+            if self._entries.get(slot) is entry:
+                self._release(slot)
+
+    def _count(self, result):
+        with self._lock:
+            if result == "hit":
+                self.hits += 1
+            else:
+                self.misses += 1
+        CACHE.inc("answer", result)
+
+
+def _unit(vector):
+    q = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(q)
+    return q / norm if norm else q
@@ -1,8 +1,10 @@
 import json
+import os
+import uuid
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Iterable, Iterator
 
-from langchain_text_splitters import MarkdownTextSplitter
+from app.services.metrics import span
 
 
 def load_ocr_json(path: Path) -> Dict[str, Any]:
@@ -32,29 +34,79 @@ def chunk_markdown_pages(
     List[Dict[str, Any]]
         Each dict contains: *page_index*, *chunk_index*, and *text*.
     """
+    return list(iter_chunks(data.get("pages", []), filename,
+                            chunk_size=chunk_size,
+                            chunk_overlap=chunk_overlap))
+
+
+def iter_chunks(
+    pages: Iterable[Dict[str, Any]], filename, chunk_size=1000,
+    chunk_overlap=200
+) -> Iterator[Dict[str, Any]]:
+    """Streaming variant of :func:`chunk_markdown_pages`.
+
+    Consumes *pages* (any iterable of ``{"index", "markdown"}`` dicts, e.g.
+    straight from the extractor or the OCR store) and yields chunks as each
+    page is split, so only one page is held at a time.
+    """
+    # imported here: langchain is slow to import and only ingestion needs it
+    from langchain_text_splitters import MarkdownTextSplitter
+
     splitter = MarkdownTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap
     )
 
-    all_chunks = []
-    for page in data.get("pages", []):
+    for page in pages:
         markdown_text: str = page.get("markdown", "")
         if not markdown_text:
             continue  # skip empty pages
 
-        page_chunks = splitter.split_text(markdown_text)
+        with span("chunking"):
+            page_chunks = splitter.split_text(markdown_text)
         page_index = page.get("index", None)
         for idx, chunk_text in enumerate(page_chunks):
-            all_chunks.append(
-                {
-                    "page_index": page_index+1,
-                    "chunk_index": idx,
-                    "text": chunk_text.strip(),
-                    "filename": filename
-                }
-            )
-    return all_chunks
+            yield {
+                "page_index": page_index+1,
+                "chunk_index": idx,
+                "text": chunk_text.strip(),
+                "filename": filename
+            }
+
+
+def log_chunks(chunks: Iterable[Dict[str, Any]], log_path
+               ) -> Iterator[Dict[str, Any]]:
+    """Write every chunk passing through to *log_path* as compact JSONL.
+
+    The log is an audit/replay trail (``embedder.embed_json_file`` accepts
+    it); chunks are yielded on unchanged.  It is written to a temporary
+    file that replaces *log_path* once the last chunk went through, so the
+    log always holds exactly one complete ingestion: replaying it restores
+    that version of the document.  A log left unfinished is discarded.
+    """
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = log_path.with_name(f".{log_path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with tmp.open("w", encoding="utf-8") as fp:
+            for chunk in chunks:
+                fp.write(json.dumps(chunk, ensure_ascii=False,
+                                    separators=(",", ":")))
+                fp.write("\n")
+                yield chunk
+        os.replace(tmp, log_path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def iter_chunk_file(path) -> Iterator[Dict[str, Any]]:
+    """Read chunks back from a ``.jsonl`` log or a legacy ``.json`` list."""
+    with path.open("r", encoding="utf-8") as fp:
+        if path.suffix == ".jsonl":
+            for line in fp:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(fp)
 
 
 def save_chunks(chunks, output_path) -> None:
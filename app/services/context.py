@@ -0,0 +1,77 @@
+import logging
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ModuleNotFoundError:  # pragma: no cover
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Tokenizer used for budgeting. The router model slug ("openai/gpt-4.1-nano")
+# is not known to tiktoken; gpt-4o-mini shares its o200k vocabulary.
+TOKENIZER_MODEL = "gpt-4o-mini"
+_FALLBACK_ENCODING = "o200k_base"
+
+CONTEXT_SEPARATOR = "\n---\n"
+
+
+@lru_cache(maxsize=16)
+def get_encoder(model=TOKENIZER_MODEL):
+    """Return the (cached) tiktoken encoder for *model*, or ``None``."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model.split("/")[-1])
+    except KeyError:
+        return tiktoken.get_encoding(_FALLBACK_ENCODING)
+
+
+def count_tokens(text, model=TOKENIZER_MODEL):
+    enc = get_encoder(model)
+    if enc is None:
+        return len(text.split())
+    return len(enc.encode(text))
+
+
+def chunk_tokens(chunk, model=TOKENIZER_MODEL):
+    """Token count of *chunk*, preferring the ``tokens`` stored at ingest.
+
+    The stored count comes from the embedding model's tokenizer
+    (cl100k), which is within a few percent of the chat tokenizer – close
+    enough for a budget that already leaves room for the answer.  Chunks
+    indexed before counts were stored are tokenized on the fly.
+    """
+    tokens = chunk.get("tokens")
+    if tokens is None:
+        tokens = count_tokens(chunk["text"], model)
+    return tokens
+
+
+def build_context(chunks, budget, model=TOKENIZER_MODEL):
+    """Pack the most relevant *chunks* into at most *budget* tokens.
+
+    Chunks are visited by ascending distance (``score``).  A chunk that does
+    not fit is skipped rather than ending the loop, so smaller, less
+    relevant chunks can still use the remaining budget.
+
+    Returns
+    -------
+    tuple of (context string, tokens used, chunks selected)
+    """
+    sep_tokens = count_tokens(CONTEXT_SEPARATOR, model)
+    selected = []
+    used = 0
+    # Lower distance => higher similarity, so sort ascending.
+    for ch in sorted(chunks, key=lambda c: c["score"]):
+        cost = chunk_tokens(ch, model) + (sep_tokens if selected else 0)
+        if used + cost > budget:
+            continue
+        selected.append(ch)
+        used += cost
+
+    if len(selected) < len(chunks):
+        logger.debug("Context budget %s: kept %s of %s chunks",
+                     budget, len(selected), len(chunks))
+    context = CONTEXT_SEPARATOR.join(ch["text"] for ch in selected)
+    return context, used, selected
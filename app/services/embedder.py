@@ -1,121 +1,390 @@
-import json
+import hashlib
 import logging
-import os
-import uuid
-from typing import Any, Dict, List
+import random
+import threading
+import time
+from concurrent.futures import (ALL_COMPLETED, FIRST_COMPLETED,
+                                ThreadPoolExecutor, wait)
+from functools import lru_cache
+from pathlib import Path
 
-import chromadb
-from langchain_openai import OpenAIEmbeddings
+from app.core.config import settings
+from app.services.chunker import iter_chunk_file
+from app.services.context import get_encoder
+from app.services.metrics import CHUNKS_INDEXED, span
+from app.services.vectorstore import ChromaStore, tag_key
 
-try:
-    import tiktoken
+logger = logging.getLogger(__name__)
+
+# tokenizer of the embedding model, used for the stored ``tokens`` counts
+EMBEDDING_TOKENIZER = "text-embedding-3-small"
 
-    _ENCODER = tiktoken.encoding_for_model("text-embedding-3-small")
-except ModuleNotFoundError:
-    _ENCODER = None
 
-try:
-    from app.core.config import settings
+@lru_cache(maxsize=1)
+def _retryable():
+    """Errors worth retrying: throttling, timeouts, dropped connections, 5xx.
 
-    _OPENAI_KEY = getattr(settings, "OPENAI_API_KEY", None)
-except (ImportError, AttributeError):
-    _OPENAI_KEY = None
+    Resolved on first use so importing this module does not load openai.
+    """
+    import openai
 
-_OPENAI_KEY = _OPENAI_KEY or os.getenv("OPENAI_API_KEY")
+    return (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
 
-if not _OPENAI_KEY:
-    raise RuntimeError("Missing OpenAI API key – set OPENAI_API_KEY env var or app.core.config.settings")  # noqa: E501
 
-logger = logging.getLogger(__name__)
+class AdaptiveLimiter:
+    """AIMD window on the number of embedding requests in flight.
+
+    The window starts at *maximum*, is halved whenever the provider answers
+    429 and grows back by roughly one slot per window of successful calls.
+    One limiter can be shared by every ingestion running in the process
+    (see ``RAGService.embed_limiter``) so they back off together.
+    """
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = maximum
+        self._active = 0
+        self._credit = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self._active -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self._credit = 0.0
+                logger.info("Embedding throttled – in-flight limit now %s",
+                            self.limit)
+            elif self.limit < self.maximum:
+                self._credit += 1.0 / self.limit
+                if self._credit >= 1.0:
+                    self.limit += 1
+                    self._credit = 0.0
+            self._cond.notify_all()
 
 
 def embed_json_file(
     chunk_json_path,
     persist_dir="data/chroma_db",
     collection_name="documents",
-    batch_size=64,
+    collection=None,
+    embeddings=None,
+    **kwargs,
 ):
     """Embed and store all chunks present in *chunk_json_path*.
 
     Parameters
     ----------
     chunk_json_path
-        Path to the JSON file produced by `chunker.py` (list of dicts).
+        Chunk file produced by `chunker.py`: a JSONL chunk log or a legacy
+        JSON list. It is streamed, never loaded whole.
     persist_dir
         Directory where Chroma will persist vectors & metadata.
     collection_name
         Name of (or alias to) the collection inside Chroma.
-    batch_size
-        Number of chunks to embed per API call.
+    collection
+        :class:`~app.services.vectorstore.VectorStore` to write to (e.g.
+        from ``RAGService``). When omitted the Chroma collection in
+        *persist_dir* is used.
+    embeddings
+        Embedding model to reuse. When omitted a new one is created.
+    **kwargs
+        Forwarded to :func:`embed_chunks`.
 
     Returns
     -------
-    dict with counters: `n_chunks`, `n_vectors`, `collection_name`.
+    dict with counters, see :func:`embed_chunks`.
     """
-    logger.info("Loading chunk list from %s", chunk_json_path)
-    chunks: List[Dict[str, Any]] = json.loads(chunk_json_path.read_text())
-    if not chunks:
-        logger.warning("No chunks found – nothing to embed")
-        return {"n_chunks": 0, "n_vectors": 0,
-                "collection_name": collection_name}
+    logger.info("Streaming chunks from %s", chunk_json_path)
 
     # Instantiate embedding model
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small",
-                                  openai_api_key=_OPENAI_KEY)
+    if embeddings is None:
+        from langchain_openai import OpenAIEmbeddings
+
+        embeddings = OpenAIEmbeddings(
+            model="text-embedding-3-small",
+            openai_api_key=settings.require("OPENAI_API_KEY"),
+            request_timeout=settings.EMBEDDING_TIMEOUT,
+        )
 
     # Prepare Chroma client + collection
-    client = chromadb.PersistentClient(path=str(persist_dir))
+    if collection is None:
+        import chromadb
 
-    # Use external embeddings (we compute first, then
-    # add with `embeddings=` param)
-    collection = client.get_or_create_collection(name=collection_name)
+        client = chromadb.PersistentClient(path=str(persist_dir))
 
-    # Process in batches
-    texts = []
-    metadatas = []
-    ids = []
-    total_vectors = 0
+        # Use external embeddings (we compute first, then
+        # add with `embeddings=` param)
+        collection = ChromaStore(
+            client.get_or_create_collection(name=collection_name)
+        )
+
+    result = embed_chunks(iter_chunk_file(Path(chunk_json_path)),
+                          collection, embeddings, **kwargs)
+    return {**result, "collection_name": collection_name}
 
-    for chunk in chunks:
-        text = chunk["text"]
-        metadata = {
-            "page_index": chunk.get("page_index"),
-            "chunk_index": chunk.get("chunk_index"),
-            "filename": chunk.get("filename")
-        }
-        if _ENCODER is not None:
-            metadata["tokens"] = len(_ENCODER.encode(text))
-
-        texts.append(text)
-        metadatas.append(metadata)
-        ids.append(str(uuid.uuid4()))
-
-        # If batch is full, embed & upsert
-        if len(texts) >= batch_size:
-            _upsert_batch(collection, texts, metadatas, ids, embeddings)
-            total_vectors += len(texts)
-            texts, metadatas, ids = [], [], []
-
-    # final tail
-    if texts:
-        _upsert_batch(collection, texts, metadatas, ids, embeddings)
-        total_vectors += len(texts)
-
-    logger.info("Stored %s vectors in collection '%s' (persist dir = %s)",
-                total_vectors, collection_name, persist_dir)
-    return {"n_chunks": len(chunks), "n_vectors": total_vectors,
-            "collection_name": collection_name}
-
-
-def _upsert_batch(
+
+def embed_chunks(
+    chunks,
     collection,
-    texts,
-    metadatas,
-    ids,
     embeddings,
+    batch_size=256,
+    max_batch_tokens=16_000,
+    max_in_flight=4,
+    limiter=None,
+    write_batch_size=2048,
+    max_retries=5,
+    incremental=True,
+    lexical=None,
 ):
-    """Embed *texts* into vector space and upsert into *collection*."""
-    logger.debug("Embedding batch of %s chunks", len(texts))
-    vectors = embeddings.embed_documents(texts)
-    collection.add(documents=texts, embeddings=vectors,
-                   metadatas=metadatas, ids=ids)
+    """Embed an iterable of chunks and upsert them into *collection*.
+
+    *chunks* is consumed lazily: chunks are grouped into batches bounded by
+    token count as they arrive and each full batch is dispatched right away,
+    with at most ``2 * max_in_flight`` batches outstanding.  Peak memory is
+    therefore bounded by the batch size, not by the document size.
+
+    Every chunk gets a deterministic id (see :func:`chunk_id`).  With
+    *incremental* the ids already stored for the document are diffed against
+    the new ones: only new chunks are embedded and upserted, vanished chunks
+    are deleted and unchanged chunks are left alone, so re-uploading the same
+    or an updated PDF never piles up duplicates.
+
+    Parameters
+    ----------
+    chunks
+        Iterable of chunk dicts (*text*, *filename*, *page_index*,
+        *chunk_index*, optionally *tags*).
+    collection
+        :class:`~app.services.vectorstore.VectorStore` to write to.
+    embeddings
+        Embedding model (``embed_documents``).
+    batch_size
+        Maximum number of chunks per embedding API call.
+    max_batch_tokens
+        Maximum number of tokens per embedding API call.
+    max_in_flight
+        Maximum number of embedding calls running at the same time.
+    limiter
+        Shared :class:`AdaptiveLimiter`; a private one capped at
+        *max_in_flight* is used when omitted.
+    write_batch_size
+        Number of vectors buffered before each ``upsert``.
+    max_retries
+        Retries per batch on throttling / transient errors (exponential
+        backoff with jitter).
+    incremental
+        Diff against the vectors already stored for the same filename(s).
+    lexical
+        Optional :class:`~app.services.lexical.BM25Index` kept in sync with
+        the collection (same ids, same additions and deletions).
+
+    Returns
+    -------
+    dict with counters: `n_chunks`, `n_vectors` (newly written),
+    `n_unchanged`, `n_deleted`.
+    """
+    limiter = limiter or AdaptiveLimiter(max_in_flight)
+    stored = {}  # filename -> ids already in the collection
+    seen = set()
+    n_chunks = n_unchanged = 0
+    total_vectors = 0
+    pending = []
+    unchanged = []  # only buffered to backfill the lexical index
+    outstanding = set()
+
+    def drain(return_when):
+        nonlocal pending, total_vectors
+        done, _ = wait(outstanding, return_when=return_when)
+        for fut in done:
+            outstanding.discard(fut)
+            batch, vectors = fut.result()
+            pending.extend(zip(batch, vectors))
+        if len(pending) >= write_batch_size or (
+            return_when == ALL_COMPLETED and pending
+        ):
+            _write_vectors(collection, pending)
+            if lexical is not None:
+                with span("lexical_add"):
+                    lexical.add(rec for rec, _ in pending)
+            CHUNKS_INDEXED.inc(amount=len(pending))
+            total_vectors += len(pending)
+            pending = []
+
+    def fresh_records():
+        nonlocal n_chunks, n_unchanged
+        for chunk in chunks:
+            n_chunks += 1
+            record = _record(chunk)
+            filename = record[2]["filename"]
+            if incremental and filename not in stored:
+                stored[filename] = set(document_ids(collection, filename))
+            seen.add(record[0])
+            if incremental and record[0] in stored[filename]:
+                n_unchanged += 1
+                if lexical is not None:
+                    unchanged.append(record)
+                    if len(unchanged) >= write_batch_size:
+                        lexical.add(unchanged)
+                        unchanged.clear()
+                continue
+            yield record
+
+    with ThreadPoolExecutor(max_workers=max_in_flight,
+                            thread_name_prefix="embed") as pool:
+        try:
+            for batch in _token_batches(fresh_records(), batch_size,
+                                        max_batch_tokens):
+                outstanding.add(pool.submit(
+                    _embed_batch, embeddings, batch, limiter, max_retries
+                ))
+                if len(outstanding) >= 2 * max_in_flight:
+                    drain(FIRST_COMPLETED)
+            # final tail
+            drain(ALL_COMPLETED)
+        except BaseException:
+            for fut in outstanding:
+                fut.cancel()
+            raise
+
+    if unchanged:
+        lexical.add(unchanged)
+
+    n_deleted = 0
+    if incremental:
+        vanished = [i for ids in stored.values() for i in ids - seen]
+        if vanished:
+            collection.delete(vanished)
+            if lexical is not None:
+                lexical.delete(vanished)
+            n_deleted = len(vanished)
+        logger.info("Incremental re-index: %s new, %s unchanged, %s deleted",
+                    total_vectors, n_unchanged, n_deleted)
+
+    logger.info("Stored %s vectors (%s chunks seen)", total_vectors, n_chunks)
+    return {"n_chunks": n_chunks, "n_vectors": total_vectors,
+            "n_unchanged": n_unchanged, "n_deleted": n_deleted}
+
+
+def _record(chunk):
+    """``(id, text, metadata)`` triple stored for one chunk."""
+    text = chunk["text"]
+    metadata = {
+        "page_index": chunk.get("page_index"),
+        "chunk_index": chunk.get("chunk_index"),
+        "filename": chunk.get("filename")
+    }
+    for tag in chunk.get("tags") or ():
+        metadata[tag_key(tag)] = True
+    encoder = get_encoder(EMBEDDING_TOKENIZER)
+    if encoder is not None:
+        metadata["tokens"] = len(encoder.encode(text))
+    return chunk_id(chunk), text, metadata
+
+
+def chunk_id(chunk):
+    """Stable id from (filename, page_index, chunk_index, text hash, tags).
+
+    The same chunk of the same document always maps to the same id, so
+    upserts are idempotent and edits only touch the chunks that changed.
+    Tags are part of the key (when there are any) so re-tagging a document
+    rewrites its metadata.
+    """
+    text_hash = hashlib.sha256(chunk["text"].encode("utf-8")).hexdigest()
+    parts = [
+        str(chunk.get("filename")),
+        str(chunk.get("page_index")),
+        str(chunk.get("chunk_index")),
+        text_hash,
+    ]
+    if chunk.get("tags"):
+        parts.append(",".join(sorted(tag_key(t) for t in chunk["tags"])))
+    key = "\x1f".join(parts)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def document_ids(collection, filename):
+    """Return the ids of every vector stored for *filename*."""
+    return collection.ids(where={"filename": filename})
+
+
+def delete_document(collection, filename, lexical=None):
+    """Remove all vectors of *filename*; return how many were deleted."""
+    ids = document_ids(collection, filename)
+    if lexical is not None:
+        lexical.delete_filename(filename)
+    if ids:
+        collection.delete(ids)
+    logger.info("Deleted %s vectors of '%s'", len(ids), filename)
+    return len(ids)
+
+
+def _token_batches(records, batch_size, max_batch_tokens):
+    """Group *records* so that each batch stays under both limits."""
+    batch, tokens = [], 0
+    for record in records:
+        n = record[2].get("tokens") or len(record[1]) // 4 + 1
+        if batch and (len(batch) >= batch_size
+                      or tokens + n > max_batch_tokens):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(record)
+        tokens += n
+    if batch:
+        yield batch
+
+
+def _retry_after(exc):
+    response = getattr(exc, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _embed_batch(embeddings, batch, limiter, max_retries,
+                 base_delay=0.5, max_delay=30.0):
+    """Embed the texts of *batch*, retrying throttled/transient failures."""
+    texts = [text for _, text, _ in batch]
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        throttled = False
+        try:
+            logger.debug("Embedding batch of %s chunks", len(texts))
+            with span("embedding_batch"):
+                return batch, embeddings.embed_documents(texts)
+        except _retryable() as exc:
+            throttled = getattr(exc, "status_code", None) == 429
+            if attempt == max_retries:
+                raise
+            delay = _retry_after(exc) or min(
+                max_delay, base_delay * 2 ** attempt
+            ) * (0.5 + random.random() / 2)
+            logger.warning("Embedding batch failed (%r) – retry %s/%s in "
+                           "%.1fs", exc, attempt + 1, max_retries, delay)
+        finally:
+            limiter.release(throttled)
+        time.sleep(delay)
+
+
+def _write_vectors(collection, items):
+    """Upsert ``((id, text, metadata), vector)`` pairs in one store call."""
+    logger.debug("Writing %s vectors", len(items))
+    with span("store_upsert"):
+        collection.upsert(
+            ids=[rec[0] for rec, _ in items],
+            documents=[rec[1] for rec, _ in items],
+            metadatas=[rec[2] for rec, _ in items],
+            embeddings=[vec for _, vec in items],
+        )
@@ -0,0 +1,249 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+
+from app.services.metrics import CACHE
+
+logger = logging.getLogger(__name__)
+
+
+def text_key(text):
+    """Content address of *text* (sha256 of its UTF-8 bytes)."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _pack(vector):
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob):
+    arr = array("f")
+    arr.frombytes(blob)
+    return arr.tolist()
+
+
+class EmbeddingCache:
+    """Persistent ``(model, sha256(text)) -> vector`` store.
+
+    Vectors live in a SQLite file (WAL mode, so several worker processes can
+    share it) fronted by a small in-process LRU.  The on-disk table is bounded
+    by *max_entries*; once exceeded the least recently used rows are evicted.
+
+    Reads stay reads: a hit only refreshes a row's ``last_used`` when it is
+    older than *touch_interval*, and those refreshes are queued and written
+    with the next :meth:`put_many` (or every 1000 of them).  The row count
+    is kept as a running total and only recounted when it passes
+    *max_entries* or after a tenth of that many inserts, since other
+    processes write to the same table.
+
+    Parameters
+    ----------
+    path
+        SQLite file location.
+    max_entries
+        Maximum rows kept on disk.
+    memory_entries
+        Maximum vectors kept in the in-memory LRU.
+    touch_interval
+        Seconds a row's ``last_used`` may lag behind its last hit, i.e. the
+        resolution of the on-disk LRU order.
+    """
+
+    def __init__(self, path, max_entries=500_000, memory_entries=10_000,
+                 touch_interval=600.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.touch_interval = touch_interval
+
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()
+        self._touched = {}  # (model, key) -> last use not yet written
+        self.hits = 0
+        self.misses = 0
+
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, key))"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used"
+            " ON embeddings(last_used)"
+        )
+        self._db.commit()
+        (self._count,) = self._db.execute(
+            "SELECT COUNT(*) FROM embeddings"
+        ).fetchone()
+        self._added = 0  # rows inserted since the last count
+
+    # ------------------------------------------------------------------
+    def get_many(self, model, keys):
+        """Return a list aligned with *keys*; ``None`` marks a miss."""
+        out = [None] * len(keys)
+        pending = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                vec = self._lru.get((model, key))
+                if vec is not None:
+                    self._lru.move_to_end((model, key))
+                    out[i] = vec
+                else:
+                    pending.setdefault(key, []).append(i)
+
+            if pending:
+                now = time.time()
+                found = []
+                wanted = list(pending)
+                # stay well below SQLITE_MAX_VARIABLE_NUMBER
+                for start in range(0, len(wanted), 500):
+                    part = wanted[start:start + 500]
+                    marks = ",".join("?" * len(part))
+                    rows = self._db.execute(
+                        f"SELECT key, vector, last_used FROM embeddings "
+                        f"WHERE model = ? AND key IN ({marks})",
+                        [model, *part],
+                    ).fetchall()
+                    found.extend(rows)
+                for key, blob, last_used in found:
+                    vec = _unpack(blob)
+                    self._remember(model, key, vec)
+                    for i in pending[key]:
+                        out[i] = vec
+                    if now - last_used > self.touch_interval:
+                        self._touched[(model, key)] = now
+                if len(self._touched) >= 1000:
+                    self._flush_touched()
+                    self._db.commit()
+
+            n_hit = sum(v is not None for v in out)
+            self.hits += n_hit
+            self.misses += len(keys) - n_hit
+        CACHE.inc("embedding", "hit", amount=n_hit)
+        CACHE.inc("embedding", "miss", amount=len(keys) - n_hit)
+        return out
+
+    def put_many(self, model, keys, vectors):
+        now = time.time()
+        with self._lock:
+            for key, vec in zip(keys, vectors):
+                self._remember(model, key, vec)
+            # a text another process embedded meanwhile keeps its vector
+            added = self._db.executemany(
+                "INSERT OR IGNORE INTO embeddings"
+                " (model, key, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, k, _pack(v), now) for k, v in zip(keys, vectors)],
+            ).rowcount
+            if added < len(keys):
+                self._touched.update(((model, k), now) for k in keys)
+            self._count += added
+            self._added += added
+            self._flush_touched()
+            self._evict()
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_entries": len(self._lru),
+            }
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._db.commit()
+            self._db.close()
+
+    # ------------------------------------------------------------------
+    def _remember(self, model, key, vec):
+        self._lru[(model, key)] = vec
+        self._lru.move_to_end((model, key))
+        while len(self._lru) > self.memory_entries:
+            self._lru.popitem(last=False)
+
+    def _flush_touched(self):
+        if self._touched:
+            self._db.executemany(
+                "UPDATE embeddings SET last_used = ? "
+                "WHERE model = ? AND key = ?",
+                [(t, model, key)
+                 for (model, key), t in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _evict(self):
+        if (self._count <= self.max_entries
+                and self._added < self.max_entries // 10):
+            return
+        # other processes insert too: count for real before evicting
+        (self._count,) = self._db.execute(
+            "SELECT COUNT(*) FROM embeddings"
+        ).fetchone()
+        self._added = 0
+        excess = self._count - self.max_entries
+        if excess > 0:
+            # some headroom, so the next puts do not evict (and count) again
+            excess += self.max_entries // 20
+            logger.debug("Evicting %s cached embeddings", excess)
+            self._count -= self._db.execute(
+                "DELETE FROM embeddings WHERE rowid IN ("
+                " SELECT rowid FROM embeddings"
+                " ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            ).rowcount
+
+
+class CachedEmbeddings:
+    """Drop-in wrapper around a LangChain embedding model.
+
+    ``embed_documents`` only sends texts that are not cached yet (each unique
+    text once) and ``embed_query`` is answered from the cache for repeated
+    questions.
+    """
+
+    def __init__(self, embeddings, cache, model):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+
+    def embed_documents(self, texts):
+        keys = [text_key(t) for t in texts]
+        vectors = self.cache.get_many(self.model, keys)
+
+        missing = {}
+        for key, text, vec in zip(keys, texts, vectors):
+            if vec is None and key not in missing:
+                missing[key] = text
+        if missing:
+            logger.debug("Embedding %s uncached texts (of %s)",
+                         len(missing), len(texts))
+            fresh = self.embeddings.embed_documents(list(missing.values()))
+            self.cache.put_many(self.model, list(missing), fresh)
+            by_key = dict(zip(missing, fresh))
+            vectors = [v if v is not None else by_key[k]
+                       for k, v in zip(keys, vectors)]
+        return vectors
+
+    def embed_query(self, text):
+        key = text_key(text)
+        (vec,) = self.cache.get_many(self.model, [key])
+        if vec is None:
+            vec = self.embeddings.embed_query(text)
+            self.cache.put_many(self.model, [key], [vec])
+        return vec
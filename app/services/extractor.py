@@ -1,56 +1,212 @@
-import json
+import contextvars
 import logging
-import os
-
-from mistralai import DocumentURLChunk, Mistral
+import mimetypes
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
 
 from app.core.config import settings
+from app.services import pdftext
+from app.services.metrics import span
+from app.services.ocr_store import save_base64
 
-try:
+logger = logging.getLogger(__name__)
 
-    _API_KEY = getattr(settings, "MISTRAL_API_KEY", None)
-except (ImportError, AttributeError):
-    _API_KEY = None
 
-_API_KEY = _API_KEY or os.getenv("MISTRAL_API_KEY")
+@lru_cache(maxsize=1)
+def _retryable():
+    """Errors worth retrying a shard for: API errors and dropped connections.
 
-if not _API_KEY:
-    raise RuntimeError("Missing Mistral API key. Set MISTRAL_API_KEY or add it to .env file")  # noqa: E501
+    Resolved on first use so importing this module does not load mistralai.
+    """
+    import httpx
+    from mistralai import models
 
-logger = logging.getLogger(__name__)
+    return models.SDKError, httpx.TransportError
 
 
-def _upload_and_ocr(client, file_path):
-    """Upload *file_path* to Mistral, run OCR, return (ocr_dict, file_id)."""
+def _upload(client, file_path):
+    """Upload *file_path* to Mistral, return (file_id, signed_url)."""
     logger.debug("Uploading %s (%s bytes) to Mistral",
                  file_path.name, file_path.stat().st_size)
 
     # Upload file to client
-    upload_resp = client.files.upload(
-        file={
-            "file_name": file_path.name,
-            "content": file_path.read_bytes(),
-        },
-        purpose="ocr",
-    )
+    with span("ocr_upload"):
+        upload_resp = client.files.upload(
+            file={
+                "file_name": file_path.name,
+                "content": file_path.read_bytes(),
+            },
+            purpose="ocr",
+        )
+
+        # Get URL from uploaded file
+        signed = client.files.get_signed_url(file_id=upload_resp.id,
+                                             expiry=1)
+    return upload_resp.id, signed.url
+
+
+def _ocr_shard(client, document_url, shard, max_retries, image_dir=None,
+               base_delay=1.0, max_delay=30.0):
+    """OCR the pages *shard* (all if *None*) of an uploaded document.
+
+    Transient failures are retried with exponential backoff; client errors
+    (4xx other than 429) are raised at once.  Page images are only
+    requested when *image_dir* is set (see :func:`_page`).  Returns the
+    page dicts with their global 0-based indices.
+    """
+    from mistralai import DocumentURLChunk
+
+    options = {} if shard is None else {"pages": shard}
+    for attempt in range(max_retries + 1):
+        try:
+            # OCR process
+            with span("ocr_process"):
+                ocr_resp = client.ocr.process(
+                    document=DocumentURLChunk(document_url=document_url),
+                    model="mistral-ocr-latest",
+                    include_image_base64=image_dir is not None,
+                    **options,
+                )
+            break
+        except _retryable() as exc:
+            status = getattr(exc, "status_code", None) or 0
+            if attempt == max_retries or (400 <= status < 500
+                                          and status != 429):
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt) * (
+                0.5 + random.random() / 2
+            )
+            logger.warning("OCR of pages %s failed (%r) – retry %s/%s in "
+                           "%.1fs", _describe(shard), exc, attempt + 1,
+                           max_retries, delay)
+        time.sleep(delay)
+
+    if image_dir is None:
+        pages = [_page(page) for page in ocr_resp.pages]
+    else:
+        with span("ocr_images"):
+            pages = [_page(page, Path(image_dir)) for page in ocr_resp.pages]
+    del ocr_resp
+    if shard is not None and len(pages) == len(shard) and not (
+        {page.get("index") for page in pages} <= set(shard)
+    ):
+        # indices relative to the selection: map back by position
+        for index, page in zip(shard, pages):
+            page["index"] = index
+    return pages
+
+
+def _page(page, image_dir=None):
+    """Turn an OCR page model into a ``{"index", "markdown"}`` dict.
+
+    Fields are read directly from the response model, with no JSON round
+    trip.  With *image_dir* every inline image is decoded into a
+    content-addressed file there; the markdown link then points at that
+    file, the path is listed under ``"images"`` and the base64 payload is
+    dropped from the response right away.
+    """
+    markdown = page.markdown or ""
+    if image_dir is None:
+        return {"index": page.index, "markdown": markdown}
+
+    images = []
+    for image in page.images or []:
+        payload = image.image_base64
+        if not payload:
+            continue
+        header, _, data = payload.rpartition(",")
+        suffix = Path(image.id).suffix or mimetypes.guess_extension(
+            header[5:].split(";")[0]
+        ) or ""
+        path = save_base64(data, image_dir, suffix).as_posix()
+        image.image_base64 = None
+        markdown = markdown.replace(f"]({image.id})", f"]({path})")
+        images.append(path)
+    return {"index": page.index, "markdown": markdown, "images": images}
+
 
-    # Get URL from uploaded file
-    signed = client.files.get_signed_url(file_id=upload_resp.id, expiry=1)
+def _describe(shard):
+    if shard is None:
+        return "all"
+    return f"{shard[0]}-{shard[-1]}" if len(shard) > 1 else str(shard[0])
 
-    # OCR process
-    ocr_resp = client.ocr.process(
-        document=DocumentURLChunk(document_url=signed.url),
-        model="mistral-ocr-latest",
-        include_image_base64=True,
-    )
 
-    # Dump response to json
-    ocr_dict = json.loads(ocr_resp.model_dump_json())
-    return ocr_dict, upload_resp.id
+def _shards(pages, shard_pages):
+    """Split page indices into lists of at most *shard_pages* indices."""
+    if pages is None or shard_pages <= 0 or len(pages) <= shard_pages:
+        return [pages]
+    return [pages[i:i + shard_pages]
+            for i in range(0, len(pages), shard_pages)]
 
 
-def extract_pdf(file_path, cleanup_remote=True):
-    """Run OCR on a PDF located at *file_path* and return the JSON result.
+def ocr_pages(file_path, cleanup_remote=True, client=None, local_text=True,
+              shard_pages=None, shard_workers=None, image_dir=None):
+    """Extract *file_path* and return an iterator over its pages.
+
+    With *local_text* (default) the PDF's own text layer is read first and
+    only the pages that have none, or only garbage (see
+    :func:`pdftext.needs_ocr`), are sent to Mistral; a born-digital document
+    never leaves the machine.  Otherwise, or if the PDF cannot be parsed
+    locally, the whole document is OCR'd.  *shard_pages*, *shard_workers*
+    and *image_dir* are forwarded to :func:`extract_pdf`.
+
+    The remote calls happen eagerly; the returned iterator then hands out
+    ``{"index", "markdown"}`` dicts (plus ``"images"`` paths for OCR'd
+    pages when *image_dir* is set) one at a time.
+    """
+    options = {"cleanup_remote": cleanup_remote, "client": client,
+               "shard_pages": shard_pages, "shard_workers": shard_workers,
+               "image_dir": image_dir}
+    if local_text:
+        try:
+            local = pdftext.text_pages(file_path)
+        except Exception as exc:
+            logger.warning("No usable text layer in %s (%r), OCR-ing all "
+                           "pages", file_path.name, exc)
+        else:
+            return _merge_pages(file_path, local, options)
+    return _iter_pages(extract_pdf(file_path, **options))
+
+
+def _merge_pages(file_path, local, options):
+    """OCR the pages of *local* that need it, keep the text of the others."""
+    need = [page["index"] for page in local if pdftext.needs_ocr(page)]
+    logger.info("%s: %d of %d pages have a usable text layer, %d need OCR",
+                file_path.name, len(local) - len(need), len(local), len(need))
+
+    ocr = {}
+    if need:
+        ocr_dict = extract_pdf(file_path, pages=need, **options)
+        ocr = {page.get("index"): page for page in ocr_dict.pop("pages", [])}
+
+    def pages():
+        for page in local:
+            index = page["index"]
+            if index in ocr:
+                yield ocr.pop(index)
+            else:
+                yield {"index": index, "markdown": page["text"]}
+
+    return pages()
+
+
+def _iter_pages(ocr_dict):
+    pages = ocr_dict.pop("pages", [])
+    pages.reverse()
+    while pages:
+        yield pages.pop()
+
+
+def extract_pdf(file_path, cleanup_remote=True, client=None, pages=None,
+                shard_pages=None, shard_workers=None, image_dir=None):
+    """Run OCR on a PDF located at *file_path* and return its pages.
+
+    The document is uploaded once.  Large documents are then OCR'd as
+    page-range shards running concurrently, each retried on its own, and
+    the pages are stitched back in order with their global indices.
 
     Parameters
     ----------
@@ -59,19 +215,80 @@ def extract_pdf(file_path, cleanup_remote=True):
     cleanup_remote
         If *True* (default) the temporary file stored on Mistral's side is
         deleted after OCR completes.
+    client
+        Mistral client to use (e.g. the benchmark's fake); by default one
+        is created from ``MISTRAL_API_KEY`` for this call.
+    pages
+        0-based page indices to OCR; all pages if *None*.
+    shard_pages
+        Pages per OCR call (default ``OCR_SHARD_PAGES``; 0 = one call).
+    shard_workers
+        Shards OCR'd at once (default ``OCR_SHARD_CONCURRENCY``).
+    image_dir
+        Where to store page images (see :func:`_page`); if *None* (default)
+        OCR is run without ``include_image_base64``.
+
+    Returns
+    -------
+    ``{"pages": [{"index", "markdown"[, "images"]}, ...]}``
     """
     if not file_path.is_file():
         raise FileNotFoundError(file_path)
 
-    with Mistral(api_key=_API_KEY) as client:
-        ocr_dict, file_id = _upload_and_ocr(client, file_path)
+    if client is None:
+        from mistralai import Mistral
+
+        with Mistral(api_key=settings.require("MISTRAL_API_KEY"),
+                     timeout_ms=int(settings.OCR_TIMEOUT * 1000)) as client:
+            return _extract(client, file_path, cleanup_remote, pages,
+                            shard_pages, shard_workers, image_dir)
+    return _extract(client, file_path, cleanup_remote, pages, shard_pages,
+                    shard_workers, image_dir)
+
+
+def _extract(client, file_path, cleanup_remote, pages=None,
+             shard_pages=None, shard_workers=None, image_dir=None):
+    if shard_pages is None:
+        shard_pages = settings.OCR_SHARD_PAGES
+    if shard_workers is None:
+        shard_workers = settings.OCR_SHARD_CONCURRENCY
+    if pages is None and shard_pages > 0:
+        n_pages = pdftext.page_count(file_path)
+        if n_pages:
+            pages = list(range(n_pages))
+    shards = _shards(pages, shard_pages)
 
+    file_id, document_url = _upload(client, file_path)
+    try:
+        if len(shards) == 1:
+            results = [_ocr_shard(client, document_url, shards[0],
+                                  settings.OCR_MAX_RETRIES, image_dir)]
+        else:
+            logger.info("OCR of %s in %d shards of up to %d pages",
+                        file_path.name, len(shards), shard_pages)
+            with ThreadPoolExecutor(max_workers=min(shard_workers,
+                                                    len(shards)),
+                                    thread_name_prefix="ocr-shard") as pool:
+                futures = [
+                    pool.submit(contextvars.copy_context().run, _ocr_shard,
+                                client, document_url, shard,
+                                settings.OCR_MAX_RETRIES, image_dir)
+                    for shard in shards
+                ]
+                try:
+                    results = [future.result() for future in futures]
+                except BaseException:
+                    for future in futures:  # a shard gave up: stop the rest
+                        future.cancel()
+                    raise
+    finally:
         if cleanup_remote:
             try:
-                client.files.delete(file_id=file_id)
+                with span("ocr_delete"):
+                    client.files.delete(file_id=file_id)
             except Exception as exc:
                 logger.warning(
                     "Failed to delete remote file %s – %r", file_id, exc
                 )
 
-    return ocr_dict
+    return {"pages": [page for shard in results for page in shard]}
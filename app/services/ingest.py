@@ -0,0 +1,201 @@
+import fcntl
+import hashlib
+import logging
+import re
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from werkzeug.utils import secure_filename
+
+from app.services import chunker, embedder, extractor
+
+logger = logging.getLogger(__name__)
+
+
+def _no_stage(name):
+    return nullcontext()
+
+
+@contextmanager
+def document_lock(lock_dir, name, filename):
+    """Hold an exclusive lock on document *filename* of collection *name*.
+
+    Two ingestions of the same document would each diff the collection
+    against their own chunks and delete the other's.  The lock is an
+    ``flock`` on a file in *lock_dir*, so it holds across threads and
+    worker processes alike.
+    """
+    lock_dir = Path(lock_dir)
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    key = hashlib.sha1(f"{name}\0{filename}".encode("utf-8")).hexdigest()
+    with open(lock_dir / f"{key}.lock", "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def has_vectors(service, filename, name=None):
+    """True if collection *name* still holds vectors for *filename*."""
+    found = service.collection(name, create=True).ids(
+        where={"filename": filename}, limit=1
+    )
+    return bool(found)
+
+
+def delete_document(service, store, filename, upload_dir, tenant=None):
+    """Remove *filename* from the indexes and its files from *upload_dir*.
+
+    Deletes its vectors and BM25 rows, its chunk logs and, for every
+    upload a log was cut from, its entry in *store*.  The OCR pages and
+    the uploaded PDF go as well unless the same PDF is still indexed under
+    another file name.  Holds the document's lock, so a running ingestion
+    of it finishes first.  Returns ``(vectors_deleted, files_deleted)``.
+    """
+    upload_dir = Path(upload_dir)
+    name = service.shard_for(filename, tenant)
+    with document_lock(upload_dir / ".locks", name, filename):
+        try:
+            n_vectors = embedder.delete_document(
+                service.collection(name), filename,
+                lexical=service.lexical(name),
+            )
+        except RuntimeError:  # nothing has been ingested yet
+            n_vectors = 0
+        n_files = 0
+        for log, prefix in _chunk_logs(upload_dir, filename):
+            for pdf in upload_dir.glob(f"{prefix}*.pdf"):
+                if store.forget(pdf.stem, name, filename):
+                    pdf.unlink(missing_ok=True)
+                    n_files += 1
+            log.unlink(missing_ok=True)
+            n_files += 1
+    logger.info("Deleted '%s': %s vectors, %s files", filename, n_vectors,
+                n_files)
+    return n_vectors, n_files
+
+
+def _chunk_logs(upload_dir, filename):
+    """``(path, digest prefix)`` of the chunk logs of *filename*."""
+    pattern = re.compile(re.escape(secure_filename(filename))
+                         + r"\.([0-9a-f]{16})\.chunks\.jsonl")
+    for path in upload_dir.glob("*.chunks.jsonl"):
+        match = pattern.fullmatch(path.name)
+        if match:
+            yield path, match.group(1)
+
+
+def ingest_pdf(
+    pdf_path,
+    filename,
+    digest,
+    service,
+    store,
+    chunk_params,
+    stage=_no_stage,
+    max_batch_tokens=16_000,
+    local_text=True,
+    image_dir=None,
+    tags=None,
+    tenant=None,
+):
+    """Run OCR ➜ chunking ➜ embedding for one stored upload.
+
+    Parameters
+    ----------
+    pdf_path
+        Local copy of the PDF (already written to ``UPLOAD_DIR``, or to
+        ``UPLOAD_DIR/tenants/<tenant>``, named after its digest).  The
+        chunk log is written next to it.
+    filename
+        Original file name, stored as chunk metadata.
+    digest
+        sha256 of the PDF bytes (key into *store*).
+    service
+        The shared :class:`~app.services.service.RAGService`.
+    store
+        :class:`~app.services.ocr_store.OCRStore` with cached OCR results.
+    chunk_params
+        ``chunk_size`` / ``chunk_overlap`` forwarded to the chunker.
+    stage
+        Callable returning a context manager for each pipeline stage
+        (``"ocr"`` and ``"embedding"``, which also covers the streamed
+        chunking); the job queue uses it for rate limiting and timings.
+    max_batch_tokens
+        Token budget of one embedding API call.
+    local_text
+        Use the PDF's own text layer and OCR only the pages without one
+        (see :func:`~app.services.extractor.ocr_pages`).
+    image_dir
+        Store the images of OCR'd pages here (content-addressed); by
+        default OCR returns text only.
+    tags
+        Tags stored on every chunk, for filtered retrieval.
+    tenant
+        Tenant namespace; with *service* sharding, the document goes to
+        the shard :meth:`~app.services.service.RAGService.shard_for` picks.
+
+    Returns
+    -------
+    dict with `n_chunks` and `cached` (OCR or whole index entry reused).
+
+    Ingestions of the same document (collection and file name) run one at
+    a time; see :func:`document_lock`.
+    """
+    pdf_path = Path(pdf_path)
+    name = service.shard_for(filename, tenant)
+    with document_lock(pdf_path.parent / ".locks", name, filename):
+        return _ingest(pdf_path, filename, digest, service, store, name,
+                       chunk_params, stage, max_batch_tokens, local_text,
+                       image_dir, tags)
+
+
+def _ingest(pdf_path, filename, digest, service, store, name, chunk_params,
+            stage, max_batch_tokens, local_text, image_dir, tags):
+    index_params = ({**chunk_params, "tags": sorted(tags)} if tags
+                    else chunk_params)
+
+    # -- identical PDF already indexed with the same chunking? -------------
+    entry = store.indexed_entry(digest, name, filename)
+    if (entry and entry["chunk_params"] == index_params
+            and has_vectors(service, filename, name)):
+        logger.info("%s already indexed (sha256=%s)", filename, digest)
+        return {"n_chunks": entry["n_chunks"], "cached": True}
+
+    # -- OCR ➜ markdown pages, written to the store one page at a time ------
+    cached = store.has_ocr(digest)
+    if not cached:
+        with stage("ocr"):
+            store.save_pages(digest, extractor.ocr_pages(
+                pdf_path, local_text=local_text, image_dir=image_dir
+            ))
+
+    # -- pages ➜ chunks ➜ vectors, streamed ----------------------------------
+    # Chunking runs lazily inside the embedding stage: pages are read back
+    # from the store, split, logged and handed to embedding batches as they
+    # fill, so memory is bounded by the batch size.
+    with stage("embedding"):
+        chunks = chunker.iter_chunks(store.iter_pages(digest), filename,
+                                     **chunk_params)
+        if tags:
+            chunks = ({**chunk, "tags": sorted(tags)} for chunk in chunks)
+        chunks = chunker.log_chunks(
+            chunks, pdf_path.parent / f"{secure_filename(filename)}"
+                                      f".{digest[:16]}.chunks.jsonl"
+        )
+        result = embedder.embed_chunks(
+            chunks,
+            collection=service.collection(name, create=True),
+            embeddings=service.ingest_embeddings,
+            max_batch_tokens=max_batch_tokens,
+            max_in_flight=service.embed_max_in_flight,
+            limiter=service.embed_limiter,
+            lexical=service.lexical(name),
+        )
+    store.mark_indexed(digest, name, filename, index_params,
+                       result["n_chunks"])
+
+    # new vectors were written -> hand out fresh collection handles
+    service.refresh()
+    return {"n_chunks": result["n_chunks"], "cached": cached}
@@ -0,0 +1,219 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_TERMINAL = {"done", "cached", "failed"}
+_JOB_ID_RE = re.compile(r"[0-9a-f]{32}")  # uuid4().hex
+
+
+class JobQueue:
+    """Background ingestion queue with locally persisted job state.
+
+    Each job is a list of already stored PDFs.  Files are processed
+    concurrently by a bounded thread pool; every file runs
+    ``process(file_entry, stage)`` where *stage* is a context-manager factory
+    that enforces a per-stage concurrency limit (OCR and embedding have
+    different provider rate limits) and records per-stage timings.
+
+    Job state is written to ``<state_dir>/<job_id>.json`` on every change.
+    Several processes (gunicorn workers) may share *state_dir*: the process
+    running a job holds an ``flock`` on ``<job_id>.lock`` until the job is
+    finished.  When a queue is created it takes over the unfinished jobs
+    whose lock is free, i.e. whose process stopped, so each is re-queued
+    by exactly one process.
+
+    Parameters
+    ----------
+    state_dir
+        Directory for job JSON files.
+    process
+        ``process(file_entry, stage) -> dict`` doing the actual work; the
+        returned dict (e.g. ``n_chunks``, ``cached``) is merged into the
+        file's state.
+    workers
+        Files processed at the same time.
+    stage_limits
+        Mapping ``stage name -> max concurrent``; stages not listed are only
+        bounded by *workers*.
+    """
+
+    def __init__(self, state_dir, process, workers=4, stage_limits=None):
+        self.state_dir = Path(state_dir)
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self._process = process
+        self._limits = {
+            name: threading.BoundedSemaphore(n)
+            for name, n in (stage_limits or {}).items()
+        }
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._claims = {}  # job id -> locked file, while the job runs
+        self._pool = ThreadPoolExecutor(max_workers=workers,
+                                        thread_name_prefix="ingest")
+        self._resume()
+
+    # ------------------------------------------------------------------
+    # public API
+    # ------------------------------------------------------------------
+    def submit(self, files):
+        """Queue *files* (dicts with at least ``filename``); return the id."""
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "created_at": time.time(),
+            "finished_at": None,
+            "files": [
+                {**f, "stage": "queued", "timings": {}, "error": None}
+                for f in files
+            ],
+        }
+        with self._lock:
+            self._claim(job_id)
+            self._jobs[job_id] = job
+            self._save(job)
+        for idx in range(len(files)):
+            self._pool.submit(self._run_file, job_id, idx)
+        logger.info("Queued ingestion job %s (%s files)", job_id, len(files))
+        return job_id
+
+    def get(self, job_id):
+        """Return a snapshot of the job, or ``None`` if unknown.
+
+        Jobs of other processes sharing *state_dir* (gunicorn workers) are
+        read from their state file.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                return json.loads(json.dumps(job))
+        path = self.state_dir / f"{job_id}.json"
+        if not _JOB_ID_RE.fullmatch(job_id) or not path.is_file():
+            return None
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    # ------------------------------------------------------------------
+    # workers
+    # ------------------------------------------------------------------
+    def _run_file(self, job_id, idx):
+        with self._lock:
+            entry = dict(self._jobs[job_id]["files"][idx])
+            self._jobs[job_id]["status"] = "running"
+
+        try:
+            result = self._process(entry, self._stage_factory(job_id, idx))
+        except Exception as exc:
+            logger.exception("Ingestion of %s failed", entry["filename"])
+            self._update(job_id, idx, stage="failed", error=str(exc))
+            return
+
+        stage = "cached" if result.get("cached") else "done"
+        self._update(job_id, idx, stage=stage, **result)
+
+    def _stage_factory(self, job_id, idx):
+        @contextmanager
+        def stage(name):
+            with self._limits.get(name) or nullcontext():
+                self._update(job_id, idx, stage=name)
+                start = time.perf_counter()
+                try:
+                    yield
+                finally:
+                    elapsed = time.perf_counter() - start
+                    with self._lock:
+                        f = self._jobs[job_id]["files"][idx]
+                        f["timings"][name] = round(elapsed, 4)
+                        self._save(self._jobs[job_id])
+        return stage
+
+    def _update(self, job_id, idx, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["files"][idx].update(fields)
+            stages = {f["stage"] for f in job["files"]}
+            if stages <= _TERMINAL:
+                job["status"] = "failed" if stages == {"failed"} else (
+                    "partial" if "failed" in stages else "done"
+                )
+                job["finished_at"] = time.time()
+            self._save(job)
+            if job["finished_at"] is not None:
+                self._release(job_id)
+
+    # ------------------------------------------------------------------
+    # persistence
+    # ------------------------------------------------------------------
+    def _save(self, job):
+        path = self.state_dir / f"{job['job_id']}.json"
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(job), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def _claim(self, job_id):
+        """Lock *job_id* for this process; False if another one holds it."""
+        fh = open(self.state_dir / f"{job_id}.lock", "a")
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            fh.close()
+            return False
+        self._claims[job_id] = fh
+        return True
+
+    def _release(self, job_id):
+        fh = self._claims.pop(job_id, None)
+        if fh is not None:
+            # the final state is saved: whoever locks the file next sees it
+            (self.state_dir / f"{job_id}.lock").unlink(missing_ok=True)
+            fh.close()
+
+    def _read(self, path):
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as exc:
+            logger.warning("Skipping unreadable job file %s – %r", path, exc)
+            return None
+
+    def _resume(self):
+        with self._lock:
+            for path in sorted(self.state_dir.glob("*.json")):
+                job = self._read(path)
+                if job is None:
+                    continue
+                if job.get("finished_at") is not None:
+                    self._jobs[job["job_id"]] = job
+                    continue
+                if not self._claim(job["job_id"]):
+                    continue  # running in another process
+                # read again under the lock: it may have finished meanwhile
+                job = self._read(path)
+                if job is None:
+                    self._release(path.stem)
+                    continue
+                self._jobs[job["job_id"]] = job
+                pending = [i for i, f in enumerate(job["files"])
+                           if f["stage"] not in _TERMINAL]
+                if not pending:
+                    self._release(job["job_id"])
+                    continue
+                logger.info("Resuming job %s (%s unfinished files)",
+                            job["job_id"], len(pending))
+                for idx in pending:
+                    job["files"][idx]["stage"] = "queued"
+                    self._pool.submit(self._run_file, job["job_id"], idx)
@@ -0,0 +1,463 @@
+import contextvars
+import heapq
+import json
+import logging
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+
+from app.services.metrics import span
+from app.services.vectorstore import where_to_sql
+
+logger = logging.getLogger(__name__)
+
+# Identifier-ish tokens ("HX-200", "E.042", "M8x1.25") are kept whole *and*
+# split into their alphanumeric parts so both spellings match.
+_TOKEN_RE = re.compile(r"[0-9A-Za-z]+(?:[-_./][0-9A-Za-z]+)*")
+_PART_RE = re.compile(r"[0-9A-Za-z]+")
+
+
+def tokenize(text):
+    terms = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        token = match.group()
+        terms.append(token)
+        parts = _PART_RE.findall(token)
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+class BM25Index:
+    """On-disk BM25 inverted index kept next to a Chroma collection.
+
+    Postings live in SQLite so the index is updated incrementally (chunks
+    are added/removed by id exactly like their vectors) and can be opened
+    by several worker processes.  Each chunk's text and metadata are stored
+    too, so lexical hits can be returned without touching Chroma.
+
+    The collection statistics BM25 needs (document count, total length and
+    each term's document frequency) are kept up to date by :meth:`add` and
+    :meth:`delete`, so a query only reads the postings of its own terms.
+
+    Parameters
+    ----------
+    path
+        SQLite file location.
+    k1, b
+        Usual BM25 saturation / length-normalisation parameters.
+    max_postings
+        Postings read per query term.  A term found in more chunks only
+        contributes to its *max_postings* highest term frequencies; such
+        terms have a low idf, so this barely moves the ranking while it
+        bounds the work of a query whatever the corpus size.
+    """
+
+    def __init__(self, path, k1=1.2, b=0.75, max_postings=5000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.k1 = k1
+        self.b = b
+        self.max_postings = max_postings
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._init_schema()
+
+    # ------------------------------------------------------------------
+    # maintenance
+    # ------------------------------------------------------------------
+    def add(self, records):
+        """Index ``(id, text, metadata)`` records; known ids are skipped."""
+        records = list(records)
+        if not records:
+            return 0
+        with self._lock:
+            known = self._existing([rec[0] for rec in records])
+            rows, postings = [], []
+            for chunk_id, text, metadata in records:
+                if chunk_id in known:
+                    continue
+                known.add(chunk_id)
+                terms = Counter(tokenize(text))
+                rows.append((chunk_id, metadata.get("filename"),
+                             sum(terms.values()), text,
+                             json.dumps(metadata)))
+                postings.extend((t, chunk_id, tf) for t, tf in terms.items())
+            self._db.executemany(
+                "INSERT INTO chunks (id, filename, length, text, metadata)"
+                " VALUES (?, ?, ?, ?, ?)", rows,
+            )
+            postings.sort()  # term order: B-tree inserts stay local
+            self._db.executemany(
+                "INSERT INTO postings (term, id, tf) VALUES (?, ?, ?)",
+                postings,
+            )
+            if rows:
+                self._db.executemany(
+                    "INSERT INTO terms (term, df) VALUES (?, ?) ON CONFLICT"
+                    "(term) DO UPDATE SET df = df + excluded.df",
+                    sorted(Counter(term for term, _, _ in postings).items()),
+                )
+                self._add_stats(len(rows), sum(row[2] for row in rows))
+                self._bump({row[1] for row in rows})
+            self._db.commit()
+        return len(rows)
+
+    def delete(self, ids):
+        ids = list(ids)
+        with self._lock:
+            filenames = set()
+            for start in range(0, len(ids), 500):
+                part = ids[start:start + 500]
+                marks = ",".join("?" * len(part))
+                filenames.update(r[0] for r in self._db.execute(
+                    f"SELECT DISTINCT filename FROM chunks"
+                    f" WHERE id IN ({marks})", part
+                ))
+                n_docs, total_len = self._db.execute(
+                    f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks"
+                    f" WHERE id IN ({marks})", part
+                ).fetchone()
+                self._add_stats(-n_docs, -total_len)
+                self._db.executemany(
+                    "UPDATE terms SET df = df - ? WHERE term = ?",
+                    [(n, term) for term, n in self._db.execute(
+                        f"SELECT term, COUNT(*) FROM postings"
+                        f" WHERE id IN ({marks}) GROUP BY term", part
+                    )],
+                )
+                self._db.execute(
+                    f"DELETE FROM postings WHERE id IN ({marks})", part
+                )
+                self._db.execute(
+                    f"DELETE FROM chunks WHERE id IN ({marks})", part
+                )
+            if ids:
+                self._db.execute("DELETE FROM terms WHERE df <= 0")
+                self._bump(filenames)
+            self._db.commit()
+
+    def records(self, ids):
+        """``{id: (text, metadata)}`` of the indexed *ids* (others left
+        out)."""
+        ids = list(ids)
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                part = ids[start:start + 500]
+                marks = ",".join("?" * len(part))
+                found.update(
+                    (cid, (text, json.loads(meta)))
+                    for cid, text, meta in self._db.execute(
+                        f"SELECT id, text, metadata FROM chunks"
+                        f" WHERE id IN ({marks})", part
+                    )
+                )
+        return found
+
+    def delete_filename(self, filename):
+        with self._lock:
+            ids = [r[0] for r in self._db.execute(
+                "SELECT id FROM chunks WHERE filename = ?", (filename,)
+            )]
+        self.delete(ids)
+        return len(ids)
+
+    # ------------------------------------------------------------------
+    # search
+    # ------------------------------------------------------------------
+    def search(self, query, k=4, where=None):
+        """Return up to *k* ``{"id", "text", "metadata", "bm25"}`` hits.
+
+        *where* restricts the hits with a Chroma-style metadata filter;
+        term statistics still come from the whole index.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        sql, params = where_to_sql(where) if where else ("1", [])
+        with span("lexical_search"), self._lock:
+            stats = dict(self._db.execute(
+                "SELECT key, value FROM info"
+                " WHERE key IN ('n_docs', 'total_len')"
+            ))
+            n_docs = stats.get("n_docs", 0)
+            if not n_docs:
+                return []
+            avg_len = stats["total_len"] / n_docs
+            marks = ",".join("?" * len(terms))
+            dfs = dict(self._db.execute(
+                f"SELECT term, df FROM terms WHERE term IN ({marks})",
+                list(terms),
+            ))
+
+            scores = Counter()
+            # rarest terms first, so common ones can score their matches
+            for term, df in sorted(dfs.items(), key=lambda item: item[1]):
+                query = ("SELECT p.id, p.tf, c.length FROM postings p"
+                         " JOIN chunks c ON c.id = p.id"
+                         f" WHERE p.term = ? AND {sql}")
+                if df <= self.max_postings:
+                    rows = self._db.execute(query, (term, *params)).fetchall()
+                else:
+                    # a common term: its highest term frequencies, plus the
+                    # chunks rarer terms matched (looked up by id)
+                    rows = self._db.execute(
+                        query + " ORDER BY p.tf DESC LIMIT ?",
+                        (term, *params, self.max_postings),
+                    ).fetchall()
+                    found = {row[0] for row in rows}
+                    rows += self._postings(
+                        term, [cid for cid in scores if cid not in found]
+                    )
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for chunk_id, tf, length in rows:
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_len)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+            best = scores.most_common(k)
+            if not best:
+                return []
+            marks = ",".join("?" * len(best))
+            stored = {
+                r[0]: r[1:] for r in self._db.execute(
+                    f"SELECT id, text, metadata FROM chunks"
+                    f" WHERE id IN ({marks})", [cid for cid, _ in best],
+                )
+            }
+        return [
+            {"id": cid, "text": stored[cid][0],
+             "metadata": json.loads(stored[cid][1]), "bm25": score}
+            for cid, score in best
+        ]
+
+    def count(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM chunks"
+            ).fetchone()[0]
+
+    def backup(self, path):
+        """Copy the index to the SQLite file *path* (a consistent copy,
+        taken with the online backup API)."""
+        with self._lock:
+            target = sqlite3.connect(str(path))
+            try:
+                self._db.backup(target)
+            finally:
+                target.close()
+
+    def restore(self, path):
+        """Replace the whole index with the :meth:`backup` at *path*.
+
+        Much faster than :meth:`add`-ing the same records, since nothing is
+        tokenized or re-sorted.  The version counter keeps growing across
+        the restore, so cached results taken before it go stale.
+        """
+        with self._lock:
+            before = self._db.execute(
+                "SELECT value FROM info WHERE key = 'version'"
+            ).fetchone()[0]
+            source = sqlite3.connect(str(path))
+            try:
+                source.backup(self._db)
+            finally:
+                source.close()
+            self._db.execute(
+                "UPDATE info SET value = MAX(value, ?) + 1"
+                " WHERE key = 'version'", (before,),
+            )
+            self._db.commit()
+            self._init_schema()  # a backup from before statistics were kept
+
+    def version(self):
+        """Counter bumped by every change, shared by all processes.
+
+        The index is updated together with the vectors, so this doubles as
+        the version of the whole collection (e.g. as a cache key).
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT value FROM info WHERE key = 'version'"
+            ).fetchone()[0]
+
+    def file_versions(self, filenames):
+        """``{filename: version}`` of the last change to each file.
+
+        The version is the value :meth:`version` took when the file's
+        chunks were last added or removed (0 if never indexed), so a cached
+        result built from some files is stale once any of them moved on.
+        """
+        filenames = list(filenames)
+        versions = dict.fromkeys(filenames, 0)
+        if not filenames:
+            return versions
+        marks = ",".join("?" * len(filenames))
+        with self._lock:
+            versions.update(self._db.execute(
+                f"SELECT filename, version FROM files"
+                f" WHERE filename IN ({marks})", filenames,
+            ))
+        return versions
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _bump(self, filenames=()):
+        self._db.execute(
+            "UPDATE info SET value = value + 1 WHERE key = 'version'"
+        )
+        self._db.executemany(
+            "INSERT INTO files (filename, version) SELECT ?, value"
+            " FROM info WHERE key = 'version'"
+            " ON CONFLICT(filename) DO UPDATE SET version = excluded.version",
+            [(f,) for f in filenames if f is not None],
+        )
+
+    def _init_schema(self):
+        """Create missing tables, and the statistics of an index written
+        before they were kept."""
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                id TEXT PRIMARY KEY,
+                filename TEXT,
+                length INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_filename ON chunks(filename);
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_id ON postings(id);
+            CREATE INDEX IF NOT EXISTS postings_tf ON postings(term, tf);
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT PRIMARY KEY,
+                df INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS info (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO info (key, value) VALUES ('version', 0);
+            CREATE TABLE IF NOT EXISTS files (
+                filename TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            );
+            """
+        )
+        self._db.commit()
+        if not self._has_stats():
+            self._rebuild_stats()
+
+    def _has_stats(self):
+        return self._db.execute(
+            "SELECT 1 FROM info WHERE key = 'n_docs'"
+        ).fetchone() is not None
+
+    def _rebuild_stats(self):
+        """Recount the collection statistics from the postings (once, for
+        indexes written before they were kept)."""
+        logger.info("Building BM25 statistics of %s", self.path)
+        self._db.execute("DELETE FROM terms")
+        self._db.execute(
+            "INSERT INTO terms (term, df)"
+            " SELECT term, COUNT(*) FROM postings GROUP BY term"
+        )
+        self._db.execute(
+            "INSERT OR REPLACE INTO info (key, value)"
+            " SELECT 'n_docs', COUNT(*) FROM chunks"
+        )
+        self._db.execute(
+            "INSERT OR REPLACE INTO info (key, value)"
+            " SELECT 'total_len', COALESCE(SUM(length), 0) FROM chunks"
+        )
+        self._db.commit()
+
+    def _add_stats(self, n_docs, total_len):
+        self._db.executemany(
+            "UPDATE info SET value = value + ? WHERE key = ?",
+            [(n_docs, "n_docs"), (total_len, "total_len")],
+        )
+
+    def _postings(self, term, ids):
+        """``(id, tf, length)`` of *term* in the chunks *ids*."""
+        rows = []
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            marks = ",".join("?" * len(part))
+            rows.extend(self._db.execute(
+                "SELECT p.id, p.tf, c.length FROM postings p"
+                " JOIN chunks c ON c.id = p.id"
+                f" WHERE p.term = ? AND p.id IN ({marks})", (term, *part),
+            ))
+        return rows
+
+    def _existing(self, ids):
+        found = set()
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            marks = ",".join("?" * len(part))
+            found.update(r[0] for r in self._db.execute(
+                f"SELECT id FROM chunks WHERE id IN ({marks})", part
+            ))
+        return found
+
+
+class ShardedLexical:
+    """BM25 search over the indexes of several shard collections.
+
+    Shards are searched concurrently on *executor* (in turn when it is
+    *None*) and the hits merged by score.  Each shard scores with its own
+    term statistics, which is close enough when documents are spread
+    evenly.
+    """
+
+    def __init__(self, indexes, executor=None):
+        self.indexes = list(indexes)
+        self.executor = executor
+
+    def search(self, query, k=4, where=None):
+        if self.executor is None or len(self.indexes) == 1:
+            per_shard = [index.search(query, k, where)
+                         for index in self.indexes]
+        else:
+            futures = [self.executor.submit(contextvars.copy_context().run,
+                                            index.search, query, k, where)
+                       for index in self.indexes]
+            per_shard = [future.result() for future in futures]
+        return heapq.nlargest(k, (hit for hits in per_shard for hit in hits),
+                              key=lambda hit: hit["bm25"])
+
+    def version(self):
+        """Sum of the shards' change counters (grows with every change)."""
+        return sum(index.version() for index in self.indexes)
+
+    def file_versions(self, filenames):
+        """Highest version of each file over the shards (see
+        :meth:`BM25Index.file_versions`)."""
+        filenames = list(filenames)
+        versions = dict.fromkeys(filenames, 0)
+        for index in self.indexes:
+            for name, version in index.file_versions(filenames).items():
+                versions[name] = max(versions[name], version)
+        return versions
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked id lists; return ``[(id, rrf_score)]`` best first."""
+    scores = Counter()
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] += 1.0 / (k + rank)
+    return scores.most_common()
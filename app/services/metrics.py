@@ -0,0 +1,176 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds: sub-millisecond index lookups up to slow
+# OCR / generation calls.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Per-request stage timings for the X-Timing header (see ``collect``).
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, values):
+        if len(values) != len(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}")
+        return tuple(str(v) for v in values)
+
+    def _fmt(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        inner = ",".join(
+            '{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"'))
+            for k, v in pairs
+        )
+        return "{" + inner + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{self._fmt(k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-1] += value
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = []
+        for key, row in items:
+            total = 0
+            for bound, n in zip(self.buckets + ("+Inf",), row[:-1]):
+                total += n
+                le = bound if isinstance(bound, str) else repr(float(bound))
+                lines.append(f"{self.name}_bucket"
+                             f"{self._fmt(key, [('le', le)])} {total}")
+            lines.append(f"{self.name}_sum{self._fmt(key)} {row[-1]}")
+            lines.append(f"{self.name}_count{self._fmt(key)} {total}")
+        return lines
+
+
+class Registry:
+    """Process-wide set of metrics rendered in the Prometheus text format.
+
+    Kept dependency-free on purpose: observing a value is a bisect and a
+    dict update under a lock, cheap enough for the retrieval hot path.
+    With several gunicorn workers every process exposes its own values.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "rag_stage_seconds", "Time spent in each pipeline stage.", ["stage"],
+))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "rag_http_request_seconds", "HTTP request latency.",
+    ["endpoint", "method", "status"],
+))
+TOKENS = REGISTRY.register(Counter(
+    "rag_llm_tokens_total", "Chat model tokens (in = prompt, out = answer).",
+    ["direction"],
+))
+CHUNKS_INDEXED = REGISTRY.register(Counter(
+    "rag_chunks_indexed_total", "Chunks written to the vector store.",
+))
+CACHE = REGISTRY.register(Counter(
+    "rag_cache_requests_total", "Cache lookups by cache and result.",
+    ["cache", "result"],
+))
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as pipeline *stage*."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def collect():
+    """Start recording stage timings for the current request.
+
+    Returns the dict that :func:`span` adds seconds to.  Work handed to a
+    thread pool is included when it runs in a copy of the caller's context
+    (``contextvars.copy_context().run``).
+    """
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def timing_header(timings):
+    """Format *timings* like ``Server-Timing``: ``stage;dur=<ms>, ...``."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}"
+                     for stage, seconds in timings.items())
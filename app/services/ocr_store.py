@@ -0,0 +1,174 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_READ_SIZE = 1 << 20  # 1 MiB
+
+
+def save_hashed(stream, dest):
+    """Copy *stream* to *dest* chunk by chunk and return its sha256 hex digest.
+
+    The upload is never held in memory as a whole.
+    """
+    digest = hashlib.sha256()
+    dest = Path(dest)
+    tmp = dest.with_name(dest.name + ".part")
+    with tmp.open("wb") as fp:
+        while True:
+            block = stream.read(_READ_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            fp.write(block)
+    os.replace(tmp, dest)
+    return digest.hexdigest()
+
+
+def save_upload(stream, root, suffix=".pdf"):
+    """Store *stream* as ``<root>/<sha256><suffix>``; return ``(digest,
+    path)``.
+
+    Uploads are content-addressed, so a later upload under the same file
+    name never replaces the bytes an earlier, still queued job will read.
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    tmp = root / f".{uuid.uuid4().hex}.upload"
+    digest = save_hashed(stream, tmp)
+    dest = root / (digest + suffix)
+    os.replace(tmp, dest)
+    return digest, dest
+
+
+def save_base64(encoded, root, suffix=""):
+    """Decode base64 *encoded* into a content-addressed file under *root*.
+
+    The payload is decoded and hashed block by block into a temporary file,
+    which is then moved to ``<root>/<sha256[:2]>/<sha256><suffix>``; an
+    identical image already stored is kept as is.  Returns that path.
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    tmp = root / f".{uuid.uuid4().hex}.part"
+    step = _READ_SIZE // 3 * 4  # whole base64 quanta
+    with tmp.open("wb") as fp:
+        for start in range(0, len(encoded), step):
+            block = base64.b64decode(encoded[start:start + step])
+            digest.update(block)
+            fp.write(block)
+    name = digest.hexdigest()
+    dest = root / name[:2] / (name + suffix)
+    if dest.exists():
+        tmp.unlink()
+    else:
+        dest.parent.mkdir(exist_ok=True)
+        os.replace(tmp, dest)
+    return dest
+
+
+def _write_json(path, data):
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    with tmp.open("w", encoding="utf-8") as fp:
+        json.dump(data, fp, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+class OCRStore:
+    """Local store of OCR results keyed by the PDF's content hash.
+
+    Layout::
+
+        <root>/<digest[:2]>/<digest>/ocr.jsonl       # one OCR page per line
+        <root>/<digest[:2]>/<digest>/manifest.json   # where it was indexed
+
+    The manifest records, per ``(collection, filename)``, the chunker
+    parameters and chunk count used, so an identical upload can be reported
+    as already indexed and a parameter change only re-chunks the cached OCR.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _dir(self, digest):
+        return self.root / digest[:2] / digest
+
+    # -- OCR -------------------------------------------------------------
+    def has_ocr(self, digest):
+        folder = self._dir(digest)
+        return ((folder / "ocr.jsonl").is_file()
+                or (folder / "ocr.json").is_file())
+
+    def iter_pages(self, digest):
+        """Stream the cached ``{"index", "markdown"}`` pages of *digest*."""
+        folder = self._dir(digest)
+        path = folder / "ocr.jsonl"
+        if path.is_file():
+            with path.open("r", encoding="utf-8") as fp:
+                for line in fp:
+                    if line.strip():
+                        yield json.loads(line)
+            return
+        # results stored before pages were kept as JSON lines
+        with (folder / "ocr.json").open("r", encoding="utf-8") as fp:
+            yield from json.load(fp).get("pages", [])
+
+    def save_pages(self, digest, pages):
+        """Write *pages* (any iterable) one per line; return the page count."""
+        folder = self._dir(digest)
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder / "ocr.jsonl"
+        # unique: the same PDF may be OCR'd under two file names at once
+        tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        n_pages = 0
+        with tmp.open("w", encoding="utf-8") as fp:
+            for page in pages:
+                fp.write(json.dumps(page, ensure_ascii=False))
+                fp.write("\n")
+                n_pages += 1
+        os.replace(tmp, path)
+        return n_pages
+
+    # -- index bookkeeping ----------------------------------------------
+    def manifest(self, digest):
+        path = self._dir(digest) / "manifest.json"
+        if not path.is_file():
+            return {"indexed": {}}
+        with path.open("r", encoding="utf-8") as fp:
+            return json.load(fp)
+
+    def indexed_entry(self, digest, collection_name, filename):
+        key = f"{collection_name}/{filename}"
+        return self.manifest(digest)["indexed"].get(key)
+
+    def mark_indexed(self, digest, collection_name, filename,
+                     chunk_params, n_chunks):
+        folder = self._dir(digest)
+        folder.mkdir(parents=True, exist_ok=True)
+        manifest = self.manifest(digest)
+        manifest["indexed"][f"{collection_name}/{filename}"] = {
+            "chunk_params": chunk_params,
+            "n_chunks": n_chunks,
+        }
+        _write_json(folder / "manifest.json", manifest)
+
+    def forget(self, digest, collection_name, filename):
+        """Drop the index entry of *filename*; True if *digest* is gone.
+
+        Once no entry is left the OCR pages are deleted with the manifest.
+        """
+        folder = self._dir(digest)
+        manifest = self.manifest(digest)
+        manifest["indexed"].pop(f"{collection_name}/{filename}", None)
+        if manifest["indexed"]:
+            _write_json(folder / "manifest.json", manifest)
+            return False
+        shutil.rmtree(folder, ignore_errors=True)
+        return True
@@ -0,0 +1,136 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Shortest suffix/prefix match treated as chunk overlap rather than a
+# coincidence (a shared full stop or heading marker).
+MIN_OVERLAP_CHARS = 16
+# Separator between adjacent chunks that did not overlap.
+JOIN_SEPARATOR = "\n\n"
+
+
+def mmr(relevance, vectors, k, lambda_mult=0.7):
+    """Maximal marginal relevance: pick *k* diverse, relevant candidates.
+
+    Parameters
+    ----------
+    relevance
+        One score per candidate, higher is better (any scale).
+    vectors
+        ``(n, dim)`` candidate embeddings; rows are normalised here, so
+        zero rows (unknown vectors) never count as redundant.
+    k
+        Number of candidates to select.
+    lambda_mult
+        Trade-off between relevance (1.0 = plain top-k) and diversity.
+
+    Returns
+    -------
+    list of candidate positions, in selection order.
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    n = len(relevance)
+    if n <= k or lambda_mult >= 1.0:
+        return [int(i) for i in np.argsort(-relevance, kind="stable")[:k]]
+
+    spread = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / (spread or 1.0)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms > 0, norms, 1.0)
+    similarity = vectors @ vectors.T
+
+    selected = []
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for _ in range(k):
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        gain = lambda_mult * relevance - (1.0 - lambda_mult) * penalty
+        gain[~available] = -np.inf
+        best = int(np.argmax(gain))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
+
+
+def merge_adjacent(chunks):
+    """Merge chunks that follow each other on the same page.
+
+    Chunks with the same ``filename`` and ``page_index`` and consecutive
+    ``chunk_index`` values are joined into one passage, dropping the text
+    the splitter repeated at the boundary (``CHUNK_OVERLAP``).  A merged
+    passage takes the place of its best-ranked part, keeps its lowest
+    ``score``, the first ``id``/``chunk_index``, and lists all parts under
+    ``chunk_ids``.  Other chunks are returned unchanged, in order.
+    """
+    runs = {}
+    for position, chunk in enumerate(chunks):
+        key = (chunk.get("filename"), chunk.get("page_index"))
+        if chunk.get("chunk_index") is None or None in key:
+            continue
+        runs.setdefault(key, []).append(position)
+
+    replaced = {}  # position of a run's best part -> merged passage
+    dropped = set()
+    for positions in runs.values():
+        if len(positions) < 2:
+            continue
+        positions.sort(key=lambda p: chunks[p]["chunk_index"])
+        run = [positions[0]]
+        for position in positions[1:] + [None]:
+            prev = chunks[run[-1]]["chunk_index"]
+            if (position is not None
+                    and chunks[position]["chunk_index"] == prev + 1):
+                run.append(position)
+                continue
+            if len(run) > 1:
+                head = min(run)
+                replaced[head] = _merge([chunks[p] for p in run])
+                dropped.update(p for p in run if p != head)
+            if position is not None:
+                run = [position]
+
+    if replaced:
+        logger.debug("Merged %s chunks into %s passages",
+                     len(replaced) + len(dropped), len(replaced))
+    return [replaced.get(position, chunk)
+            for position, chunk in enumerate(chunks)
+            if position not in dropped]
+
+
+def _merge(parts):
+    """One passage from chunks already sorted by ``chunk_index``."""
+    text = parts[0]["text"]
+    for part in parts[1:]:
+        overlap = _overlap(text, part["text"])
+        if overlap:
+            text += part["text"][overlap:]
+        else:
+            text += JOIN_SEPARATOR + part["text"]
+
+    tokens = [part.get("tokens") for part in parts]
+    if None in tokens:
+        estimate = None  # counted when the context is built
+    else:
+        chars = sum(len(part["text"]) for part in parts) or 1
+        estimate = max(1, round(sum(tokens) * len(text) / chars))
+
+    return {
+        **parts[0],
+        "text": text,
+        "tokens": estimate,
+        "score": min(part["score"] for part in parts),
+        "chunk_ids": [part["id"] for part in parts],
+    }
+
+
+def _overlap(left, right):
+    """Length of the longest suffix of *left* that starts *right*."""
+    window = left[-len(right):]
+    for start in range(len(window) - MIN_OVERLAP_CHARS + 1):
+        if right.startswith(window[start:]):
+            return len(window) - start
+    return 0
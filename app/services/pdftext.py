@@ -0,0 +1,105 @@
+import logging
+import re
+import unicodedata
+
+from app.services.metrics import span
+
+logger = logging.getLogger(__name__)
+
+# A page whose text layer has fewer visible characters than this is treated
+# as image-only (scanned) if it carries any images, blank otherwise.
+MIN_PAGE_CHARS = 40
+# Share of characters that must be letters, digits, punctuation or spaces.
+MIN_CLEAN_RATIO = 0.85
+# Share of unmapped glyphs (pdfminer's "(cid:N)") that marks a broken font.
+MAX_CID_RATIO = 0.02
+
+_CID_RE = re.compile(r"\(cid:\d+\)")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+def text_pages(file_path):
+    """Read the embedded text layer of every page of a PDF.
+
+    Returns a list of ``{"index", "text", "image_cover"}`` dicts, where
+    *image_cover* is the fraction of the page area covered by images.
+    Raises whatever pdfminer raises on unreadable or encrypted files.
+    """
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LAParams
+
+    pages = []
+    with span("text_extract"):
+        for index, layout in enumerate(extract_pages(str(file_path),
+                                                     laparams=LAParams())):
+            pages.append(_read_page(index, layout))
+    return pages
+
+
+def page_count(file_path):
+    """Number of pages declared by the PDF, or *None* if it cannot be read.
+
+    Only the page tree root is parsed, so this is cheap even for large files.
+    """
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdftypes import resolve1
+
+    try:
+        with open(file_path, "rb") as fh:
+            document = PDFDocument(PDFParser(fh))
+            return int(resolve1(document.catalog["Pages"])["Count"])
+    except Exception as exc:
+        logger.debug("Could not count pages of %s: %r", file_path, exc)
+        return None
+
+
+def _read_page(index, layout):
+    from pdfminer.layout import LTFigure, LTImage, LTTextContainer
+
+    parts, image_area = [], 0.0
+    stack = list(layout)
+    while stack:
+        item = stack.pop()
+        if isinstance(item, LTTextContainer):
+            parts.append((-item.y1, item.x0, item.get_text()))
+        elif isinstance(item, LTImage):
+            image_area += item.width * item.height
+        elif isinstance(item, LTFigure):
+            stack.extend(item)
+
+    # top-to-bottom, left-to-right, one blank line between text boxes
+    parts.sort(key=lambda p: (p[0], p[1]))
+    text = "\n\n".join(p[2].strip() for p in parts if p[2].strip())
+    page_area = layout.width * layout.height or 1.0
+    return {
+        "index": index,
+        "text": _BLANK_LINES_RE.sub("\n\n", text),
+        "image_cover": min(image_area / page_area, 1.0),
+    }
+
+
+def needs_ocr(page):
+    """True if *page* (from :func:`text_pages`) should go through OCR.
+
+    That is the case for scanned pages (little or no text but images) and
+    for text layers that did not decode to readable characters: unmapped
+    glyphs, replacement characters or private-use code points.
+    """
+    text, n_cids = _CID_RE.subn("", page["text"])
+    visible = [c for c in text if not c.isspace()]
+    if len(visible) + n_cids < MIN_PAGE_CHARS:
+        return page["image_cover"] > 0
+    if n_cids > MAX_CID_RATIO * (len(visible) + n_cids):
+        return True
+    clean = sum(1 for c in visible if _is_clean(c))
+    return clean / len(visible) < MIN_CLEAN_RATIO
+
+
+def _is_clean(char):
+    if char == "\ufffd":
+        return False
+    category = unicodedata.category(char)
+    # letters, marks, numbers, punctuation, symbols – not control (Cc),
+    # format (Cf), private use (Co) or unassigned (Cn) code points
+    return category[0] in "LMNPS"
@@ -1,49 +1,41 @@
+import contextvars
+import json
 import logging
-import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
 
-import chromadb
-import openai
-from langchain_openai import OpenAIEmbeddings
+import numpy as np
 
 from app.core.config import settings
+from app.services.context import build_context, count_tokens
+from app.services.lexical import reciprocal_rank_fusion
+from app.services.metrics import TOKENS, span
+from app.services.passages import merge_adjacent, mmr
+from app.services.vectorstore import ChromaStore, metadata_filter
 
-try:
-    import tiktoken
-except ModuleNotFoundError:  # pragma: no cover
-    tiktoken = None
-
-# ---------------------------------------------------------------------------
-# Configuration
-# ---------------------------------------------------------------------------
-try:
-    _OPENAI_KEY: Optional[str] = getattr(settings, "OPENAI_API_KEY", None)
-except (ImportError, AttributeError):
-    _OPENAI_KEY = None
-
-_OPENAI_KEY = _OPENAI_KEY or os.getenv("OPENAI_API_KEY")
-if not _OPENAI_KEY:
-    raise RuntimeError("Missing OpenAI API key – set OPENAI_API_KEY or populate app.core.config.settings")  # noqa: E501
-
-openai.api_key = _OPENAI_KEY
-
+logger = logging.getLogger(__name__)
 
-try:
-    _ROUTER_API_KEY: Optional[str] = getattr(settings, "ROUTER_API_KEY", None)
-except (ImportError, AttributeError):
-    _ROUTER_API_KEY = None
+_DEFAULT_MAX_TOKENS_CONTEXT = 10000  # plenty of room for prompt and answer
+_RRF_K = 60
 
-_ROUTER_API_KEY = _ROUTER_API_KEY or os.getenv("ROUTER_API_KEY")
-if not _ROUTER_API_KEY:
-    raise RuntimeError("Missing Router API key (Requesty) – set ROUTER_API_KEY or populate app.core.config.settings")  # noqa: E501
+NO_ANSWER = "I couldn't find relevant information."
 
-logger = logging.getLogger(__name__)
+_INSTRUCTION = """
+        You are a meticulous assistant. Use the provided CONTEXT to answer the USER question.
+        If the CONTEXT is insufficient to answer confidently, say so instead of inventing information.
+        Make sure the answer to the question is properly formatted for the USER, but do not change the content of the answer (do not invent new information).
+    """  # noqa: E501
 
-_DEFAULT_MAX_TOKENS_CONTEXT = 10000  # plenty of room for prompt and answer
+_INPUT_TEMPLATE = """
+    QUESTION:\n {question}
+    CONTEXT:\n {context}
+    """
 
 
 def _get_collection(persist_dir: Path | str, collection_name: str):
+    import chromadb
+
     client = chromadb.PersistentClient(path=str(persist_dir))
     try:
         return client.get_collection(name=collection_name)
@@ -54,62 +46,357 @@ def _get_collection(persist_dir: Path | str, collection_name: str):
         ) from exc
 
 
+def _source(chunk_id, text, meta, score):
+    return {
+        "id": chunk_id,
+        "text": text,
+        "filename": meta.get("filename"),
+        "page_index": meta.get("page_index"),
+        "chunk_index": meta.get("chunk_index"),
+        "tokens": meta.get("tokens"),
+        "score": score
+    }
+
+
+def _filter(filters):
+    """``(where, filenames)`` for a *filters* dict.
+
+    *filters* takes the keyword arguments of
+    :func:`~app.services.vectorstore.metadata_filter`; *filenames* lets a
+    sharded service skip the shards that cannot match.
+    """
+    filters = filters or {}
+    filenames = filters.get("filename")
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    return metadata_filter(**filters), filenames
+
+
+def _vector_search(question, collection, embeddings_model, top_k,
+                   where=None):
+    """``(sources, vectors)``: the hits and ``{id: stored vector}``."""
+    with span("embed_query"):
+        q_vector = embeddings_model.embed_query(question)
+
+    with span("vector_query"):
+        (hits,) = collection.query([q_vector], top_k, where=where,
+                                   include_vectors=_mmr_enabled())
+    return _vector_sources(hits)
+
+
+def _vector_sources(hits):
+    return ([_source(h["id"], h["text"], h["metadata"], h["distance"])
+             for h in hits],
+            {h["id"]: h["vector"] for h in hits if "vector" in h})
+
+
 def _similar_chunks(
     question,
     collection,
     embeddings_model,
     top_k=4,
+    lexical=None,
+    mode="hybrid",
+    executor=None,
+    where=None,
 ):
-    """Return *top_k* most similar chunks from Chroma (with score)."""
-    q_vector = embeddings_model.embed_query(question)
+    """Return the *top_k* best chunks for *question* (with score).
+
+    Parameters
+    ----------
+    lexical
+        :class:`~app.services.lexical.BM25Index` of the collection; without
+        it every mode falls back to ``"vector"``.
+    mode
+        ``"vector"``: dense similarity from Chroma.
+        ``"lexical"``: BM25 only – no embedding call at all, best for part
+        numbers / error codes.
+        ``"hybrid"``: both searches run in parallel over a ``2 * top_k``
+        candidate pool and are merged with reciprocal rank fusion.
+    executor
+        Pool used to run the vector leg next to the lexical one.
+    where
+        Chroma-style metadata filter applied by both searches.
+
+    Every mode retrieves a pool of candidates that :func:`_select` narrows
+    down to *top_k* diverse chunks, merging neighbours of the same page.
+
+    ``score`` is always "lower is better": the Chroma distance in vector
+    mode, ``1 - normalised BM25`` / ``1 - normalised RRF`` otherwise.
+    """
+    pool = _pool_size(top_k)
+    if lexical is None or mode == "vector":
+        hits, vectors = _vector_search(question, collection,
+                                       embeddings_model, pool, where)
+        return _select(hits, vectors, collection, top_k)
+
+    if mode == "lexical":
+        hits = _lexical_search(question, lexical, pool, where)
+        return _select(hits, {}, collection, top_k)
+
+    n_candidates = max(2 * top_k, pool)
+    if executor is not None:
+        # run in a copy of this context so its spans land in X-Timing
+        vector_leg = executor.submit(contextvars.copy_context().run,
+                                     _vector_search, question, collection,
+                                     embeddings_model, n_candidates, where)
+        lexical_hits = lexical.search(question, k=n_candidates, where=where)
+        vector_hits, vectors = vector_leg.result()
+    else:
+        lexical_hits = lexical.search(question, k=n_candidates, where=where)
+        vector_hits, vectors = _vector_search(question, collection,
+                                              embeddings_model, n_candidates,
+                                              where)
+    return _select(_fuse(vector_hits, lexical_hits, pool), vectors,
+                   collection, top_k)
+
+
+def _mmr_enabled():
+    return settings.MMR_LAMBDA < 1.0
+
+
+def _pool_size(top_k):
+    """Candidates to retrieve for *top_k* chunks (more when MMR is on)."""
+    if not _mmr_enabled():
+        return top_k
+    return max(top_k, settings.MMR_FETCH_K)
+
+
+def _select(candidates, vectors, collection, top_k):
+    """Narrow ranked *candidates* down to the chunks sent to the model.
+
+    With ``MMR_LAMBDA < 1`` the *top_k* are re-selected by maximal marginal
+    relevance over the vectors of the whole pool, so near-duplicate chunks
+    (the splitter's overlap, repeated boilerplate) give way to other
+    relevant ones.  *vectors* maps ids to the vectors the vector query
+    returned with its hits; only candidates it did not return (BM25 hits)
+    are looked up in *collection*, and candidates without a stored vector
+    are dropped.  With ``MERGE_ADJACENT_CHUNKS`` consecutive chunks of a
+    page are then joined into one passage without the repeated overlap.
+    """
+    chunks = candidates[:top_k]
+    if len(candidates) > top_k:
+        with span("mmr"):
+            missing = [c["id"] for c in candidates if c["id"] not in vectors]
+            if missing:
+                vectors = {**collection.vectors(missing), **vectors}
+            candidates = [c for c in candidates if c["id"] in vectors]
+            chunks = candidates
+            if len(candidates) > top_k:
+                order = mmr([-c["score"] for c in candidates],
+                            np.stack([vectors[c["id"]] for c in candidates]),
+                            top_k, settings.MMR_LAMBDA)
+                chunks = [candidates[i] for i in order]
+    if settings.MERGE_ADJACENT_CHUNKS:
+        chunks = merge_adjacent(chunks)
+    return chunks
+
+
+def _lexical_search(question, lexical, top_k, where=None):
+    hits = lexical.search(question, k=top_k, where=where)
+    best = hits[0]["bm25"] if hits else 1.0
+    return [_source(h["id"], h["text"], h["metadata"],
+                    1.0 - h["bm25"] / best) for h in hits]
+
+
+def _fuse(vector_hits, lexical_hits, top_k):
+    """Merge vector sources and raw BM25 hits with reciprocal rank fusion."""
+    by_id = {h["id"]: _source(h["id"], h["text"], h["metadata"], None)
+             for h in lexical_hits}
+    by_id.update((c["id"], c) for c in vector_hits)
+    fused = reciprocal_rank_fusion(
+        [[c["id"] for c in vector_hits], [h["id"] for h in lexical_hits]],
+        k=_RRF_K,
+    )
+    best_possible = 2.0 / (_RRF_K + 1)
+    return [{**by_id[cid], "score": 1.0 - rrf / best_possible}
+            for cid, rrf in fused[:top_k]]
+
+
+def _batch_chunks(questions, modes, collection, embeddings_model, top_k=4,
+                  lexical=None, where=None):
+    """:func:`_similar_chunks` for many questions at once.
+
+    Every question that needs a vector leg is embedded in a single
+    ``embed_documents`` call (the embedding cache is shared with
+    ``embed_query``) and searched with one multi-query
+    ``collection.query``; the BM25 legs stay per question.  *where*
+    applies to all of them, and every result goes through :func:`_select`.
 
-    res = collection.query(
-        query_embeddings=[q_vector],
-        n_results=top_k,
-        include=["documents", "metadatas", "distances"],
+    Returns one chunk list per question, in order.
+    """
+    if lexical is None:
+        modes = ["vector"] * len(questions)
+    dense = [i for i, mode in enumerate(modes) if mode != "lexical"]
+    results = [None] * len(questions)
+    pool = _pool_size(top_k)
+    fused_pool = max(2 * top_k, pool)
+
+    if dense:
+        with span("embed_query"):
+            vectors = embeddings_model.embed_documents(
+                [questions[i] for i in dense]
+            )
+        n_candidates = fused_pool if "hybrid" in modes else pool
+        with span("vector_query"):
+            rows = collection.query(vectors, n_candidates, where=where,
+                                    include_vectors=_mmr_enabled())
+        for i, hits in zip(dense, rows):
+            vector_hits, found = _vector_sources(hits)
+            if modes[i] == "vector":
+                candidates = vector_hits[:pool]
+            else:
+                lexical_hits = lexical.search(questions[i], k=fused_pool,
+                                              where=where)
+                candidates = _fuse(vector_hits[:fused_pool], lexical_hits,
+                                   pool)
+            results[i] = _select(candidates, found, collection, top_k)
+    for i, mode in enumerate(modes):
+        if mode == "lexical":
+            results[i] = _select(_lexical_search(questions[i], lexical, pool,
+                                                 where), {}, collection, top_k)
+    return results
+
+
+def _build_context(question, chunks, max_tokens_context):
+    """Build the context block so the whole prompt fits *max_tokens_context*.
+
+    Only the instruction and the question template are tokenized here;
+    chunk sizes come from the ``tokens`` metadata stored at ingest.
+    Returns ``(context, prompt_tokens)``.
+    """
+    prompt_tokens = count_tokens(_INSTRUCTION) + count_tokens(
+        _INPUT_TEMPLATE.format(question=question, context="")
+    )
+    context, context_tokens, _ = build_context(
+        chunks, max_tokens_context - prompt_tokens
     )
-    docs = res["documents"][0]
-    mets = res["metadatas"][0]
-    dists = res["distances"][0]
-
-    out = []
-
-    for text, meta, dist in zip(docs, mets, dists):
-        out.append({
-            "text": text,
-            "filename": meta.get("filename"),
-            "page_index": meta.get("page_index"),
-            "chunk_index": meta.get("chunk_index"),
-            "score": dist
-        })
-    return out
-
-
-def _encode_len(text, model="gpt-4o-mini"):
-    if tiktoken is None:
-        return len(text.split())
-    enc = tiktoken.encoding_for_model(model)
-    return len(enc.encode(text))
-
-
-def _build_context(chunks, max_tokens_context):
-    """Construct OpenAI chat messages with context trimmed to *max_tokens_context*."""  # noqa: E501
-    # Merge chunk texts separated by two newlines, order by
-    # proximity (ascending score)
-    # Lower distance => higher similarity, so sort ascending.
-    chunks_sorted = sorted(chunks, key=lambda c: c["score"])
-    context_texts = []
-    total_tokens = 0
-    for ch in chunks_sorted:
-        token_len = _encode_len(ch["text"])
-        if total_tokens + token_len > max_tokens_context:
-            break
-        context_texts.append(ch["text"])
-        total_tokens += token_len
-
-    context_block = "\n---\n".join(context_texts)
-
-    return context_block
+    return context, prompt_tokens + context_tokens
+
+
+def _clients(persist_dir, collection_name, service, tenant=None,
+             filenames=None):
+    """Collection, embeddings, chat client, chat model, BM25 index, pool.
+
+    With a sharded *service* the collection and BM25 index search every
+    shard of *tenant* that may hold *filenames*.  Both are ``None`` when
+    nothing has been ingested for *tenant* yet: tenant names come from the
+    caller, and an empty namespace simply has nothing relevant.
+    """
+    if service is not None:
+        try:
+            collection, lexical = service.search_handles(tenant, filenames,
+                                                         collection_name)
+        except RuntimeError as exc:
+            logger.info("Nothing to search: %s", exc)
+            collection = lexical = None
+        return (collection, service.embeddings, service.chat,
+                service.chat_model, lexical, service.pool)
+    if tenant is not None:
+        raise ValueError("tenants need a RAGService")
+    import openai
+    from langchain_openai import OpenAIEmbeddings
+
+    router_key = settings.require("ROUTER_API_KEY")
+    collection = ChromaStore(_get_collection(persist_dir, collection_name))
+    embeddings = OpenAIEmbeddings(
+        model="text-embedding-3-small",
+        openai_api_key=settings.require("OPENAI_API_KEY"),
+        request_timeout=settings.EMBEDDING_TIMEOUT,
+    )
+    client = openai.OpenAI(
+        api_key=router_key,
+        base_url="https://router.requesty.ai/v1",
+        default_headers={"Authorization": f"Bearer {router_key}"},
+        timeout=settings.CHAT_TIMEOUT,
+    )
+    return collection, embeddings, client, "openai/gpt-4.1-nano", None, None
+
+
+def _messages(question, chunks, max_tokens_context, chat_model):
+    """Chat messages for *question* and the prompt's token estimate."""
+    with span("context_build"):
+        context, prompt_tokens = _build_context(question, chunks,
+                                                max_tokens_context)
+    logger.info("Querying %s with context (tokens≈%s)", chat_model,
+                prompt_tokens)
+    return [
+        {"role": "system", "content": _INSTRUCTION},
+        {"role": "user", "content": _INPUT_TEMPLATE.format(
+            question=question, context=context)},
+    ], prompt_tokens
+
+
+def _count_tokens(usage, prompt_tokens, answer):
+    """Add a completion to the token counters.
+
+    Uses the usage reported by the API, or estimates when there is none
+    (streamed responses).
+    """
+    if usage is not None:
+        TOKENS.inc("in", amount=usage.prompt_tokens)
+        TOKENS.inc("out", amount=usage.completion_tokens)
+    else:
+        TOKENS.inc("in", amount=prompt_tokens)
+        TOKENS.inc("out", amount=count_tokens(answer))
+
+
+def _cache_lookup(question, service, embeddings, lexical, retrieval,
+                  scope):
+    """``(vector, hit)`` from the service's answer cache.
+
+    *vector* is the question embedding (``None`` when the cache is off)
+    and *hit* a cached ``(answer, sources)`` or ``None``.  The embedding
+    lands in the embedding cache, so retrieval after a miss reuses it;
+    lexical-only questions are not cached since they embed nothing.
+    """
+    cache = service.answer_cache if service is not None else None
+    if cache is None or lexical is None or retrieval == "lexical":
+        return None, None
+    with span("answer_cache"):
+        vector = embeddings.embed_query(question)
+        return vector, cache.get(vector, scope, lexical.file_versions)
+
+
+def _cache_lookup_many(questions, service, embeddings, lexical, modes,
+                       scopes):
+    """:func:`_cache_lookup` for a batch, embedding every question in one
+    call; returns the lists of vectors and hits."""
+    vectors = [None] * len(questions)
+    hits = [None] * len(questions)
+    cache = service.answer_cache if service is not None else None
+    dense = [i for i, mode in enumerate(modes) if mode != "lexical"]
+    if cache is None or lexical is None or not dense:
+        return vectors, hits
+    with span("answer_cache"):
+        embedded = embeddings.embed_documents([questions[i] for i in dense])
+        for i, vector in zip(dense, embedded):
+            vectors[i] = vector
+            hits[i] = cache.get(vector, scopes[i], lexical.file_versions)
+    return vectors, hits
+
+
+def _cache_store(service, vector, scope, question, answer, chunks,
+                 versions):
+    if vector is None or not chunks or answer is None:
+        return
+    service.answer_cache.put(vector, scope, question, answer, chunks,
+                             versions)
+
+
+def _cache_scope(collection_name, tenant, retrieval, filters, top_k,
+                 max_tokens_context, chat_model):
+    """Requests whose answers may be shared: same index, search, model."""
+    return (collection_name, tenant, retrieval,
+            json.dumps(filters, sort_keys=True), top_k, max_tokens_context,
+            chat_model)
+
+
+def _file_versions(lexical, chunks):
+    """Versions of the files behind *chunks*, read right after retrieval."""
+    if lexical is None or not chunks:
+        return {}
+    return lexical.file_versions({chunk["filename"] for chunk in chunks})
 
 
 def answer_question(
@@ -117,66 +404,331 @@ def answer_question(
     persist_dir="data/chroma_db",
     collection_name="documents",
     top_k=4,
-    max_tokens_context=_DEFAULT_MAX_TOKENS_CONTEXT
+    max_tokens_context=_DEFAULT_MAX_TOKENS_CONTEXT,
+    service=None,
+    retrieval="hybrid",
+    filters=None,
+    tenant=None,
 ):
-    """Retrieve similar chunks and ask GPT‑4o to answer.
+    """Retrieve similar chunks and ask the chat model to answer.
 
-    Returns a dict with keys: `answer`, `sources`.
-    """
-    collection = _get_collection(persist_dir, collection_name)
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small",
-                                  openai_api_key=_OPENAI_KEY)
+    When *service* (a :class:`~app.services.service.RAGService`) is given its
+    pooled Chroma collection, embedding model and router client are reused;
+    otherwise throw-away clients are built for this single call.
 
-    chunks = _similar_chunks(question, collection=collection,
-                             embeddings_model=embeddings, top_k=top_k)
-    if not chunks:
-        return {
-            "answer": "I couldn't find relevant information.", "sources": []
-        }
+    *retrieval* selects the search mode (see :func:`_similar_chunks`);
+    lexical and hybrid search need the service's BM25 index.
 
-    context = _build_context(chunks, max_tokens_context)
+    *filters* (``filename``, ``page_from``, ``page_to``, ``tags``) are
+    pushed down to both searches as a metadata ``where`` clause, and
+    *tenant* selects that tenant's collections; on a sharded service a
+    filename filter only searches the shards holding those files.
 
-    logger.info("Querying GPT‑4o with context (tokens≈%s)",
-                _encode_len(context))
+    With a service whose ``answer_cache`` is enabled, a question similar
+    enough to one answered before (same scope) returns that answer and its
+    sources without retrieval or generation; ``cached`` tells which.
 
-    instruction = """
-        You are a meticulous assistant. Use the provided CONTEXT to answer the USER question.
-        If the CONTEXT is insufficient to answer confidently, say so instead of inventing information.
-        Make sure the answer to the question is properly formatted for the USER, but do not change the content of the answer (do not invent new information).
-    """  # noqa: E501
+    Upstream errors (embedding or chat API, timeouts included) propagate
+    to the caller; the app turns them into 502/503/504 responses.
 
-    input_str = f"""
-    QUESTION:\n {question}
-    CONTEXT:\n {context}
+    Returns a dict with keys: `answer`, `sources`, `cached`.
     """
+    where, filenames = _filter(filters)
+    collection, embeddings, client, chat_model, lexical, executor = _clients(
+        persist_dir, collection_name, service, tenant, filenames
+    )
+    scope = _cache_scope(collection_name, tenant, retrieval, filters, top_k,
+                         max_tokens_context, chat_model)
+    vector, hit = _cache_lookup(question, service, embeddings, lexical,
+                                retrieval, scope)
+    if hit is not None:
+        answer, sources = hit
+        return {"answer": answer, "sources": sources, "cached": True}
+
+    chunks = []
+    if collection is not None:
+        chunks = _similar_chunks(question, collection=collection,
+                                 embeddings_model=embeddings, top_k=top_k,
+                                 lexical=lexical, mode=retrieval,
+                                 executor=executor, where=where)
+    if not chunks:
+        return {"answer": NO_ANSWER, "sources": [], "cached": False}
+    versions = _file_versions(lexical, chunks)
 
     try:
-        # Initialize OpenAI client
-        client = openai.OpenAI(
-            api_key=_ROUTER_API_KEY,
-            base_url="https://router.requesty.ai/v1",
-            default_headers={"Authorization": f"Bearer {_ROUTER_API_KEY}"}
-        )
-        # Example request
+        answer = _generate(client, chat_model, question, chunks,
+                           max_tokens_context)
+    except Exception as e:
+        logger.error("Chat completion failed: %s", e)
+        raise
+
+    _cache_store(service, vector, scope, question, answer, chunks, versions)
+    return {"answer": answer, "sources": chunks, "cached": False}
+
+
+def _generate(client, chat_model, question, chunks, max_tokens_context):
+    """One chat completion for *question* over *chunks*; errors propagate."""
+    messages, prompt_tokens = _messages(question, chunks, max_tokens_context,
+                                        chat_model)
+    with span("generation"):
         response = client.chat.completions.create(
-            model="openai/gpt-4.1-nano",
-            messages=[
-                {"role": "system", "content": instruction},
-                {"role": "user", "content": input_str}
-            ]
+            model=chat_model,
+            messages=messages,
         )
-        print(response)
-        # Check if the response is successful
-        if not response.choices:
-            raise Exception("No response choices found.")
-        # Print the result
-        print(response.choices[0].message.content)
-    except openai.OpenAIError as e:
-        print(f"OpenAI API error: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+    if not response.choices:
+        raise RuntimeError("No response choices found.")
+    logger.debug("Chat completion %s: %s", response.id, response.usage)
+    answer = response.choices[0].message.content
+    _count_tokens(response.usage, prompt_tokens, answer or "")
+    return answer
 
-    return {
-        "answer": response.choices[0].message.content,
-        "sources": chunks,
-    }
+
+def answer_questions(
+    questions,
+    persist_dir="data/chroma_db",
+    collection_name="documents",
+    top_k=4,
+    max_tokens_context=_DEFAULT_MAX_TOKENS_CONTEXT,
+    service=None,
+    max_concurrency=8,
+    generate=True,
+):
+    """Answer a batch of questions.
+
+    Parameters
+    ----------
+    questions
+        List of ``(question, retrieval)`` pairs, *retrieval* being a mode
+        accepted by :func:`_similar_chunks`, or of ``(question, retrieval,
+        filters, tenant)`` tuples (see :func:`answer_question`).
+    service
+        Shared :class:`~app.services.service.RAGService`; its
+        ``generation_pool`` bounds the chat completions in flight across
+        all batches.  Without a service a private pool of
+        *max_concurrency* threads is used.
+    generate
+        ``False`` skips the chat model: only the sources are returned
+        (``answer`` is ``None``), e.g. to score retrieval on its own.
+
+    Retrieval is batched (see :func:`_batch_chunks`), once per distinct
+    ``(filters, tenant)``, and the generations run concurrently, so a batch
+    takes about as long as its slowest answer.  When generating, every
+    question is first looked up in the service's answer cache (one
+    embedding call per group) and only the misses are retrieved and
+    answered; their answers are then cached.
+
+    Returns
+    -------
+    list of dicts, in input order, each with either `answer`, `sources`
+    and `cached`, or `error`.
+    """
+    questions = [tuple(q) + (None,) * (4 - len(q)) for q in questions]
+    texts = [q[0] for q in questions]
+    groups = {}
+    for i, (_, _, filters, tenant) in enumerate(questions):
+        key = (json.dumps(filters, sort_keys=True), tenant)
+        groups.setdefault(key, []).append(i)
+
+    retrieved = [None] * len(questions)  # chunk list or the retrieval error
+    cached = {}  # index -> (answer, sources) from the answer cache
+    stores = {}  # index -> (vector, scope, versions) to cache the answer
+    client = chat_model = None
+    for (filters, tenant), indices in groups.items():
+        try:
+            where, filenames = _filter(json.loads(filters))
+            (collection, embeddings, client, chat_model, lexical,
+             _) = _clients(persist_dir, collection_name, service, tenant,
+                           filenames)
+            vectors = scopes = [None] * len(indices)
+            if generate:
+                scopes = [_cache_scope(collection_name, tenant,
+                                       questions[i][1], questions[i][2],
+                                       top_k, max_tokens_context, chat_model)
+                          for i in indices]
+                vectors, hits = _cache_lookup_many(
+                    [texts[i] for i in indices], service, embeddings,
+                    lexical, [questions[i][1] for i in indices], scopes,
+                )
+                for i, hit in zip(indices, hits):
+                    if hit is not None:
+                        cached[i] = hit
+                        retrieved[i] = hit[1]
+            misses = [miss for miss in zip(indices, vectors, scopes)
+                      if miss[0] not in cached]
+            if collection is None:
+                chunks = [[] for _ in misses]
+            else:
+                chunks = _batch_chunks([texts[i] for i, _, _ in misses],
+                                       [questions[i][1]
+                                        for i, _, _ in misses],
+                                       collection, embeddings, top_k=top_k,
+                                       lexical=lexical, where=where)
+        except Exception as exc:
+            logger.exception("Batch retrieval failed for %s questions",
+                             len(indices))
+            for i in indices:
+                if i not in cached:
+                    retrieved[i] = exc
+            continue
+        for (i, vector, scope), found in zip(misses, chunks):
+            retrieved[i] = found
+            if vector is not None:
+                stores[i] = (vector, scope, _file_versions(lexical, found))
+    if not generate:
+        return [{"error": f"retrieval failed: {found}"}
+                if isinstance(found, Exception)
+                else {"answer": None, "sources": found}
+                for found in retrieved]
+
+    owned = None
+    if service is not None:
+        pool = service.generation_pool
+    else:
+        pool = owned = ThreadPoolExecutor(max_workers=max_concurrency)
+    try:
+        futures = [
+            pool.submit(contextvars.copy_context().run, _generate, client,
+                        chat_model, question, chunks, max_tokens_context)
+            if chunks and i not in cached
+            and not isinstance(chunks, Exception) else None
+            for i, (question, chunks) in enumerate(zip(texts, retrieved))
+        ]
+        results = []
+        for i, (fut, chunks) in enumerate(zip(futures, retrieved)):
+            if isinstance(chunks, Exception):
+                results.append({"error": f"retrieval failed: {chunks}"})
+                continue
+            if i in cached:
+                answer, sources = cached[i]
+                results.append({"answer": answer, "sources": sources,
+                                "cached": True})
+                continue
+            if fut is None:
+                results.append({"answer": NO_ANSWER, "sources": [],
+                                "cached": False})
+                continue
+            try:
+                answer = fut.result()
+            except Exception as exc:
+                logger.warning("Generation failed: %s", exc)
+                results.append({"error": str(exc)})
+                continue
+            if i in stores:
+                vector, scope, versions = stores[i]
+                _cache_store(service, vector, scope, texts[i], answer,
+                             chunks, versions)
+            results.append({"answer": answer, "sources": chunks,
+                            "cached": False})
+        return results
+    finally:
+        if owned is not None:
+            owned.shutdown(wait=False)
+
+
+def stream_answer(
+    question,
+    persist_dir="data/chroma_db",
+    collection_name="documents",
+    top_k=4,
+    max_tokens_context=_DEFAULT_MAX_TOKENS_CONTEXT,
+    service=None,
+    retrieval="hybrid",
+    filters=None,
+    tenant=None,
+):
+    """Streaming variant of :func:`answer_question`.
+
+    Yields ``(event, data)`` pairs as soon as each part is available:
+
+    * ``("sources", {"sources": [...], "retrieval_ms": ...})`` once retrieval
+      has finished – before the chat model is called;
+    * ``("token", {"delta": "..."})`` for every piece of the answer;
+    * ``("done", {"answer": ..., "timings": {...}})`` at the end, where
+      ``timings`` holds ``ttfb_ms`` (first event, i.e. the sources),
+      ``ttft_ms`` (first answer token) and ``total_ms``, all measured from
+      the call.
+
+    ``sources`` and ``done`` carry ``cached``; a cached answer is sent as
+    a single token.
+
+    Errors while generating are reported as ``("error", {"detail": ...})``
+    because the sources have already been sent; errors before that
+    (retrieval) propagate.
+    """
+    import openai
+
+    start = time.perf_counter()
+
+    def elapsed():
+        return round((time.perf_counter() - start) * 1000, 1)
+
+    where, filenames = _filter(filters)
+    collection, embeddings, client, chat_model, lexical, executor = _clients(
+        persist_dir, collection_name, service, tenant, filenames
+    )
+    scope = _cache_scope(collection_name, tenant, retrieval, filters, top_k,
+                         max_tokens_context, chat_model)
+    vector, hit = _cache_lookup(question, service, embeddings, lexical,
+                                retrieval, scope)
+    if hit is not None:
+        answer, sources = hit
+        ttfb = elapsed()
+        yield "sources", {"sources": sources, "retrieval_ms": ttfb,
+                          "cached": True}
+        yield "token", {"delta": answer}
+        timings = {"ttfb_ms": ttfb, "ttft_ms": elapsed(),
+                   "total_ms": elapsed()}
+        yield "done", {"answer": answer, "timings": timings, "cached": True}
+        return
+
+    chunks = []
+    if collection is not None:
+        chunks = _similar_chunks(question, collection=collection,
+                                 embeddings_model=embeddings, top_k=top_k,
+                                 lexical=lexical, mode=retrieval,
+                                 executor=executor, where=where)
+    versions = _file_versions(lexical, chunks)
+    ttfb = elapsed()
+    yield "sources", {"sources": chunks, "retrieval_ms": ttfb,
+                      "cached": False}
+
+    parts = []
+    ttft = None
+    if not chunks:
+        parts.append(NO_ANSWER)
+        ttft = elapsed()
+        yield "token", {"delta": NO_ANSWER}
+    else:
+        messages, prompt_tokens = _messages(question, chunks,
+                                            max_tokens_context, chat_model)
+        try:
+            with span("generation"):
+                stream = client.chat.completions.create(
+                    model=chat_model, messages=messages, stream=True,
+                )
+                for event in stream:
+                    if not event.choices:
+                        continue
+                    delta = event.choices[0].delta.content
+                    if not delta:
+                        continue
+                    if ttft is None:
+                        ttft = elapsed()
+                    parts.append(delta)
+                    yield "token", {"delta": delta}
+        except openai.OpenAIError as e:
+            logger.error("OpenAI API error while streaming: %s", e)
+            yield "error", {"detail": str(e)}
+            return
+        except Exception:
+            logger.exception("Streaming the answer failed")
+            yield "error", {"detail": "Internal server error"}
+            return
+        _count_tokens(None, prompt_tokens, "".join(parts))
+        _cache_store(service, vector, scope, question, "".join(parts),
+                     chunks, versions)
+
+    timings = {"ttfb_ms": ttfb, "ttft_ms": ttft, "total_ms": elapsed()}
+    logger.info("Streamed answer: %s", timings)
+    yield "done", {"answer": "".join(parts), "timings": timings,
+                   "cached": False}
@@ -0,0 +1,545 @@
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+
+from app.core.config import require
+from app.services.answer_cache import AnswerCache
+from app.services.context import get_encoder
+from app.services.embedder import EMBEDDING_TOKENIZER, AdaptiveLimiter
+from app.services.embedding_cache import CachedEmbeddings, EmbeddingCache
+from app.services.lexical import BM25Index, ShardedLexical
+from app.services.vectorstore import (QUANTIZATIONS, ChromaStore, MmapStore,
+                                      ShardedStore, truncate)
+
+logger = logging.getLogger(__name__)
+
+
+class RAGService:
+    """Process-wide holder for the clients used by ingestion and retrieval.
+
+    One instance is created by :func:`app.main.create_app` and stored in
+    ``app.extensions["rag"]``.  It keeps the vector store handles (a single
+    Chroma client, or the memory-mapped NumPy index when
+    ``vector_backend="mmap"``), the embedding model and the router chat
+    client alive for the lifetime of the worker, so requests reuse the
+    opened index and the keep-alive HTTP connection pool instead of building
+    them from scratch.
+
+    The Chroma client, the embedding model and the chat client are only
+    built on first use (or by :meth:`warm`), so creating the service is
+    cheap and does not need credentials a replica's role never uses.
+
+    With ``shards > 1`` every document is stored in one of *shards*
+    collections ``<collection_name>__s<i>`` picked by a hash of its file
+    name, and searches fan out to all of them (see :meth:`search_handles`).
+    A tenant gets its own namespace, ``<collection_name>__t_<tenant>``,
+    sharded the same way.
+
+    *embedding_dimensions* asks the embedding model for shorter vectors,
+    and *quantization* (``"int8"`` / ``"binary"``, mmap backend only) adds
+    a compact copy of them for a first search pass that is rescored with
+    the full vectors; :meth:`reencode` converts existing collections.
+
+    All attributes are safe to share between request threads; lazy creation
+    is guarded by a lock.  Call :meth:`refresh` after anything writes to the
+    collections so the next request picks up a fresh handle.
+    """
+
+    def __init__(
+        self,
+        openai_api_key,
+        router_api_key,
+        persist_dir="data/chroma_db",
+        collection_name="documents",
+        shards=1,
+        vector_backend="chroma",
+        mmap_dir="data/mmap_index",
+        ivf_threshold=50_000,
+        ivf_n_probe=8,
+        quantization="none",
+        rescore=10,
+        lexical_dir="data/lexical",
+        retrieval_workers=16,
+        generation_concurrency=8,
+        embedding_model="text-embedding-3-small",
+        embedding_dimensions=None,
+        embedding_base_url=None,
+        embed_max_in_flight=4,
+        chat_model="openai/gpt-4.1-nano",
+        router_base_url="https://router.requesty.ai/v1",
+        max_connections=20,
+        max_keepalive=10,
+        keepalive_expiry=30.0,
+        embedding_timeout=20.0,
+        chat_timeout=60.0,
+        max_retries=2,
+        embedding_cache_path="data/embedding_cache.sqlite3",
+        embedding_cache_max_entries=500_000,
+        embedding_cache_memory_entries=10_000,
+        answer_cache_threshold=0.95,
+        answer_cache_max_entries=1024,
+        answer_cache_ttl=3600.0,
+    ):
+        self.persist_dir = str(persist_dir)
+        self.collection_name = collection_name
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        self.shards = shards
+        if vector_backend not in ("chroma", "mmap"):
+            raise ValueError(f"Unknown vector backend {vector_backend!r}")
+        self.vector_backend = vector_backend
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}")
+        if quantization != "none" and vector_backend != "mmap":
+            raise ValueError("Quantized vectors need the mmap backend")
+        self.quantization = quantization
+        self.rescore = rescore
+        self.mmap_dir = Path(mmap_dir)
+        self.ivf_threshold = ivf_threshold
+        self.ivf_n_probe = ivf_n_probe
+        self.lexical_dir = Path(lexical_dir)
+        self.embedding_model = embedding_model
+        self.embedding_dimensions = embedding_dimensions
+        self.embedding_base_url = embedding_base_url
+        self.chat_model = chat_model
+        self.router_base_url = router_base_url
+        # seconds per upstream call (per read while streaming)
+        self.embedding_timeout = embedding_timeout
+        self.chat_timeout = chat_timeout
+        self.max_retries = max_retries
+        self._openai_api_key = openai_api_key
+        self._router_api_key = router_api_key
+
+        self._lock = threading.RLock()
+        self._client = None
+        self._embeddings = None
+        self._ingest_embeddings = None
+        self._chat = None
+        self._collections = {}
+        self._lexical = {}
+
+        # runs independent retrieval legs (vector / lexical) side by side
+        self.pool = ThreadPoolExecutor(max_workers=retrieval_workers,
+                                       thread_name_prefix="retrieval")
+        # queries every shard at once (kept apart from `pool`, whose
+        # vector legs wait on it)
+        self.shard_pool = ThreadPoolExecutor(
+            max_workers=retrieval_workers, thread_name_prefix="shard",
+        ) if shards > 1 else None
+        # caps concurrent chat completions across all batch requests
+        self.generation_pool = ThreadPoolExecutor(
+            max_workers=generation_concurrency,
+            thread_name_prefix="generation",
+        )
+
+        # One pooled transport shared by every OpenAI-compatible client.
+        self._http = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
+        self.embedding_cache = EmbeddingCache(
+            embedding_cache_path,
+            max_entries=embedding_cache_max_entries,
+            memory_entries=embedding_cache_memory_entries,
+        )
+        # similar questions answered from memory (None = disabled)
+        self.answer_cache = AnswerCache(
+            threshold=answer_cache_threshold,
+            max_entries=answer_cache_max_entries,
+            ttl=answer_cache_ttl,
+        ) if answer_cache_max_entries > 0 else None
+        # shared by all ingestions so they back off together on 429s
+        self.embed_max_in_flight = embed_max_in_flight
+        self.embed_limiter = AdaptiveLimiter(embed_max_in_flight)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            openai_api_key=settings.OPENAI_API_KEY,
+            router_api_key=settings.ROUTER_API_KEY,
+            persist_dir=settings.CHROMA_DIR,
+            collection_name=settings.COLLECTION_NAME,
+            shards=settings.SHARDS,
+            vector_backend=settings.VECTOR_BACKEND,
+            mmap_dir=settings.MMAP_INDEX_DIR,
+            ivf_threshold=settings.IVF_THRESHOLD,
+            ivf_n_probe=settings.IVF_N_PROBE,
+            quantization=settings.VECTOR_QUANTIZATION,
+            rescore=settings.QUANTIZED_RESCORE,
+            lexical_dir=settings.LEXICAL_INDEX_DIR,
+            retrieval_workers=settings.RETRIEVAL_WORKERS,
+            generation_concurrency=settings.GENERATION_CONCURRENCY,
+            embedding_model=settings.EMBEDDING_MODEL,
+            embedding_dimensions=settings.EMBEDDING_DIMENSIONS,
+            embedding_base_url=settings.EMBEDDING_BASE_URL,
+            embed_max_in_flight=settings.EMBED_MAX_IN_FLIGHT,
+            chat_model=settings.CHAT_MODEL,
+            router_base_url=settings.ROUTER_BASE_URL,
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive=settings.HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            embedding_timeout=settings.EMBEDDING_TIMEOUT,
+            chat_timeout=settings.CHAT_TIMEOUT,
+            max_retries=settings.UPSTREAM_MAX_RETRIES,
+            embedding_cache_path=settings.EMBEDDING_CACHE_PATH,
+            embedding_cache_max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+            embedding_cache_memory_entries=(
+                settings.EMBEDDING_CACHE_MEMORY_ENTRIES
+            ),
+            answer_cache_threshold=settings.ANSWER_CACHE_THRESHOLD,
+            answer_cache_max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+            answer_cache_ttl=settings.ANSWER_CACHE_TTL,
+        )
+
+    # ------------------------------------------------------------------
+    # vector stores
+    # ------------------------------------------------------------------
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import chromadb
+
+                    logger.info("Opening Chroma at %s", self.persist_dir)
+                    self._client = chromadb.PersistentClient(
+                        path=self.persist_dir
+                    )
+        return self._client
+
+    @property
+    def embeddings(self):
+        """Cached OpenAI embedding model (built on first use)."""
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = self._build_embeddings(
+                        self.max_retries
+                    )
+        return self._embeddings
+
+    @property
+    def ingest_embeddings(self):
+        """Embedding model for ingestion, without client-side retries.
+
+        :func:`~app.services.embedder.embed_chunks` retries every batch
+        itself, so each 429 reaches :attr:`embed_limiter` right away and
+        ``Retry-After`` is honoured once instead of after the client's own
+        retries.
+        """
+        if self._ingest_embeddings is None:
+            with self._lock:
+                if self._ingest_embeddings is None:
+                    self._ingest_embeddings = self._build_embeddings(0)
+        return self._ingest_embeddings
+
+    def _build_embeddings(self, max_retries):
+        from langchain_openai import OpenAIEmbeddings
+
+        return CachedEmbeddings(
+            OpenAIEmbeddings(
+                model=self.embedding_model,
+                dimensions=self.embedding_dimensions,
+                openai_api_key=require(self._openai_api_key,
+                                       "OPENAI_API_KEY"),
+                openai_api_base=self.embedding_base_url,
+                request_timeout=self.embedding_timeout,
+                max_retries=max_retries,
+                http_client=self._http,
+            ),
+            self.embedding_cache,
+            model=self.embedding_key,
+        )
+
+    @property
+    def embedding_key(self):
+        """Model name plus vector size, e.g. ``text-embedding-3-small@512``.
+
+        Keys the embedding cache, so vectors of different sizes never mix.
+        """
+        if self.embedding_dimensions is None:
+            return self.embedding_model
+        return f"{self.embedding_model}@{self.embedding_dimensions}"
+
+    @property
+    def chat(self):
+        """OpenAI-compatible client of the router (built on first use)."""
+        if self._chat is None:
+            with self._lock:
+                if self._chat is None:
+                    import openai
+
+                    key = require(self._router_api_key, "ROUTER_API_KEY")
+                    self._chat = openai.OpenAI(
+                        api_key=key,
+                        base_url=self.router_base_url,
+                        default_headers={"Authorization": f"Bearer {key}"},
+                        timeout=self.chat_timeout,
+                        max_retries=self.max_retries,
+                        http_client=self._http,
+                    )
+        return self._chat
+
+    def warm(self, role="all"):
+        """Build what *role* will need before the first request asks for it.
+
+        Meant to run in a background thread once the server is up.  Failures
+        are only logged: the request that needs the missing piece reports
+        the real error.
+        """
+        steps = [("tokenizer", lambda: get_encoder(EMBEDDING_TOKENIZER)),
+                 ("embeddings", lambda: self.embeddings),
+                 ("lexical index", self.lexical)]
+        if role in ("all", "query"):
+            steps += [("chat tokenizer", get_encoder),
+                      ("chat client", lambda: self.chat),
+                      ("collection", self.search_handles)]
+        if role in ("all", "ingest"):
+            steps += [("ingest embeddings", lambda: self.ingest_embeddings),
+                      ("collection", lambda: self.collection(
+                          self.shard_names()[0], create=True
+                      ))]
+        for name, step in steps:
+            start = time.perf_counter()
+            try:
+                step()
+            except Exception as exc:
+                logger.warning("Warm-up of %s failed: %r", name, exc)
+            else:
+                logger.info("Warmed %s in %.2fs", name,
+                            time.perf_counter() - start)
+
+    def collection(self, name=None, create=False):
+        """Return the cached :class:`VectorStore` for collection *name*.
+
+        With ``create=False`` a missing collection raises ``RuntimeError``
+        (nothing has been ingested yet); missing collections are never cached
+        so a later ingestion is picked up without an explicit refresh.
+        """
+        name = name or self.collection_name
+        coll = self._collections.get(name)
+        if coll is not None:
+            return coll
+
+        with self._lock:
+            coll = self._collections.get(name)
+            if coll is not None:
+                return coll
+            if self.vector_backend == "mmap":
+                coll = self._open_mmap(name, create)
+            elif create:
+                coll = ChromaStore(
+                    self.client.get_or_create_collection(name=name)
+                )
+            else:
+                try:
+                    coll = ChromaStore(self.client.get_collection(name=name))
+                except Exception as exc:
+                    raise RuntimeError(
+                        f"Collection '{name}' not found in Chroma at "
+                        f"'{self.persist_dir}'. Have you run the embed step?"
+                    ) from exc
+            self._collections[name] = coll
+            return coll
+
+    def _open_mmap(self, name, create):
+        if not create and not MmapStore.exists(self.mmap_dir, name):
+            raise RuntimeError(
+                f"Collection '{name}' not found in '{self.mmap_dir}'. "
+                f"Have you run the embed step?"
+            )
+        return MmapStore(self.mmap_dir, name,
+                         ivf_threshold=self.ivf_threshold,
+                         n_probe=self.ivf_n_probe,
+                         quantization=self.quantization,
+                         rescore=self.rescore)
+
+    def lexical(self, name=None):
+        """Return the BM25 index maintained alongside collection *name*."""
+        name = name or self.collection_name
+        index = self._lexical.get(name)
+        if index is None:
+            with self._lock:
+                index = self._lexical.get(name)
+                if index is None:
+                    index = BM25Index(self.lexical_dir / f"{name}.sqlite3")
+                    self._lexical[name] = index
+        return index
+
+    # ------------------------------------------------------------------
+    # shards
+    # ------------------------------------------------------------------
+    def _namespace(self, tenant=None, name=None):
+        name = name or self.collection_name
+        return name if tenant is None else f"{name}__t_{tenant}"
+
+    def shard_for(self, filename, tenant=None, name=None):
+        """Name of the collection that stores *filename* (of *tenant*)."""
+        base = self._namespace(tenant, name)
+        if self.shards == 1:
+            return base
+        return f"{base}__s{_shard_index(filename, self.shards)}"
+
+    def shard_names(self, tenant=None, filenames=None, name=None):
+        """Collections a search has to look at.
+
+        All shards of the namespace, or only those holding *filenames*
+        when the search is restricted to some files.
+        """
+        base = self._namespace(tenant, name)
+        if self.shards == 1:
+            return [base]
+        if filenames:
+            indices = sorted({_shard_index(f, self.shards)
+                              for f in filenames})
+        else:
+            indices = range(self.shards)
+        return [f"{base}__s{i}" for i in indices]
+
+    def search_handles(self, tenant=None, filenames=None, name=None):
+        """``(store, lexical)`` to search, fanned out over the shards.
+
+        Shards that hold nothing yet are skipped; ``RuntimeError`` is
+        raised when none exists at all (nothing has been ingested).
+        """
+        names = self.shard_names(tenant, filenames, name)
+        if len(names) == 1:
+            return self.collection(names[0]), self.lexical(names[0])
+        found = []
+        for shard in names:
+            try:
+                found.append((shard, self.collection(shard)))
+            except RuntimeError:
+                continue
+        if not found:
+            raise RuntimeError(
+                f"No shard of '{self._namespace(tenant, name)}' found. "
+                f"Have you run the embed step?"
+            )
+        return (
+            ShardedStore([store for _, store in found], self.shard_pool),
+            ShardedLexical([self.lexical(shard) for shard, _ in found],
+                           self.shard_pool),
+        )
+
+    def collection_names(self):
+        """Every existing collection of this service: all tenants, shards."""
+        base = self.collection_name
+        if self.vector_backend == "mmap":
+            names = [path.name for path in self.mmap_dir.glob("*")
+                     if MmapStore.exists(self.mmap_dir, path.name)]
+        else:
+            names = [coll.name for coll in self.client.list_collections()]
+        return sorted(n for n in names
+                      if n == base or n.startswith(base + "__"))
+
+    def reencode(self, name, dimensions=None, quantization=None,
+                 batch=1000):
+        """Convert the stored vectors of collection *name* in place.
+
+        *dimensions* truncates them (re-normalised, like asking the model
+        for ``dimensions`` directly) and *quantization* switches the mmap
+        first-pass encoding.  Mmap indexes are rewritten under a new file
+        generation, so running workers keep serving the old one until they
+        see the new version.  A Chroma collection is copied into a new one
+        that then takes its name; it is briefly missing in between, so
+        stop the query replicas first.  Returns the number of vectors.
+        """
+        if self.vector_backend == "mmap":
+            n = self.collection(name).reencode(dimensions, quantization)
+            self.refresh()
+            return n
+        if quantization not in (None, "none"):
+            raise ValueError("Quantized vectors need the mmap backend")
+        if dimensions is None:
+            return self.collection(name).count()
+
+        old = self.client.get_collection(name)
+        new = self.client.create_collection(
+            f"reencode_{uuid.uuid4().hex[:12]}", metadata=old.metadata,
+        )
+        n = 0
+        while True:
+            res = old.get(include=["embeddings", "documents", "metadatas"],
+                          limit=batch, offset=n)
+            if not res["ids"]:
+                break
+            new.add(ids=res["ids"],
+                    embeddings=truncate(res["embeddings"], dimensions),
+                    documents=res["documents"], metadatas=res["metadatas"])
+            n += len(res["ids"])
+        self.client.delete_collection(name)
+        new.modify(name=name)
+        self.refresh()
+        logger.info("Re-encoded '%s': %s vectors, dim=%s", name, n,
+                    dimensions)
+        return n
+
+    def index_version(self, tenant=None):
+        """Change counter of everything a search of *tenant* can see."""
+        return sum(self.lexical(shard).version()
+                   for shard in self.shard_names(tenant))
+
+    def refresh(self):
+        """Drop cached Chroma handles after an ingestion wrote to them.
+
+        Memory-mapped stores notice new versions on their own and are kept.
+        """
+        with self._lock:
+            self._collections = {
+                name: coll for name, coll in self._collections.items()
+                if isinstance(coll, MmapStore)
+            }
+
+    def stats(self):
+        try:
+            vectors = self.search_handles()[0].count()
+        except RuntimeError:  # nothing ingested yet
+            vectors = 0
+        return {
+            "embedding_cache": self.embedding_cache.stats(),
+            "answer_cache": (self.answer_cache.stats()
+                             if self.answer_cache is not None else None),
+            "index": {
+                "collection": self.collection_name,
+                "shards": self.shards,
+                "backend": self.vector_backend,
+                "quantization": self.quantization,
+                "vectors": vectors,
+                "version": self.index_version(),
+            },
+            "models": {"embedding": self.embedding_key,
+                       "chat": self.chat_model},
+        }
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+        if self.shard_pool is not None:
+            self.shard_pool.shutdown(wait=False)
+        self.generation_pool.shutdown(wait=False)
+        with self._lock:
+            for coll in self._collections.values():
+                if isinstance(coll, MmapStore):
+                    coll.close()
+            self._collections.clear()
+            self._client = None
+            for index in self._lexical.values():
+                index.close()
+            self._lexical.clear()
+        self.embedding_cache.close()
+        self._http.close()
+
+
+def _shard_index(filename, shards):
+    """Stable shard of *filename* (the same in every process)."""
+    digest = hashlib.sha256(filename.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shards
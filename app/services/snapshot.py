@@ -0,0 +1,416 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT = "rag-snapshot"
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+LEXICAL_FILE = "bm25.sqlite3"
+# Rows read from (or written to) the index per call.
+BATCH = 5000
+# Attempts at exporting a collection that is being written to.
+EXPORT_ATTEMPTS = 3
+
+_SNAPSHOT_ID_RE = re.compile(r"\d{8}T\d{6}Z-[0-9a-f]{8}")
+
+
+def new_snapshot_id():
+    """Sortable id: UTC timestamp plus a random suffix."""
+    stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    return f"{stamp}-{uuid.uuid4().hex[:8]}"
+
+
+def is_snapshot_id(value):
+    return bool(_SNAPSHOT_ID_RE.fullmatch(value or ""))
+
+
+def export_snapshot(service, path, names=None):
+    """Write every collection of *service* (or *names*) to directory *path*.
+
+    A snapshot holds, per collection, one ``.npy`` file per column, rows
+    sorted by id:
+
+    * ``ids.npy`` – unicode ids;
+    * ``vectors.npy`` – ``(n, dim)`` float32;
+    * ``texts.npy`` / ``metadata.npy`` – UTF-8 bytes (metadata as JSON)
+      sliced by ``texts_offsets.npy`` / ``metadata_offsets.npy``;
+    * ``digests.npy`` – a 16-byte hash of each row's id, text and
+      metadata, to diff snapshots;
+    * ``bm25.sqlite3`` – a copy of the BM25 index, so a node bootstrapped
+      from the snapshot does not have to re-tokenize every text.
+
+    Only live rows are written, so the snapshot is compacted.  It is
+    consistent per collection: the BM25 index version is read before and
+    after, and the export is retried if an ingestion changed it meanwhile.
+    The files are written to a temporary directory next to *path* and
+    moved in place with the manifest last, so a snapshot that exists is
+    complete.  Returns the manifest.
+    """
+    path = Path(path)
+    if path.exists():
+        raise FileExistsError(f"{path} already exists")
+    names = list(names or service.collection_names())
+    tmp = path.with_name(f".{path.name}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    manifest = {
+        "format": FORMAT,
+        "format_version": FORMAT_VERSION,
+        "snapshot_id": (path.name if is_snapshot_id(path.name)
+                        else new_snapshot_id()),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "embedding_model": service.embedding_key,
+        "vector_backend": service.vector_backend,
+        "shards": service.shards,
+        "collections": {},
+    }
+    try:
+        for name in names:
+            manifest["collections"][name] = _export_collection(
+                service, name, tmp / name
+            )
+        _write_json(tmp / MANIFEST, manifest)
+        os.replace(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    logger.info("Exported snapshot %s to %s (%s)", manifest["snapshot_id"],
+                path, {n: c["count"]
+                       for n, c in manifest["collections"].items()})
+    return manifest
+
+
+def read_manifest(path):
+    """Manifest of the snapshot at *path*; ``ValueError`` if it is none."""
+    try:
+        manifest = json.loads((Path(path) / MANIFEST).read_text("utf-8"))
+    except FileNotFoundError:
+        raise ValueError(f"{path} is not a snapshot (no {MANIFEST})")
+    if manifest.get("format") != FORMAT:
+        raise ValueError(f"{path} is not a snapshot")
+    if manifest.get("format_version", 0) > FORMAT_VERSION:
+        raise ValueError(
+            f"{path} has snapshot format {manifest['format_version']}; "
+            f"this version reads up to {FORMAT_VERSION}"
+        )
+    return manifest
+
+
+def list_snapshots(directory):
+    """Manifests of the snapshots in *directory*, oldest first."""
+    found = []
+    for path in sorted(Path(directory).glob("*")):
+        if (path / MANIFEST).is_file():
+            try:
+                found.append(read_manifest(path))
+            except ValueError as exc:
+                logger.warning("Skipping %s: %s", path, exc)
+    return found
+
+
+def diff_snapshots(old, new):
+    """Per collection: ids ``added``, ``removed`` and ``changed`` from
+    snapshot *old* to *new* (both paths), plus the ``unchanged`` count.
+
+    Rows are matched by id and compared by digest, so this only reads the
+    ``ids`` and ``digests`` columns.
+    """
+    old_manifest, new_manifest = read_manifest(old), read_manifest(new)
+    out = {}
+    for name in sorted(set(old_manifest["collections"])
+                       | set(new_manifest["collections"])):
+        before = (_digests(Path(old) / name)
+                  if name in old_manifest["collections"] else {})
+        after = (_digests(Path(new) / name)
+                 if name in new_manifest["collections"] else {})
+        changed = [cid for cid in after.keys() & before.keys()
+                   if after[cid] != before[cid]]
+        out[name] = {
+            "added": sorted(after.keys() - before.keys()),
+            "removed": sorted(before.keys() - after.keys()),
+            "changed": sorted(changed),
+            "unchanged": len(after.keys() & before.keys()) - len(changed),
+        }
+    return out
+
+
+def check_snapshot(service, path):
+    """Manifest of *path*; ``ValueError`` if *service* cannot import it."""
+    manifest = read_manifest(path)
+    if manifest["embedding_model"] != service.embedding_key:
+        raise ValueError(
+            f"Snapshot vectors come from {manifest['embedding_model']}, "
+            f"this node embeds with {service.embedding_key}"
+        )
+    if manifest["shards"] != service.shards:
+        raise ValueError(f"Snapshot has {manifest['shards']} shards, "
+                         f"SHARDS is {service.shards}")
+    return manifest
+
+
+def import_snapshot(service, path, since=None, batch=BATCH):
+    """Load the snapshot at *path* into *service*'s indexes.
+
+    Without *since* every collection is matched to the snapshot by id:
+    ids the index lacks are bulk-inserted and ids the snapshot lacks are
+    deleted, so importing into an empty node or re-importing into a warm
+    one both work (chunk ids hash the chunk text, so a new text is a new
+    id).  With *since* (the path of the snapshot this node was last synced
+    to) only the rows that differ between the two snapshots are written.
+    Columns are memory-mapped, never read whole.  When the node's BM25
+    index of a collection is empty, the snapshot's copy is restored in
+    place of indexing the texts again.
+
+    Collections of the node that the snapshot lacks (a tenant whose
+    documents were all deleted) are emptied, in both modes.
+
+    The snapshot must come from the same embedding model and size and the
+    same ``SHARDS`` setting.  Returns ``{collection: {"upserted",
+    "deleted", "bm25_restored"}}``.
+    """
+    manifest = check_snapshot(service, path)
+    changes = diff_snapshots(since, path) if since is not None else None
+
+    out = {}
+    for name in service.collection_names():
+        if name not in manifest["collections"]:
+            out[name] = _empty_collection(service, name)
+            logger.info("Emptied '%s', absent from %s: %s", name, path,
+                        out[name])
+    for name in manifest["collections"]:
+        columns = _Columns(Path(path) / name)
+        store = service.collection(name, create=True)
+        lexical = service.lexical(name)
+        if changes is None:
+            live = set(store.ids())
+            wanted = [i for i, cid in enumerate(columns.ids)
+                      if cid not in live]
+            deleted = sorted(live - set(columns.ids))
+        else:
+            diff = changes[name]
+            update = set(diff["added"]) | set(diff["changed"])
+            wanted = [i for i, cid in enumerate(columns.ids)
+                      if cid in update]
+            deleted = diff["removed"]
+
+        if deleted:
+            store.delete(deleted)
+            lexical.delete(deleted)
+        restored = _restore_lexical(lexical, Path(path) / name, columns)
+        for start in range(0, len(wanted), batch):
+            rows = wanted[start:start + batch]
+            ids = [columns.ids[i] for i in rows]
+            texts = [columns.text(i) for i in rows]
+            metadatas = [columns.metadata(i) for i in rows]
+            store.upsert(ids, np.asarray(columns.vectors[rows]), texts,
+                         metadatas)
+            if not restored:
+                lexical.delete(ids)  # changed rows: re-index their text
+                lexical.add(zip(ids, texts, metadatas))
+        out[name] = {"upserted": len(wanted), "deleted": len(deleted),
+                     "bm25_restored": restored}
+        logger.info("Imported '%s' from %s: %s", name, path, out[name])
+    service.refresh()
+    return out
+
+
+# ---------------------------------------------------------------------------
+# collections
+# ---------------------------------------------------------------------------
+def _export_collection(service, name, directory):
+    store = service.collection(name)
+    lexical = service.lexical(name)
+    for attempt in range(1, EXPORT_ATTEMPTS + 1):
+        version = lexical.version()
+        shutil.rmtree(directory, ignore_errors=True)
+        directory.mkdir(parents=True)
+        info = _write_columns(store, lexical, directory)
+        lexical.backup(directory / LEXICAL_FILE)
+        if lexical.version() == version:
+            info["index_version"] = version
+            info["files"] = {p.name: p.stat().st_size
+                             for p in sorted(directory.iterdir())}
+            return info
+        logger.info("'%s' changed during export (attempt %s), retrying",
+                    name, attempt)
+    raise RuntimeError(f"'{name}' kept changing during the export; retry "
+                       f"when ingestion is idle")
+
+
+def _empty_collection(service, name):
+    store = service.collection(name)
+    deleted = sorted(store.ids())
+    if deleted:
+        store.delete(deleted)
+        service.lexical(name).delete(deleted)
+    return {"upserted": 0, "deleted": len(deleted), "bm25_restored": False}
+
+
+def _restore_lexical(lexical, directory, columns):
+    """Restore the exported BM25 index if *lexical* is empty; True if done.
+
+    Skipped when the copy does not hold exactly the exported rows (some
+    were missing from the vector index at export time).
+    """
+    source = directory / LEXICAL_FILE
+    if not source.is_file() or lexical.count():
+        return False
+    with closing(sqlite3.connect(f"file:{source}?mode=ro", uri=True)) as db:
+        rows = db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+    if rows != len(columns.ids):
+        return False
+    lexical.restore(source)
+    return True
+
+
+def _write_columns(store, lexical, directory):
+    ids = sorted(store.ids())
+    vectors = None
+    texts = _BlobWriter(directory, "texts")
+    metadata = _BlobWriter(directory, "metadata")
+    digests = np.zeros(len(ids), dtype="S16")
+    kept = []
+    for start in range(0, len(ids), BATCH):
+        part = ids[start:start + BATCH]
+        found = store.vectors(part)
+        records = lexical.records(part)
+        for cid in part:
+            if cid not in found or cid not in records:
+                logger.warning("Skipping %s: missing from the %s index", cid,
+                               "vector" if cid not in found else "BM25")
+                continue
+            vector = np.asarray(found[cid], dtype=np.float32)
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(
+                    directory / "vectors.npy", mode="w+", dtype=np.float32,
+                    shape=(len(ids), len(vector)),
+                )
+            text, meta = records[cid]
+            meta = json.dumps(meta, sort_keys=True, ensure_ascii=False)
+            vectors[len(kept)] = vector
+            digests[len(kept)] = _digest(cid, text, meta)
+            texts.append(text.encode("utf-8"))
+            metadata.append(meta.encode("utf-8"))
+            kept.append(cid)
+
+    n = len(kept)
+    dim = vectors.shape[1] if vectors is not None else 0
+    if vectors is not None:
+        vectors.flush()
+        del vectors
+        if n < len(ids):  # skipped rows: shrink to the rows written
+            full = np.load(directory / "vectors.npy", mmap_mode="r")
+            np.save(directory / "vectors.tmp.npy", full[:n])
+            del full
+            os.replace(directory / "vectors.tmp.npy",
+                       directory / "vectors.npy")
+    else:
+        np.save(directory / "vectors.npy", np.zeros((0, 0), np.float32))
+    np.save(directory / "ids.npy", np.array(kept, dtype=str))
+    np.save(directory / "digests.npy", digests[:n])
+    texts.close()
+    metadata.close()
+
+    fingerprint = hashlib.sha256()
+    for cid, digest in zip(kept, digests[:n]):
+        fingerprint.update(cid.encode("utf-8") + digest)
+    return {
+        "count": n,
+        "dimensions": dim,
+        "fingerprint": fingerprint.hexdigest(),
+    }
+
+
+def _digest(cid, text, meta):
+    """Row hash for diffs.  The vector is left out: it follows from the
+    text and the embedding model (in the manifest), while its last bits
+    change whenever a store re-normalises it."""
+    h = hashlib.blake2b(digest_size=16)
+    for part in (cid.encode("utf-8"), text.encode("utf-8"),
+                 meta.encode("utf-8")):
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.digest()
+
+
+def _digests(directory):
+    ids = np.load(directory / "ids.npy", mmap_mode="r")
+    digests = np.load(directory / "digests.npy", mmap_mode="r")
+    return dict(zip(ids.tolist(), digests.tolist()))
+
+
+class _BlobWriter:
+    """Variable-length byte strings as ``<name>.npy`` (uint8, all rows
+    concatenated) plus ``<name>_offsets.npy`` (int64, ``n + 1``).
+
+    Rows are spooled to a temporary file so memory stays flat however
+    large the collection.
+    """
+
+    def __init__(self, directory, name):
+        self.directory = Path(directory)
+        self.name = name
+        self._spool = open(self.directory / f"{name}.bin", "wb")
+        self._offsets = [0]
+
+    def append(self, data):
+        self._spool.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+
+    def close(self):
+        self._spool.close()
+        spool = self.directory / f"{self.name}.bin"
+        out = np.lib.format.open_memmap(
+            self.directory / f"{self.name}.npy", mode="w+", dtype=np.uint8,
+            shape=(self._offsets[-1],),
+        )
+        with open(spool, "rb") as fh:
+            pos = 0
+            while block := fh.read(1 << 24):
+                out[pos:pos + len(block)] = np.frombuffer(block, np.uint8)
+                pos += len(block)
+        out.flush()
+        del out
+        spool.unlink()
+        np.save(self.directory / f"{self.name}_offsets.npy",
+                np.asarray(self._offsets, dtype=np.int64))
+
+
+class _Columns:
+    """Memory-mapped columns of one exported collection."""
+
+    def __init__(self, directory):
+        def load(name):
+            return np.load(directory / f"{name}.npy", mmap_mode="r")
+
+        self.ids = load("ids").tolist()
+        self.vectors = load("vectors")
+        self._texts, self._text_offsets = load("texts"), load("texts_offsets")
+        self._meta = load("metadata")
+        self._meta_offsets = load("metadata_offsets")
+
+    def text(self, i):
+        start, end = self._text_offsets[i], self._text_offsets[i + 1]
+        return bytes(self._texts[start:end]).decode("utf-8")
+
+    def metadata(self, i):
+        start, end = self._meta_offsets[i], self._meta_offsets[i + 1]
+        return json.loads(bytes(self._meta[start:end]))
+
+
+def _write_json(path, data):
+    path.write_text(json.dumps(data, indent=2, sort_keys=True) + "\n",
+                    encoding="utf-8")
@@ -0,0 +1,909 @@
+import contextvars
+import fcntl
+import json
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Tags are stored as one boolean metadata field each (``tag_<name>: True``):
+# Chroma metadata values must be scalars.
+TAG_PREFIX = "tag_"
+
+
+def tag_key(tag):
+    return TAG_PREFIX + tag.strip().lower()
+
+
+def metadata_filter(filename=None, page_from=None, page_to=None, tags=None):
+    """Build a Chroma ``where`` clause over the metadata written at ingest.
+
+    Parameters
+    ----------
+    filename
+        One file name or a list of them.
+    page_from, page_to
+        Inclusive range of 1-based ``page_index`` values.
+    tags
+        Chunks carrying any of these tags.
+
+    Returns *None* when nothing is filtered.
+    """
+    conditions = []
+    if isinstance(filename, str):
+        conditions.append({"filename": filename})
+    elif filename:
+        conditions.append({"filename": {"$in": list(filename)}})
+    if page_from is not None:
+        conditions.append({"page_index": {"$gte": page_from}})
+    if page_to is not None:
+        conditions.append({"page_index": {"$lte": page_to}})
+    if tags:
+        by_tag = [{tag_key(tag): True} for tag in tags]
+        conditions.append(by_tag[0] if len(by_tag) == 1 else {"$or": by_tag})
+    if not conditions:
+        return None
+    # Chroma wants at least two operands in an $and
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+class SearchableStore(ABC):
+    """Read side of a vector index, used by retrieval.
+
+    Query results are lists (one per query vector) of hits shaped like
+    ``{"id", "text", "metadata", "distance"}`` – lower distance is better –
+    plus the stored ``"vector"`` when asked for with *include_vectors*.
+    *where* filters use Chroma's metadata filter syntax.
+    """
+
+    name: str
+
+    @abstractmethod
+    def ids(self, where=None, limit=None):
+        """Return the ids matching *where* (all when omitted)."""
+
+    @abstractmethod
+    def query(self, embeddings, k, where=None, include_vectors=False):
+        """Return the *k* nearest hits for every vector in *embeddings*."""
+
+    @abstractmethod
+    def count(self):
+        """Number of stored vectors."""
+
+    @abstractmethod
+    def vectors(self, ids):
+        """Return ``{id: vector}`` for the stored *ids* (missing ones left
+        out)."""
+
+
+class VectorStore(SearchableStore):
+    """Minimal vector index interface used by ingestion and retrieval."""
+
+    @abstractmethod
+    def upsert(self, ids, embeddings, documents, metadatas):
+        """Insert or replace vectors by id."""
+
+    @abstractmethod
+    def delete(self, ids):
+        """Remove vectors by id."""
+
+
+# ---------------------------------------------------------------------------
+# Chroma
+# ---------------------------------------------------------------------------
+class ChromaStore(VectorStore):
+    """:class:`VectorStore` backed by a Chroma collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.collection.upsert(ids=ids, embeddings=embeddings,
+                               documents=documents, metadatas=metadatas)
+
+    def delete(self, ids, batch=5000):
+        for start in range(0, len(ids), batch):
+            self.collection.delete(ids=ids[start:start + batch])
+
+    def ids(self, where=None, limit=None):
+        return self.collection.get(where=where, limit=limit,
+                                   include=[])["ids"]
+
+    def query(self, embeddings, k, where=None, include_vectors=False):
+        include = ["documents", "metadatas", "distances"]
+        if include_vectors:
+            include.append("embeddings")
+        res = self.collection.query(
+            query_embeddings=embeddings,
+            n_results=k,
+            where=where,
+            include=include,
+        )
+        results = [
+            [{"id": cid, "text": text, "metadata": meta, "distance": dist}
+             for cid, text, meta, dist in zip(ids, docs, metas, dists)]
+            for ids, docs, metas, dists in zip(
+                res["ids"], res["documents"], res["metadatas"],
+                res["distances"],
+            )
+        ]
+        if include_vectors:
+            for hits, vectors in zip(results, res["embeddings"]):
+                for hit, vec in zip(hits, vectors):
+                    hit["vector"] = np.asarray(vec, dtype=np.float32)
+        return results
+
+    def count(self):
+        return self.collection.count()
+
+    def vectors(self, ids):
+        if not ids:
+            return {}
+        res = self.collection.get(ids=list(ids), include=["embeddings"])
+        return {cid: np.asarray(vec, dtype=np.float32)
+                for cid, vec in zip(res["ids"], res["embeddings"])}
+
+
+# ---------------------------------------------------------------------------
+# shards
+# ---------------------------------------------------------------------------
+class ShardedStore(SearchableStore):
+    """:class:`SearchableStore` over several shard collections.
+
+    Every query is sent to all shards at once on *executor* (in turn when
+    it is *None*) and the per-shard top-k lists are merged by distance.
+    The view is read-only: writes go to the one shard chosen by the caller.
+    """
+
+    def __init__(self, stores, executor=None):
+        self.stores = list(stores)
+        self.executor = executor
+        self.name = ",".join(store.name for store in self.stores)
+
+    def _each(self, method, *args):
+        if self.executor is None or len(self.stores) == 1:
+            return [getattr(store, method)(*args) for store in self.stores]
+        # each shard runs in a copy of this context so spans reach X-Timing
+        futures = [self.executor.submit(contextvars.copy_context().run,
+                                        getattr(store, method), *args)
+                   for store in self.stores]
+        return [future.result() for future in futures]
+
+    def ids(self, where=None, limit=None):
+        found = [i for ids in self._each("ids", where, limit) for i in ids]
+        return found if limit is None else found[:limit]
+
+    def query(self, embeddings, k, where=None, include_vectors=False):
+        per_shard = self._each("query", embeddings, k, where,
+                               include_vectors)
+        return [
+            sorted((hit for hits in rows for hit in hits),
+                   key=lambda hit: hit["distance"])[:k]
+            for rows in zip(*per_shard)
+        ]
+
+    def count(self):
+        return sum(self._each("count"))
+
+    def vectors(self, ids):
+        found = {}
+        for part in self._each("vectors", list(ids)):
+            found.update(part)
+        return found
+
+
+# ---------------------------------------------------------------------------
+# NumPy memory map
+# ---------------------------------------------------------------------------
+_OPS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<",
+        "$lte": "<="}
+
+
+def where_to_sql(where):
+    """Translate a Chroma-style metadata filter into SQL over ``metadata``."""
+    clauses, params = [], []
+    for key, cond in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_to_sql(sub) for sub in cond]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append(
+                "(" + joiner.join(sql for sql, _ in parts) + ")"
+            )
+            for _, sub_params in parts:
+                params.extend(sub_params)
+            continue
+        field = "json_extract(metadata, ?)"
+        path = '$."{}"'.format(key.replace('"', '\\"'))
+        if not isinstance(cond, dict):
+            cond = {"$eq": cond}
+        for op, value in cond.items():
+            if op in ("$in", "$nin"):
+                marks = ",".join("?" * len(value))
+                neg = "NOT " if op == "$nin" else ""
+                clauses.append(f"{field} {neg}IN ({marks})")
+                params.extend([path, *value])
+            elif op in _OPS:
+                clauses.append(f"{field} {_OPS[op]} ?")
+                params.extend([path, value])
+            else:
+                raise ValueError(f"Unsupported filter operator {op!r}")
+    return " AND ".join(clauses) or "1", params
+
+
+def _normalize(mat):
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def truncate(vectors, dim):
+    """First *dim* components of *vectors*, re-normalised.
+
+    ``text-embedding-3-*`` models are trained so that this matches asking
+    the API for ``dimensions=dim`` directly.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dim is None or dim >= vectors.shape[1]:
+        return vectors
+    return _normalize(vectors[:, :dim])
+
+
+# Compact copies of the vectors scanned by the first search pass.
+QUANTIZATIONS = ("none", "int8", "binary")
+
+
+def quantize(vectors, mode):
+    """``(codes, scales)`` of unit-normalised *vectors* for *mode*.
+
+    ``int8`` keeps one byte per dimension plus a float32 scale per row;
+    ``binary`` keeps the sign bit of every dimension (packed, no scales).
+    """
+    if mode == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    if mode == "binary":
+        return np.packbits(vectors > 0, axis=1), None
+    raise ValueError(f"Unknown quantization {mode!r}")
+
+
+def _code_width(mode, dim):
+    return dim if mode == "int8" else (dim + 7) // 8
+
+
+class _View:
+    """Read-only snapshot of the mapped files for one index version."""
+
+    def __init__(self, version, n_rows, matrix, live, centroids, assign,
+                 quantization="none", codes=None, scales=None):
+        self.version = version
+        self.n_rows = n_rows
+        self.matrix = matrix
+        self.live = live
+        self.centroids = centroids
+        self.assign = assign
+        self.quantization = quantization
+        self.codes = codes
+        self.scales = scales
+
+
+class MmapStore(VectorStore):
+    """:class:`VectorStore` keeping vectors in a memory-mapped float32 matrix.
+
+    Files under ``<directory>/<name>/``::
+
+        meta.sqlite3        ids, texts, metadata, tombstones, index info
+        vectors.<gen>.f32   row-major (rows, dim) unit-normalised float32
+        codes.<gen>.<mode>  quantized copy of the vectors (int8 / binary)
+        scales.<gen>.f32    per-row int8 scale (int8 only)
+        ivf.<gen>.npz       k-means centroids (IVF mode only)
+        assign.<gen>.i32    IVF list of every row (IVF mode only)
+
+    Vectors are mapped read-only with ``np.memmap``, so every worker process
+    serving the same index shares the pages through the OS page cache
+    instead of holding its own copy.  Writers append rows and tombstone
+    replaced/deleted ones; a version counter in SQLite tells readers to remap.
+    Writes hold an ``flock`` on ``write.lock``, so writers in different
+    processes never pick the same rows.
+    Compaction writes a new generation of files and keeps the previous one
+    until the next compaction, for readers that are about to map it.
+
+    Small corpora are searched exactly with blocked matrix products.  Once
+    the live row count reaches *ivf_threshold* a k-means partitioning is
+    trained and queries only scan the *n_probe* closest lists.
+
+    With *quantization* ``"int8"`` or ``"binary"`` a compact copy of the
+    vectors is kept next to the matrix.  Queries scan the copy (4x or 32x
+    less memory to touch) for a shortlist of ``k * rescore`` rows and
+    rescore only those with the float32 vectors.  The setting applies to a
+    new index; an existing one keeps its encoding until :meth:`reencode`.
+
+    Distances are cosine distances (``1 - cos``).
+    """
+
+    _BLOCK = 32_768  # rows per matrix-product block
+    _CODE_BLOCK = 4_096  # rows per block of quantized codes
+
+    def __init__(self, directory, name, ivf_threshold=50_000, n_probe=8,
+                 quantization="none", rescore=10):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}")
+        self.name = name
+        self.dir = Path(directory) / name
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.ivf_threshold = ivf_threshold
+        self.n_probe = n_probe
+        self.rescore = rescore
+
+        self._lock = threading.RLock()
+        self._view = None
+        self._write_file = open(self.dir / "write.lock", "a")
+        self._write_depth = 0
+        self._db = sqlite3.connect(str(self.dir / "meta.sqlite3"),
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS rows (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                live INTEGER NOT NULL DEFAULT 1
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS rows_live_id
+                ON rows(id) WHERE live = 1;
+            CREATE TABLE IF NOT EXISTS info (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO info VALUES
+                ('version', 0), ('gen', 0), ('dim', 0),
+                ('ivf_gen', 0), ('ivf_rows', 0), ('quant', 0);
+            """
+        )
+        self._db.commit()
+        with self._writing(), self._db:
+            stored = QUANTIZATIONS[self._info()["quant"]]
+            if stored != quantization:
+                if self._n_rows() == 0:
+                    self._set_info(quant=QUANTIZATIONS.index(quantization))
+                else:
+                    logger.warning(
+                        "Index '%s' is stored with quantization %r, not %r;"
+                        " run the migration to re-encode it",
+                        name, stored, quantization,
+                    )
+
+    @staticmethod
+    def exists(directory, name):
+        return (Path(directory) / name / "meta.sqlite3").is_file()
+
+    # ------------------------------------------------------------------
+    # bookkeeping helpers
+    # ------------------------------------------------------------------
+    def _info(self):
+        return dict(self._db.execute("SELECT key, value FROM info"))
+
+    def _set_info(self, **values):
+        self._db.executemany("UPDATE info SET value = ? WHERE key = ?",
+                             [(v, k) for k, v in values.items()])
+
+    def _bump(self):
+        self._db.execute(
+            "UPDATE info SET value = value + 1 WHERE key = 'version'"
+        )
+
+    @contextmanager
+    def _writing(self):
+        """Hold the write lock, shared with the other processes.
+
+        New rows go to the offsets after the current row count, and their
+        vectors are written before the rows are committed, so the lock is
+        held from reading that count until the commit.  Reentrant within
+        the thread holding it.
+        """
+        with self._lock:
+            if not self._write_depth:
+                fcntl.flock(self._write_file, fcntl.LOCK_EX)
+            self._write_depth += 1
+            try:
+                yield
+            finally:
+                self._write_depth -= 1
+                if not self._write_depth:
+                    fcntl.flock(self._write_file, fcntl.LOCK_UN)
+
+    def _n_rows(self):
+        (n,) = self._db.execute(
+            "SELECT COALESCE(MAX(row) + 1, 0) FROM rows"
+        ).fetchone()
+        return n
+
+    def _vectors_path(self, gen):
+        return self.dir / f"vectors.{gen}.f32"
+
+    def _code_paths(self, gen, mode):
+        return (self.dir / f"codes.{gen}.{mode}",
+                self.dir / f"scales.{gen}.f32")
+
+    def _write_codes(self, gen, mode, start, vecs):
+        codes, scales = quantize(vecs, mode)
+        codes_path, scales_path = self._code_paths(gen, mode)
+        self._write_at(codes_path, start * codes.shape[1], codes.tobytes())
+        if scales is not None:
+            self._write_at(scales_path, start * 4, scales.tobytes())
+
+    def _remove_generation(self, gen):
+        """Delete the vector and code files of generation *gen*."""
+        for pattern in (f"vectors.{gen}.f32", f"codes.{gen}.*",
+                        f"scales.{gen}.f32"):
+            for path in self.dir.glob(pattern):
+                path.unlink(missing_ok=True)
+
+    def _ivf_paths(self, ivf_gen):
+        return (self.dir / f"ivf.{ivf_gen}.npz",
+                self.dir / f"assign.{ivf_gen}.i32")
+
+    # ------------------------------------------------------------------
+    # writes
+    # ------------------------------------------------------------------
+    def upsert(self, ids, embeddings, documents, metadatas):
+        if not ids:
+            return
+        vecs = _normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._writing(), self._db:
+            info = self._info()
+            dim = info["dim"] or vecs.shape[1]
+            if vecs.shape[1] != dim:
+                raise ValueError(
+                    f"Vector dimension {vecs.shape[1]} does not match the "
+                    f"index dimension {dim}"
+                )
+            self._tombstone(ids)
+            start = self._n_rows()
+            self._db.executemany(
+                "INSERT INTO rows (row, id, text, metadata)"
+                " VALUES (?, ?, ?, ?)",
+                [(start + i, cid, doc, json.dumps(meta))
+                 for i, (cid, doc, meta)
+                 in enumerate(zip(ids, documents, metadatas))],
+            )
+            # vector bytes land on disk before the rows become visible
+            self._write_at(self._vectors_path(info["gen"]),
+                           start * dim * 4, vecs.tobytes())
+            if info["quant"]:
+                self._write_codes(info["gen"], QUANTIZATIONS[info["quant"]],
+                                  start, vecs)
+            if info["ivf_gen"]:
+                centroids = self._load_centroids(info["ivf_gen"])
+                lists = np.argmax(vecs @ centroids.T, axis=1)
+                self._write_at(self._ivf_paths(info["ivf_gen"])[1],
+                               start * 4, lists.astype(np.int32).tobytes())
+            self._set_info(dim=dim)
+            self._bump()
+        self._maybe_train()
+
+    def delete(self, ids):
+        with self._writing(), self._db:
+            self._tombstone(list(ids))
+            self._bump()
+
+    def _tombstone(self, ids):
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            marks = ",".join("?" * len(part))
+            self._db.execute(
+                f"UPDATE rows SET live = 0 WHERE live = 1 AND id IN ({marks})",
+                part,
+            )
+
+    @staticmethod
+    def _write_at(path, offset, payload):
+        mode = "r+b" if path.exists() else "wb"
+        with path.open(mode) as fp:
+            fp.seek(offset)
+            fp.write(payload)
+
+    # ------------------------------------------------------------------
+    # reads
+    # ------------------------------------------------------------------
+    def ids(self, where=None, limit=None):
+        sql, params = where_to_sql(where or {})
+        query = f"SELECT id FROM rows WHERE live = 1 AND {sql} ORDER BY row"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        with self._lock:
+            return [r[0] for r in self._db.execute(query, params)]
+
+    def count(self):
+        with self._lock:
+            (n,) = self._db.execute(
+                "SELECT COUNT(*) FROM rows WHERE live = 1"
+            ).fetchone()
+        return n
+
+    def vectors(self, ids):
+        ids = list(ids)
+        if not ids:
+            return {}
+        view = self._current_view()
+        marks = ",".join("?" * len(ids))
+        with self._lock:
+            rows = [(cid, row) for cid, row in self._db.execute(
+                f"SELECT id, row FROM rows WHERE live = 1 AND id IN ({marks})",
+                ids,
+            ) if row < view.n_rows]
+        if not rows:
+            return {}
+        matrix = np.asarray(view.matrix[[row for _, row in rows]])
+        return {cid: vec for (cid, _), vec in zip(rows, matrix)}
+
+    def query(self, embeddings, k, where=None, include_vectors=False):
+        view = self._current_view()
+        queries = _normalize(np.asarray(embeddings, dtype=np.float32))
+        if not view.n_rows:
+            return [[] for _ in range(len(queries))]
+        if queries.shape[1] != view.matrix.shape[1]:
+            raise ValueError(
+                f"Query dimension {queries.shape[1]} does not match the "
+                f"index dimension {view.matrix.shape[1]}"
+            )
+
+        mask = view.live
+        if where:
+            mask = mask & self._where_mask(where, view.n_rows)
+
+        # hits read their vectors from the rows just ranked
+        source = view if include_vectors else None
+        results = []
+        for q in queries:
+            rows = None
+            if view.centroids is not None:
+                lists = np.argsort(-(view.centroids @ q))[:self.n_probe]
+                probe = mask & np.isin(view.assign, lists)
+                if probe.sum() >= k:
+                    rows = np.flatnonzero(probe)
+            if view.codes is None:
+                best_rows, best_sims = self._search(view, q[None, :], mask,
+                                                    rows, k)
+                results.append(self._hits(best_rows[0], best_sims[0],
+                                          source))
+            else:
+                results.append(self._hits(*self._rescore(view, q, mask, rows,
+                                                         k), source))
+        return results
+
+    def _rescore(self, view, q, mask, rows, k):
+        """Shortlist rows on the quantized codes, rank them exactly."""
+        short_rows, short_sims = self._search(view, q[None, :], mask, rows,
+                                              k * self.rescore, coarse=True)
+        # sorted rows read the matrix front to back
+        short = np.sort(short_rows[0][np.isfinite(short_sims[0])])
+        sims = np.asarray(view.matrix[short]) @ q
+        order = np.argsort(-sims)[:k]
+        return short[order], sims[order]
+
+    def _search(self, view, queries, mask, rows, k, coarse=False):
+        """Blocked brute force over all rows, or only over *rows*.
+
+        With *coarse* the quantized codes are scanned instead of the
+        float32 matrix (see :meth:`_scores`).
+        """
+        data, block_size = view.matrix, self._BLOCK
+        if coarse:
+            data, block_size = view.codes, self._CODE_BLOCK
+            if view.quantization == "binary":
+                queries = np.packbits(queries > 0, axis=1)
+        m = len(queries)
+        top_rows = np.empty((m, 0), dtype=np.int64)
+        top_sims = np.empty((m, 0), dtype=np.float32)
+        total = view.n_rows if rows is None else len(rows)
+        for start in range(0, total, block_size):
+            stop = min(start + block_size, total)
+            if rows is None:
+                block_rows = np.arange(start, stop)
+                block = data[start:stop]
+                valid = mask[start:stop]
+            else:
+                block_rows = rows[start:stop]
+                block = data[block_rows]
+                valid = np.ones(len(block_rows), dtype=bool)
+            sims = self._scores(view, queries, np.asarray(block), block_rows,
+                                coarse)
+            sims[:, ~valid] = -np.inf
+            cand_rows = np.concatenate(
+                [top_rows, np.broadcast_to(block_rows, (m, len(block_rows)))],
+                axis=1,
+            )
+            cand_sims = np.concatenate([top_sims, sims], axis=1)
+            keep = min(k, cand_sims.shape[1])
+            idx = np.argpartition(-cand_sims, keep - 1, axis=1)[:, :keep]
+            top_rows = np.take_along_axis(cand_rows, idx, axis=1)
+            top_sims = np.take_along_axis(cand_sims, idx, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        return (np.take_along_axis(top_rows, order, axis=1),
+                np.take_along_axis(top_sims, order, axis=1))
+
+    @staticmethod
+    def _scores(view, queries, block, block_rows, coarse):
+        if not coarse:
+            return queries @ block.T
+        if view.quantization == "int8":
+            return ((queries @ block.T.astype(np.float32))
+                    * view.scales[block_rows])
+        # binary: the fewer sign bits differ, the closer
+        differing = np.bitwise_count(queries[:, None, :] ^ block[None, :, :])
+        return -differing.sum(axis=2, dtype=np.int32).astype(np.float32)
+
+    def _hits(self, rows, sims, view=None):
+        """Hit dicts of *rows*, with their ``vector`` when *view* is given."""
+        keep = [(int(r), float(s)) for r, s in zip(rows, sims)
+                if np.isfinite(s)]
+        if not keep:
+            return []
+        marks = ",".join("?" * len(keep))
+        with self._lock:
+            stored = {
+                r[0]: r[1:] for r in self._db.execute(
+                    f"SELECT row, id, text, metadata FROM rows"
+                    f" WHERE row IN ({marks})", [r for r, _ in keep],
+                )
+            }
+        hits = [
+            {"id": stored[r][0], "text": stored[r][1],
+             "metadata": json.loads(stored[r][2]), "distance": 1.0 - s}
+            for r, s in keep
+        ]
+        if view is not None:
+            matrix = np.asarray(view.matrix[[r for r, _ in keep]])
+            for hit, vec in zip(hits, matrix):
+                hit["vector"] = vec
+        return hits
+
+    def _where_mask(self, where, n_rows):
+        sql, params = where_to_sql(where)
+        with self._lock:
+            rows = np.fromiter(
+                (r[0] for r in self._db.execute(
+                    f"SELECT row FROM rows WHERE live = 1 AND {sql}", params
+                )),
+                dtype=np.int64,
+            )
+        mask = np.zeros(n_rows, dtype=bool)
+        mask[rows[rows < n_rows]] = True
+        return mask
+
+    def _current_view(self):
+        with self._lock:
+            for attempt in range(1, 4):
+                try:
+                    return self._load_view()
+                except FileNotFoundError:
+                    # a rewrite in another process removed the files of
+                    # the generation just read: read the info again
+                    if attempt == 3:
+                        raise
+                    logger.debug("'%s' changed while mapping it, retrying",
+                                 self.name)
+
+    def _load_view(self):
+        # info, row count and live rows from one snapshot of the database
+        began = not self._db.in_transaction
+        if began:
+            self._db.execute("BEGIN")
+        try:
+            info = self._info()
+            view = self._view
+            if view is not None and view.version == info["version"]:
+                return view
+            n_rows = self._n_rows()
+            live_rows = np.fromiter(
+                (r[0] for r in self._db.execute(
+                    "SELECT row FROM rows WHERE live = 1"
+                )),
+                dtype=np.int64,
+            )
+        finally:
+            if began:
+                self._db.commit()
+
+        dim = info["dim"]
+        matrix = centroids = assign = None
+        if n_rows:
+            matrix = np.memmap(self._vectors_path(info["gen"]),
+                               dtype=np.float32, mode="r",
+                               shape=(n_rows, dim))
+        live = np.zeros(n_rows, dtype=bool)
+        live[live_rows] = True
+        if info["ivf_gen"] and n_rows:
+            centroids = self._load_centroids(info["ivf_gen"])
+            assign = np.memmap(self._ivf_paths(info["ivf_gen"])[1],
+                               dtype=np.int32, mode="r",
+                               shape=(n_rows,))
+        quantization = QUANTIZATIONS[info["quant"]]
+        codes = scales = None
+        if quantization != "none" and n_rows:
+            codes_path, scales_path = self._code_paths(info["gen"],
+                                                       quantization)
+            codes = np.memmap(
+                codes_path, mode="r",
+                dtype=np.int8 if quantization == "int8" else np.uint8,
+                shape=(n_rows, _code_width(quantization, dim)),
+            )
+            if quantization == "int8":
+                scales = np.memmap(scales_path, dtype=np.float32,
+                                   mode="r", shape=(n_rows,))
+        self._view = _View(info["version"], n_rows, matrix, live,
+                           centroids, assign, quantization, codes,
+                           scales)
+        return self._view
+
+    def _load_centroids(self, ivf_gen):
+        with np.load(self._ivf_paths(ivf_gen)[0]) as data:
+            return data["centroids"]
+
+    # ------------------------------------------------------------------
+    # IVF
+    # ------------------------------------------------------------------
+    def _maybe_train(self):
+        with self._lock:
+            info = self._info()
+            live = self.count()
+        trained = info["ivf_rows"]
+        if live >= self.ivf_threshold and (not trained
+                                           or live >= 4 * trained):
+            self.build_ivf()
+
+    def build_ivf(self, n_lists=None, iters=10, sample=100_000, seed=0):
+        """(Re)train the k-means partitioning and assign every row."""
+        with self._writing():
+            view = self._current_view()
+            live_rows = np.flatnonzero(view.live)
+            if not len(live_rows):
+                return
+            n_lists = n_lists or int(np.clip(np.sqrt(len(live_rows)),
+                                             16, 4096))
+            rng = np.random.default_rng(seed)
+            train_rows = np.sort(rng.choice(
+                live_rows, size=min(sample, len(live_rows)), replace=False
+            ))
+            data = np.asarray(view.matrix[train_rows])
+            n_lists = min(n_lists, len(data))
+            centroids = data[rng.choice(len(data), n_lists, replace=False)]
+            for _ in range(iters):
+                labels = np.argmax(data @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, data)
+                counts = np.bincount(labels, minlength=n_lists)
+                empty = counts == 0
+                sums[empty] = data[rng.choice(len(data), empty.sum())]
+                centroids = _normalize(sums)
+
+            assign = np.empty(view.n_rows, dtype=np.int32)
+            for start in range(0, view.n_rows, self._BLOCK):
+                block = np.asarray(view.matrix[start:start + self._BLOCK])
+                assign[start:start + len(block)] = np.argmax(
+                    block @ centroids.T, axis=1
+                )
+
+            info = self._info()
+            ivf_gen = info["ivf_gen"] + 1
+            centroid_path, assign_path = self._ivf_paths(ivf_gen)
+            np.savez(centroid_path, centroids=centroids)
+            assign.tofile(assign_path)
+            with self._db:
+                self._set_info(ivf_gen=ivf_gen, ivf_rows=len(live_rows))
+                self._bump()
+            self._remove_ivf(info["ivf_gen"])
+            logger.info("Trained IVF index '%s': %s lists over %s rows",
+                        self.name, n_lists, len(live_rows))
+
+    def _remove_ivf(self, ivf_gen):
+        if ivf_gen:
+            for path in self._ivf_paths(ivf_gen):
+                path.unlink(missing_ok=True)
+
+    # ------------------------------------------------------------------
+    # maintenance
+    # ------------------------------------------------------------------
+    def compact(self):
+        """Drop tombstoned rows by rewriting the matrix densely."""
+        with self._writing():
+            view = self._current_view()
+            removed = view.n_rows - int(view.live.sum())
+            if not removed:
+                return 0
+            self._rewrite()
+            logger.info("Compacted '%s': removed %s dead rows",
+                        self.name, removed)
+        self._maybe_train()
+        return removed
+
+    def reencode(self, dim=None, quantization=None):
+        """Re-encode the index in place; returns the number of live rows.
+
+        *dim* truncates every vector to its first *dim* components (and
+        re-normalises it), which for ``text-embedding-3-*`` vectors matches
+        embedding with ``dimensions=dim``; queries must then use the same
+        size.  *quantization* switches the compact copy used by the first
+        search pass (``"none"`` drops it).  Dead rows are compacted away on
+        the way, and the IVF lists are retrained when the size changes.
+        """
+        if quantization is not None and quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}")
+        with self._writing():
+            current = self._info()["dim"]
+            if dim is not None and current and dim > current:
+                raise ValueError(
+                    f"Cannot grow vectors from {current} to {dim} dimensions"
+                )
+            n_live = self._rewrite(dim, quantization)
+            logger.info("Re-encoded '%s': %s rows, dim=%s, quantization=%s",
+                        self.name, n_live, self._info()["dim"],
+                        QUANTIZATIONS[self._info()["quant"]])
+        self._maybe_train()
+        return n_live
+
+    def _rewrite(self, dim=None, quantization=None):
+        """Copy the live rows into a new file generation.
+
+        The new files get a new generation number, so readers in other
+        processes keep their (still valid) old mapping until they notice
+        the version bump.  The previous generation's files are only
+        removed by the next rewrite: a reader that has just read the old
+        generation number can still open them.
+        """
+        view = self._current_view()
+        info = self._info()
+        old_mode = QUANTIZATIONS[info["quant"]]
+        mode = quantization or old_mode
+        dim = dim or info["dim"]
+        live_rows = np.flatnonzero(view.live)
+        gen = info["gen"] + 1
+        with self._vectors_path(gen).open("wb") as fp:
+            for start in range(0, len(live_rows), self._BLOCK):
+                rows = live_rows[start:start + self._BLOCK]
+                vecs = truncate(view.matrix[rows], dim)
+                fp.write(vecs.tobytes())
+                if mode != "none":
+                    self._write_codes(gen, mode, start, vecs)
+        ivf_gen, ivf_rows = info["ivf_gen"], info["ivf_rows"]
+        if ivf_gen and dim == info["dim"]:
+            # keep the trained lists, renumbered like the rows
+            ivf_gen += 1
+            centroid_path, assign_path = self._ivf_paths(ivf_gen)
+            np.savez(centroid_path, centroids=view.centroids)
+            np.asarray(view.assign[live_rows]).tofile(assign_path)
+        else:
+            ivf_gen = ivf_rows = 0  # retrained by _maybe_train if needed
+        with self._db:
+            self._db.execute("DELETE FROM rows WHERE live = 0")
+            # ascending order never collides with a row not yet moved
+            self._db.executemany(
+                "UPDATE rows SET row = ? WHERE row = ?",
+                [(new, int(old)) for new, old in enumerate(live_rows)],
+            )
+            self._set_info(gen=gen, dim=dim, ivf_gen=ivf_gen,
+                           ivf_rows=ivf_rows,
+                           quant=QUANTIZATIONS.index(mode))
+            self._bump()
+        self._remove_generation(info["gen"] - 1)
+        # IVF generations restart at 1 after a reset, so the old lists go
+        # now; a reader that misses them retries (see _current_view)
+        self._remove_ivf(info["ivf_gen"])
+        return len(live_rows)
+
+    def close(self):
+        with self._lock:
+            self._view = None
+            self._db.close()
+            self._write_file.close()
@@ -0,0 +1,187 @@
+"""In-process stand-in for the ``mistralai.Mistral`` client used by OCR.
+
+Implements the calls made by :mod:`app.services.extractor` (file upload,
+signed URL, OCR, delete) and answers with real ``mistralai`` response
+models filled with synthetic markdown, after an artificial latency.  OCR
+calls can be made to fail at random to exercise the shard retries:
+
+    from fake_mistral import FakeMistral, blank_pdf
+    pdf_path.write_bytes(blank_pdf(40))
+    extractor.ocr_pages(pdf_path, client=FakeMistral(n_pages=40),
+                        local_text=False)
+"""
+import base64
+import hashlib
+import random
+import threading
+import time
+import uuid
+
+from mistralai import models
+
+_WORDS = [
+    "pump", "valve", "pressure", "flow", "cylinder", "reservoir", "bearing",
+    "torque", "seal", "hose", "filter", "clearance", "lubrication", "piston",
+    "gear", "motor", "actuator", "coolant", "sensor", "calibration", "shaft",
+    "inspection", "interval", "tolerance", "maintenance", "temperature",
+    "viscosity", "nominal", "rated", "replace", "check", "adjust", "the",
+    "of", "and", "to", "in", "for", "with", "every", "before", "after",
+]
+
+
+def synth_markdown(rng, n_chars=4000):
+    """Pseudo-technical markdown page of roughly *n_chars* characters."""
+    parts, size = [], 0
+    while size < n_chars:
+        if rng.random() < 0.08:
+            line = f"\n## {rng.randint(1, 12)}.{rng.randint(1, 9)} " \
+                   f"{rng.choice(_WORDS).title()} {rng.choice(_WORDS)}\n"
+        else:
+            words = rng.choices(_WORDS, k=rng.randint(8, 24))
+            if rng.random() < 0.3:
+                words.append(f"HX-{rng.randint(100, 999)}")
+            if rng.random() < 0.2:
+                words.append(f"E{rng.randint(10, 99)}")
+            line = " ".join(words).capitalize() + ".\n"
+        parts.append(line)
+        size += len(line)
+    return "".join(parts)
+
+
+def blank_pdf(n_pages, tag=""):
+    """Valid PDF of *n_pages* empty pages (*tag* makes the bytes unique).
+
+    Lets the extractor count pages (and shard them) without a text layer.
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+                   b" ".join(b"%d 0 R" % (3 + i) for i in range(n_pages)),
+                   n_pages)]
+    objects += [b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>"
+                ] * n_pages
+    out = bytearray(b"%%PDF-1.4\n%% %s\n" % tag.encode())
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, xref)
+    return bytes(out)
+
+
+class _Files:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def upload(self, file, purpose="ocr"):
+        content = file["content"]
+        file_id = str(uuid.uuid4())
+        with self._owner._lock:
+            self._owner.uploads[file_id] = content
+        return models.UploadFileOut(
+            id=file_id, object="file", size_bytes=len(content),
+            created_at=int(time.time()), filename=file["file_name"],
+            purpose=purpose, sample_type="ocr_input", source="upload",
+        )
+
+    def get_signed_url(self, file_id, expiry=1):
+        return models.FileSignedURL(url=f"https://fake.mistral/{file_id}")
+
+    def delete(self, file_id):
+        with self._owner._lock:
+            self._owner.uploads.pop(file_id, None)
+
+
+class _OCR:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def process(self, document, model, include_image_base64=False,
+                pages=None, **kwargs):
+        owner = self._owner
+        file_id = document.document_url.rsplit("/", 1)[-1]
+        with owner._lock:
+            owner.calls += 1
+            content = owner.uploads[file_id]
+            failed = owner._rng.random() < owner.fail_rate
+        indices = range(owner.n_pages) if pages is None else pages
+        if owner.latency or owner.page_latency:
+            time.sleep(owner.latency + owner.page_latency * len(indices))
+        if failed:
+            with owner._lock:
+                owner.failures += 1
+            raise models.SDKError("injected OCR failure", status_code=503)
+
+        seed = hashlib.sha256(content).digest()
+        out = []
+        for index in indices:
+            rng = random.Random(seed + index.to_bytes(4, "little"))
+            markdown = synth_markdown(rng, owner.page_chars)
+            images = []
+            if owner.image_bytes:
+                image_id = f"img-{index}-0.jpeg"
+                markdown += f"\n![{image_id}]({image_id})\n"
+                images.append(models.OCRImageObject(
+                    id=image_id, top_left_x=0, top_left_y=0,
+                    bottom_right_x=100, bottom_right_y=100,
+                    image_base64=("data:image/jpeg;base64," + base64.b64encode(
+                        rng.randbytes(owner.image_bytes)).decode())
+                    if include_image_base64 else None,
+                ))
+            out.append(models.OCRPageObject(
+                index=index,
+                markdown=markdown,
+                images=images,
+                dimensions=models.OCRPageDimensions(dpi=200, height=2200,
+                                                    width=1700),
+            ))
+        return models.OCRResponse(
+            pages=out, model=model,
+            usage_info=models.OCRUsageInfo(pages_processed=len(out),
+                                           doc_size_bytes=len(content)),
+        )
+
+
+class FakeMistral:
+    """Deterministic fake of the Mistral OCR client.
+
+    Parameters
+    ----------
+    n_pages
+        Pages "found" in every uploaded document.
+    latency, page_latency
+        Seconds per OCR call, plus seconds per page processed.
+    page_chars
+        Approximate markdown size of one page.
+    image_bytes
+        Size of the base64 image attached to every page (0 = no images).
+    fail_rate
+        Probability that an OCR call raises a 503 ``SDKError``.
+    seed
+        Seed of the failure draws.
+    """
+
+    def __init__(self, n_pages=20, latency=0.0, page_latency=0.0,
+                 page_chars=4000, image_bytes=0, fail_rate=0.0, seed=0):
+        self.n_pages = n_pages
+        self.latency = latency
+        self.page_latency = page_latency
+        self.page_chars = page_chars
+        self.image_bytes = image_bytes
+        self.fail_rate = fail_rate
+        self.uploads = {}
+        self.calls = 0
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.files = _Files(self)
+        self.ocr = _OCR(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
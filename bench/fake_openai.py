@@ -0,0 +1,200 @@
+"""Local stand-in for the OpenAI embeddings and chat completions APIs.
+
+Embeddings are deterministic pseudo-random unit vectors (seeded by the
+input); chat completions return a canned answer, optionally streamed.  Both
+come after an artificial latency, and a configurable share of requests is
+answered with HTTP 429, so ingestion and /question can be exercised without
+a real key:
+
+    python bench/fake_openai.py --port 8100 --latency 0.2 --throttle 0.1
+    EMBEDDING_BASE_URL=http://127.0.0.1:8100/v1 \\
+    ROUTER_BASE_URL=http://127.0.0.1:8100/v1 python -m app.main
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_vector(item, dims):
+    """Deterministic unit vector for *item* (a string or a token list)."""
+    seed = hashlib.sha256(json.dumps(item).encode("utf-8")).digest()
+    rng = random.Random(seed)
+    vec = [rng.gauss(0.0, 1.0) for _ in range(dims)]
+    norm = sum(v * v for v in vec) ** 0.5 or 1.0
+    return [v / norm for v in vec]
+
+
+ANSWER = ("Based on the provided context, the requested value is listed in "
+          "the maintenance table of the document.")
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    chat_latency = 0.0  # before the first token of a chat completion
+    token_delay = 0.0  # between streamed tokens
+    throttle = 0.0
+    dims = 1536
+    stats = {"requests": 0, "throttled": 0}
+    _stats_lock = threading.Lock()
+
+    def log_message(self, fmt, *args):  # keep benchmark output clean
+        pass
+
+    def _reply(self, status, body, headers=None):
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_POST(self):
+        payload = self._read_json()
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            throttled = random.random() < self.throttle
+            if throttled:
+                self.stats["throttled"] += 1
+        if throttled:
+            return self._reply(
+                429,
+                {"error": {"message": "Rate limit reached (fake)",
+                           "type": "rate_limit_error"}},
+                headers={"Retry-After": "0.2"},
+            )
+        path = self.path.rstrip("/")
+        if path.endswith("/embeddings"):
+            if self.latency:
+                time.sleep(self.latency)
+            return self._reply(200, self._embeddings(payload))
+        if path.endswith("/chat/completions"):
+            if self.chat_latency:
+                time.sleep(self.chat_latency)
+            if payload.get("stream"):
+                return self._stream_chat(payload)
+            return self._reply(200, self._chat(payload))
+        return self._reply(404, {"error": {"message": "unknown route"}})
+
+    def _chat(self, payload):
+        prompt = sum(len(m.get("content") or "")
+                     for m in payload.get("messages", [])) // 4
+        completion = len(ANSWER) // 4
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": ANSWER},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": prompt,
+                      "completion_tokens": completion,
+                      "total_tokens": prompt + completion},
+        }
+
+    def _stream_chat(self, payload):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "fake")}
+        words = ANSWER.split(" ")
+        for i, word in enumerate(words):
+            delta = word if i == 0 else " " + word
+            chunk = {**base, "choices": [{"index": 0,
+                                          "delta": {"content": delta},
+                                          "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            if self.token_delay:
+                time.sleep(self.token_delay)
+        last = {**base, "choices": [{"index": 0, "delta": {},
+                                     "finish_reason": "stop"}]}
+        self.wfile.write(f"data: {json.dumps(last)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def _embeddings(self, payload):
+        inputs = payload.get("input")
+        # a single string / token list is also accepted by the real API
+        if isinstance(inputs, str) or (
+            inputs and isinstance(inputs[0], int)
+        ):
+            inputs = [inputs]
+        dims = int(payload.get("dimensions") or self.dims)
+        data = []
+        for i, item in enumerate(inputs):
+            vec = fake_vector(item, dims)
+            if payload.get("encoding_format") == "base64":
+                vec = base64.b64encode(
+                    struct.pack(f"<{dims}f", *vec)
+                ).decode("ascii")
+            data.append({"object": "embedding", "index": i,
+                         "embedding": vec})
+        n_tokens = sum(len(x) if isinstance(x, list) else len(x) // 4
+                       for x in inputs)
+        return {
+            "object": "list",
+            "data": data,
+            "model": payload.get("model", "fake"),
+            "usage": {"prompt_tokens": n_tokens, "total_tokens": n_tokens},
+        }
+
+
+def serve(host="127.0.0.1", port=8100, latency=0.0, throttle=0.0,
+          dims=1536, chat_latency=0.0, token_delay=0.0):
+    """Start the fake server in a daemon thread and return it.
+
+    ``server.RequestHandlerClass.stats`` counts requests and 429s.
+    """
+    handler = type("Handler", (FakeOpenAIHandler,), {
+        "latency": latency, "throttle": throttle, "dims": dims,
+        "chat_latency": chat_latency, "token_delay": token_delay,
+        "stats": {"requests": 0, "throttled": 0},
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every embedding request")
+    parser.add_argument("--chat-latency", type=float, default=0.0,
+                        help="seconds before the first chat token")
+    parser.add_argument("--token-delay", type=float, default=0.0,
+                        help="seconds between streamed chat tokens")
+    parser.add_argument("--throttle", type=float, default=0.0,
+                        help="share of requests answered with 429")
+    parser.add_argument("--dims", type=int, default=1536)
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.latency, args.throttle,
+                   args.dims, args.chat_latency, args.token_delay)
+    print(f"Fake OpenAI listening on http://{args.host}:{args.port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
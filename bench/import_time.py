@@ -0,0 +1,106 @@
+"""Import-time budget for worker cold starts.
+
+Imports ``app.main`` and calls ``create_app()`` in fresh interpreters and
+checks that (a) the median wall time stays under the budget and (b) none of
+the heavy client libraries were loaded – they must only be imported on
+first use or by the warm-up thread:
+
+    python bench/import_time.py --budget 1.5 --runs 5 --role query
+
+Exits with status 1 when the budget is exceeded.  Missing API keys are
+filled with placeholders (nothing is called), warm-up is disabled.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# must not be imported by `import app.main; create_app()`
+HEAVY = ("chromadb", "langchain_openai", "langchain_text_splitters",
+         "mistralai", "openai")
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+app.main.create_app()
+done = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - start,
+    "create_app_s": done - imported,
+    "total_s": done - start,
+    "heavy": [m for m in %r if m in sys.modules],
+}))
+"""
+
+
+def probe(role):
+    env = dict(os.environ, ROLE=role, WARMUP="false")
+    for key in ("MISTRAL_API_KEY", "OPENAI_API_KEY", "ROUTER_API_KEY"):
+        env.setdefault(key, "placeholder")
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE % (HEAVY,)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_modules(role, n=10):
+    """Top *n* modules by cumulative import time (``-X importtime``)."""
+    env = dict(os.environ, ROLE=role, WARMUP="false")
+    for key in ("MISTRAL_API_KEY", "OPENAI_API_KEY", "ROUTER_API_KEY"):
+        env.setdefault(key, "placeholder")
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        if "." not in name:  # top-level packages only
+            rows.append((int(parts[1]) / 1e6, name))
+    return sorted(rows, reverse=True)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=float, default=1.5,
+                        help="max median seconds for import + create_app")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--role", default="all",
+                        choices=["all", "ingest", "query"])
+    parser.add_argument("--output", help="write results as JSON here")
+    args = parser.parse_args()
+
+    runs = [probe(args.role) for _ in range(args.runs)]
+    result = {
+        "role": args.role,
+        "budget_s": args.budget,
+        "median_import_s": statistics.median(r["import_s"] for r in runs),
+        "median_create_app_s": statistics.median(
+            r["create_app_s"] for r in runs
+        ),
+        "median_total_s": statistics.median(r["total_s"] for r in runs),
+        "heavy_modules_loaded": sorted({m for r in runs for m in r["heavy"]}),
+        "slowest_modules": slowest_modules(args.role),
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+
+    ok = (result["median_total_s"] <= args.budget
+          and not result["heavy_modules_loaded"])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
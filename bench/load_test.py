@@ -0,0 +1,256 @@
+"""Load test of the production server against local stand-in upstreams.
+
+Unless ``--url`` is given, the fake OpenAI API (``fake_openai.py``) is
+started in-process and gunicorn is launched with ``gunicorn.conf.py`` in a
+temporary data directory, pointed at the fake.  ``--pdf`` is uploaded
+(its text layer is read locally, so OCR is never called), then
+``--clients`` threads POST distinct questions for ``--duration`` seconds:
+
+    python bench/load_test.py --clients 64 --max-in-flight 16 \\
+        --chat-latency 0.5 --duration 20
+
+Slow or hanging upstreams are simulated with ``--chat-latency`` above
+``--chat-timeout`` (504s) and saturation with more clients than
+``--workers`` x ``--max-in-flight`` (503s with Retry-After).  Streams
+that fail after the sources were sent are counted as ``200_error``.
+
+The report (sorted JSON) counts responses by status and gives latency
+percentiles per status, so shed load shows up as fast 503s rather than
+slow 200s.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+sys.path[:0] = [str(ROOT), str(BENCH_DIR)]
+
+import fake_openai  # noqa: E402
+from run_benchmarks import percentiles, rate  # noqa: E402
+
+QUESTIONS = [
+    "What are the main components of hydraulic circuits?",
+    "How often should the engine oil be changed?",
+    "What is the valve clearance adjustment interval?",
+    "How is bearing lubrication scheduled?",
+    "What does Pascal's law state?",
+]
+
+
+def _request(method, url, body=None, headers=None, timeout=120):
+    """``(status, headers, body bytes)``; HTTP errors are returned too."""
+    req = urllib.request.Request(url, data=body, method=method,
+                                 headers=headers or {})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.headers, resp.read()
+    except urllib.error.HTTPError as exc:
+        return exc.code, exc.headers, exc.read()
+
+
+def _upload(url, pdf):
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; "
+            f"name=\"files\"; filename=\"{pdf.name}\"\r\n"
+            f"Content-Type: application/pdf\r\n\r\n").encode()
+    body += pdf.read_bytes() + f"\r\n--{boundary}--\r\n".encode()
+    status, _, raw = _request(
+        "POST", f"{url}/documents", body,
+        {"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+    if status != 202:
+        raise RuntimeError(f"upload failed ({status}): {raw[:200]!r}")
+    status_url = url + json.loads(raw)["status_url"]
+    while True:
+        job = json.loads(_request("GET", status_url)[2])
+        if job["status"] in ("done", "partial", "failed"):
+            return job["status"]
+        time.sleep(0.2)
+
+
+def _wait_ready(url, proc, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            if _request("GET", f"{url}/stats", timeout=2)[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"server at {url} not ready after {timeout}s")
+
+
+def _spawn(args, workdir):
+    """Fake upstreams plus a gunicorn server; returns (url, proc, fake)."""
+    fake = fake_openai.serve(port=0, dims=args.dims,
+                             latency=args.embed_latency,
+                             chat_latency=args.chat_latency,
+                             throttle=args.throttle)
+    fake_url = f"http://127.0.0.1:{fake.server_address[1]}/v1"
+    data = Path(workdir)
+    env = {
+        **os.environ,
+        "PORT": str(args.port),
+        "WEB_CONCURRENCY": str(args.workers),
+        "MAX_IN_FLIGHT": str(args.max_in_flight),
+        "CHAT_TIMEOUT": str(args.chat_timeout),
+        "UPSTREAM_MAX_RETRIES": str(args.max_retries),
+        "EMBEDDING_BASE_URL": fake_url,
+        "ROUTER_BASE_URL": fake_url,
+        "OPENAI_API_KEY": "fake",
+        "ROUTER_API_KEY": "fake",
+        "MISTRAL_API_KEY": "fake",
+        "VECTOR_BACKEND": args.backend,
+        "UPLOAD_DIR": str(data / "uploads"),
+        "JOBS_DIR": str(data / "jobs"),
+        "CHROMA_DIR": str(data / "chroma_db"),
+        "MMAP_INDEX_DIR": str(data / "mmap_index"),
+        "LEXICAL_INDEX_DIR": str(data / "lexical"),
+        "EMBEDDING_CACHE_PATH": str(data / "embedding_cache.sqlite3"),
+        "ANSWER_CACHE_MAX_ENTRIES": "0",
+    }
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app.main:create_app()",
+         "--config", str(ROOT / "gunicorn.conf.py"), "--access-logfile",
+         "/dev/null"],
+        cwd=ROOT, env=env,
+    )
+    return f"http://127.0.0.1:{args.port}", proc, fake
+
+
+def load(url, clients, duration, stream=False):
+    """``--clients`` closed-loop clients for *duration* seconds."""
+    samples = defaultdict(list)  # status -> latencies (ms)
+    retry_after = set()
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    target = f"{url}/question" + ("?stream=true" if stream else "")
+
+    def client(n):
+        i = 0
+        while time.monotonic() < deadline:
+            # distinct questions: neither cache answers them
+            body = json.dumps({"question": f"{QUESTIONS[i % len(QUESTIONS)]}"
+                                           f" #{n}-{i}"}).encode()
+            i += 1
+            start = time.perf_counter()
+            try:
+                status, headers, raw = _request(
+                    "POST", target, body,
+                    {"Content-Type": "application/json"},
+                )
+                # a stream that failed after its 200 ends in an error event
+                if stream and b"event: error" in raw:
+                    status = "200_error"
+            except OSError:
+                status, headers = "connection_error", {}
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                samples[str(status)].append(elapsed)
+                if headers.get("Retry-After"):
+                    retry_after.add(headers["Retry-After"])
+
+    threads = [threading.Thread(target=client, args=(n,))
+               for n in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    ok = len(samples.get("200", []))
+    return {
+        "clients": clients,
+        "requests": sum(len(v) for v in samples.values()),
+        "ok_per_s": rate(ok, elapsed),
+        "status": {status: len(v) for status, v in samples.items()},
+        "latency": {status: percentiles(v) for status, v in samples.items()},
+        "retry_after": sorted(retry_after),
+    }
+
+
+def run(args):
+    proc = fake = workdir = None
+    url = args.url
+    try:
+        if url is None:
+            workdir = tempfile.mkdtemp(prefix="rag-load-")
+            url, proc, fake = _spawn(args, workdir)
+        url = url.rstrip("/")
+        _wait_ready(url, proc)
+        if args.pdf:
+            print(f"Ingesting {args.pdf}: {_upload(url, Path(args.pdf))}",
+                  file=sys.stderr)
+        results = {"json": load(url, args.clients, args.duration)}
+        if args.stream:
+            results["stream"] = load(url, args.clients, args.duration,
+                                     stream=True)
+        results["settings"] = {
+            key: getattr(args, key)
+            for key in ("workers", "max_in_flight", "chat_latency",
+                        "chat_timeout", "max_retries", "throttle")
+        } if args.url is None else {"url": args.url}
+        if fake is not None:
+            results["upstream_requests"] = dict(
+                fake.RequestHandlerClass.stats
+            )
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+        if fake is not None:
+            fake.shutdown()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    print(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="load this server instead of "
+                                      "spawning one")
+    parser.add_argument("--pdf", default=str(ROOT / "machinery.pdf"),
+                        help="uploaded before the test ('' = skip)")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--stream", action="store_true",
+                        help="also load the streaming endpoint")
+    parser.add_argument("--output")
+    # spawned server
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--backend", default="mmap",
+                        choices=("chroma", "mmap"))
+    parser.add_argument("--dims", type=int, default=256)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--chat-timeout", type=float, default=10.0)
+    parser.add_argument("--max-retries", type=int, default=2,
+                        help="upstream retries after a failed call")
+    parser.add_argument("--throttle", type=float, default=0.0,
+                        help="share of upstream calls answered 429")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
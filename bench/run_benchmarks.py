@@ -0,0 +1,648 @@
+"""Offline benchmarks for ingestion throughput and query latency.
+
+Every external provider is replaced by a local stand-in: OCR by
+:class:`fake_mistral.FakeMistral`, embeddings and chat completions by the
+HTTP server in ``fake_openai.py`` (each with configurable latency).  For
+every corpus size a synthetic document set is chunked, indexed and queried:
+
+    python bench/run_benchmarks.py --sizes 1000,10000,100000 \\
+        --backend mmap --clients 16 --output bench/results.json
+
+Reported per corpus size:
+
+* ``chunking``   – chars/s and chunks/s of ``chunker.iter_chunks``
+* ``embedding``  – batches/s and chunks/s of ``embedder.embed_chunks``
+  against the fake API (on a sample of ``--embed-sample`` chunks)
+* ``insert``     – vectors/s of ``VectorStore.upsert`` and chunks/s of the
+  BM25 index (random vectors seeded by the chunk text, no API involved)
+* ``retrieval``  – ``_similar_chunks`` p50/p95/p99 per mode, with query
+  embeddings computed in-process so only the search is timed, and the
+  context tokens per answer with and without MMR / adjacent-chunk merging
+* ``snapshot``   – size of an exported snapshot, export and import rows/s
+  and the first query of a fresh node bootstrapped from it
+* ``question``   – end-to-end POST /question latency (JSON and streamed)
+  under ``--clients`` concurrent clients, through the fake APIs
+
+OCR pages/s (``FakeMistral`` ➜ ``OCRStore``, one call per document and
+page-range shards in parallel, optionally with injected failures) is
+reported once, and so are ``quantization`` (memory scanned per query,
+recall@k and latency of the mmap index at full, half and quarter
+dimensions, each as float32 / int8 / binary) and
+``text_layer``: local text extraction of ``--pdf`` (a real, born-digital
+PDF; default ``machinery.pdf``) with the number of pages still sent to OCR.
+The result file is sorted, indented JSON so runs can be diffed between
+commits.  The tiktoken encodings must already be in the local cache
+(``TIKTOKEN_CACHE_DIR``) since no network access is assumed.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+sys.path[:0] = [str(ROOT), str(BENCH_DIR)]
+
+import fake_openai  # noqa: E402
+from fake_mistral import FakeMistral, blank_pdf, synth_markdown  # noqa: E402
+
+from app.services import (  # noqa: E402
+    chunker, embedder, extractor, pdftext, retriever, snapshot,
+)
+from app.services.ocr_store import OCRStore  # noqa: E402
+from app.services.service import RAGService  # noqa: E402
+from app.services.vectorstore import (  # noqa: E402
+    QUANTIZATIONS, MmapStore, VectorStore,
+)
+
+
+def percentiles(samples_ms):
+    if not samples_ms:
+        return {"n": 0}
+    arr = np.asarray(samples_ms, dtype=np.float64)
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {"n": len(arr), "mean_ms": round(float(arr.mean()), 3),
+            "p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3)}
+
+
+def rate(count, seconds):
+    return round(count / seconds, 1) if seconds > 0 else None
+
+
+# ----------------------------------------------------------------------
+# synthetic corpus
+# ----------------------------------------------------------------------
+class Corpus:
+    """Deterministic stream of chunks built from a pool of synthetic pages.
+
+    Pages are generated once and reused with increasing page indices, so a
+    million chunks need no more memory than a few hundred pages.
+    """
+
+    def __init__(self, args, seed=0):
+        rng = random.Random(seed)
+        self.pool = [synth_markdown(rng, args.page_chars)
+                     for _ in range(args.page_pool)]
+        self.doc_pages = args.doc_pages
+        self.chunk_params = {"chunk_size": args.chunk_size,
+                             "chunk_overlap": args.chunk_overlap}
+        self.chars = 0
+
+    def _pages(self, doc):
+        for i in range(self.doc_pages):
+            text = self.pool[(doc * self.doc_pages + i) % len(self.pool)]
+            self.chars += len(text)
+            yield {"index": i, "markdown": text}
+
+    def chunks(self, n):
+        docs = (chunker.iter_chunks(self._pages(d), f"bench-{d:06d}.pdf",
+                                    **self.chunk_params)
+                for d in itertools.count())
+        return itertools.islice(itertools.chain.from_iterable(docs), n)
+
+
+class LocalEmbeddings:
+    """Hash-seeded random query vectors, computed in-process."""
+
+    def __init__(self, dims):
+        self.dims = dims
+
+    def embed_query(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8],
+                              "little")
+        vec = np.random.default_rng(seed).standard_normal(self.dims)
+        return (vec / np.linalg.norm(vec)).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+
+class NullStore(VectorStore):
+    """Discards writes, so embedding throughput is timed on its own."""
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        pass
+
+    def delete(self, ids):
+        pass
+
+    def ids(self, where=None, limit=None):
+        return []
+
+    def query(self, embeddings, k, where=None, include_vectors=False):
+        return [[] for _ in embeddings]
+
+    def count(self):
+        return 0
+
+    def vectors(self, ids):
+        return {}
+
+
+# ----------------------------------------------------------------------
+# stages
+# ----------------------------------------------------------------------
+def bench_ocr(work, args, shard_pages):
+    fake = FakeMistral(n_pages=args.ocr_pages, latency=args.ocr_latency,
+                       page_latency=args.ocr_page_latency,
+                       page_chars=args.page_chars,
+                       image_bytes=args.ocr_image_bytes,
+                       fail_rate=args.ocr_fail_rate)
+    store = OCRStore(work / f"ocr-{shard_pages}")
+    pages = 0
+    start = time.perf_counter()
+    for i in range(args.ocr_docs):
+        pdf = work / f"doc-{i}.pdf"
+        pdf.write_bytes(blank_pdf(args.ocr_pages, tag=str(i)))
+        digest = hashlib.sha256(pdf.read_bytes()).hexdigest()
+        pages += store.save_pages(digest, extractor.ocr_pages(
+            pdf, client=fake, local_text=False, shard_pages=shard_pages,
+            shard_workers=args.ocr_shard_workers,
+            image_dir=work / "images" if args.ocr_image_bytes else None,
+        ))
+    elapsed = time.perf_counter() - start
+    return {"docs": args.ocr_docs, "pages": pages, "calls": fake.calls,
+            "failures": fake.failures, "pages_per_s": rate(pages, elapsed),
+            "s_per_doc": round(elapsed / max(args.ocr_docs, 1), 4)}
+
+
+def bench_text_layer(args):
+    pdf = Path(args.pdf)
+    if not pdf.is_file():
+        return None
+    start = time.perf_counter()
+    pages = pdftext.text_pages(pdf)
+    elapsed = time.perf_counter() - start
+    return {"pdf": pdf.name, "pages": len(pages),
+            "pages_per_s": rate(len(pages), elapsed),
+            "ocr_pages": sum(1 for p in pages if pdftext.needs_ocr(p))}
+
+
+def bench_chunking(corpus, n):
+    corpus.chars = 0
+    start = time.perf_counter()
+    count = sum(1 for _ in corpus.chunks(n))
+    elapsed = time.perf_counter() - start
+    return {"chunks": count, "chars": corpus.chars,
+            "chars_per_s": rate(corpus.chars, elapsed),
+            "chunks_per_s": rate(count, elapsed)}
+
+
+def bench_embedding(service, corpus, n, fake_server):
+    stats = fake_server.RequestHandlerClass.stats
+    before = dict(stats)
+    start = time.perf_counter()
+    result = embedder.embed_chunks(
+        corpus.chunks(n), collection=NullStore(),
+        embeddings=service.ingest_embeddings,
+        max_in_flight=service.embed_max_in_flight,
+        limiter=service.embed_limiter,
+    )
+    elapsed = time.perf_counter() - start
+    batches = stats["requests"] - before["requests"]
+    return {"chunks": result["n_vectors"], "requests": batches,
+            "throttled": stats["throttled"] - before["throttled"],
+            "batches_per_s": rate(batches, elapsed),
+            "chunks_per_s": rate(result["n_vectors"], elapsed)}
+
+
+def bench_insert(service, corpus, n, args, n_queries):
+    """Index *n* chunks with random vectors; return stats and queries."""
+    store = service.collection(create=True)
+    lexical = service.lexical()
+    qrng = random.Random(1)
+    every = max(n // max(n_queries, 1), 1)
+    queries = []
+    t_vec = t_lex = 0.0
+    batch = []
+
+    def flush():
+        nonlocal t_vec, t_lex
+        records = [(embedder.chunk_id(c), c["text"],
+                    {"page_index": c["page_index"],
+                     "chunk_index": c["chunk_index"],
+                     "filename": c["filename"],
+                     "tokens": len(c["text"]) // 4}) for c in batch]
+        # seeded by the text, so chunks repeated across documents share a
+        # vector like real embeddings would
+        vectors = np.stack([
+            np.random.default_rng(
+                int.from_bytes(hashlib.sha256(r[1].encode()).digest()[:8],
+                               "little")
+            ).standard_normal(args.dims, dtype=np.float32)
+            for r in records
+        ])
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        start = time.perf_counter()
+        store.upsert(ids=[r[0] for r in records],
+                     embeddings=vectors.tolist(),
+                     documents=[r[1] for r in records],
+                     metadatas=[r[2] for r in records])
+        t_vec += time.perf_counter() - start
+        start = time.perf_counter()
+        lexical.add(records)
+        t_lex += time.perf_counter() - start
+        batch.clear()
+
+    for i, chunk in enumerate(corpus.chunks(n)):
+        if i % every == 0 and len(queries) < n_queries:
+            words = chunk["text"].split()
+            at = qrng.randrange(max(len(words) - 6, 1))
+            queries.append(" ".join(words[at:at + 6]))
+        batch.append(chunk)
+        if len(batch) >= args.write_batch:
+            flush()
+    if batch:
+        flush()
+    service.refresh()
+    return {"vectors": n, "vectors_per_s": rate(n, t_vec),
+            "lexical_chunks_per_s": rate(n, t_lex),
+            "store_count": service.collection().count()}, queries
+
+
+def bench_retrieval(service, queries, args):
+    embeddings = LocalEmbeddings(args.dims)
+    collection = service.collection()
+    lexical = service.lexical()
+    out = {}
+    for mode in ("vector", "lexical", "hybrid"):
+        for q in queries[:5]:  # warm caches / page in the index
+            retriever._similar_chunks(q, collection, embeddings,
+                                      top_k=args.top_k, lexical=lexical,
+                                      mode=mode, executor=service.pool)
+        samples = []
+        for q in queries:
+            start = time.perf_counter()
+            retriever._similar_chunks(q, collection, embeddings,
+                                      top_k=args.top_k, lexical=lexical,
+                                      mode=mode, executor=service.pool)
+            samples.append((time.perf_counter() - start) * 1000)
+        out[mode] = percentiles(samples)
+    out["context_tokens"] = bench_context_tokens(service, queries, args)
+    return out
+
+
+def _redundancy(chunks, n=8):
+    """Share of the word *n*-grams of a context that occur more than once."""
+    grams = []
+    for chunk in chunks:
+        words = chunk["text"].split()
+        grams.extend(tuple(words[i:i + n]) for i in range(len(words) - n + 1))
+    return 1.0 - len(set(grams)) / len(grams) if grams else 0.0
+
+
+def bench_context_tokens(service, queries, args):
+    """Context handed to the model per answer, per mode.
+
+    ``plain`` is the raw top-k, ``selected`` the MMR re-selection plus
+    adjacent-chunk merging (``MMR_LAMBDA`` / ``MERGE_ADJACENT_CHUNKS``).
+    Each reports the mean ``tokens`` and the ``redundant`` share of
+    repeated text (overlaps and duplicate chunks).
+    """
+    embeddings = LocalEmbeddings(args.dims)
+    collection = service.collection()
+    lexical = service.lexical()
+    settings = retriever.settings
+    configured = (settings.MMR_LAMBDA, settings.MERGE_ADJACENT_CHUNKS)
+    plain = (1.0, False)
+    out = {}
+    try:
+        for mode in ("vector", "lexical", "hybrid"):
+            entry = {}
+            for label, (mmr_lambda, merge) in (("plain", plain),
+                                               ("selected", configured)):
+                settings.MMR_LAMBDA = mmr_lambda
+                settings.MERGE_ADJACENT_CHUNKS = merge
+                contexts = [
+                    retriever._similar_chunks(
+                        q, collection, embeddings, top_k=args.top_k,
+                        lexical=lexical, mode=mode, executor=service.pool)
+                    for q in queries[:50]
+                ]
+                n = max(len(contexts), 1)
+                entry[label] = {
+                    "tokens": round(sum(c["tokens"] or 0 for chunks in contexts
+                                        for c in chunks) / n, 1),
+                    "redundant": round(sum(map(_redundancy, contexts)) / n,
+                                       3),
+                }
+            out[mode] = entry
+    finally:
+        settings.MMR_LAMBDA, settings.MERGE_ADJACENT_CHUNKS = configured
+    return out
+
+
+def bench_quantization(work, args):
+    """Memory vs recall@k of truncated and quantized mmap indexes.
+
+    Vectors are clustered and their variance decays along the dimensions,
+    like embeddings trained to be truncated (``text-embedding-3-*``), so
+    shorter prefixes keep most of the neighbourhood structure.  Recall is
+    measured against exact search over the full float32 vectors; the
+    memory is what the first pass scans per query (``scan_mb``) next to
+    the float32 matrix kept on disk for rescoring (``vectors_mb``).
+    """
+    rng = np.random.default_rng(0)
+    n, dim, k = args.quant_vectors, args.quant_dims, args.top_k
+    decay = (1.0 / np.sqrt(1.0 + np.arange(dim) / 32)).astype(np.float32)
+    centers = rng.standard_normal((256, dim), dtype=np.float32) * decay
+    data = (centers[rng.integers(0, len(centers), n)]
+            + 0.6 * rng.standard_normal((n, dim), dtype=np.float32) * decay)
+    queries = (data[rng.choice(n, args.quant_queries, replace=False)]
+               + 0.3 * rng.standard_normal((args.quant_queries, dim),
+                                           dtype=np.float32) * decay)
+
+    store = MmapStore(work / "quant", "bench", ivf_threshold=n + 1,
+                      rescore=args.rescore)
+    ids = [str(i) for i in range(n)]
+    for start in range(0, n, args.write_batch):
+        stop = min(start + args.write_batch, n)
+        store.upsert(ids[start:stop], data[start:stop], [""] * (stop - start),
+                     [{}] * (stop - start))
+    exact = [{h["id"] for h in hits} for hits in store.query(queries, k)]
+
+    out = {"vectors": n, "k": k, "rescore": args.rescore}
+    try:
+        for size in (dim, dim // 2, dim // 4):
+            if size < 8:
+                continue
+            prefix = queries[:, :size]
+            for mode in QUANTIZATIONS:
+                store.reencode(size, mode)
+                store.query(prefix[:5], k)  # page the files in
+                samples, found = [], 0
+                for q, truth in zip(prefix, exact):
+                    start = time.perf_counter()
+                    (hits,) = store.query(q[None, :], k)
+                    samples.append((time.perf_counter() - start) * 1000)
+                    found += len(truth & {h["id"] for h in hits})
+                scan = sum(path.stat().st_size
+                           for path in store.dir.glob("*")
+                           if path.name.startswith(("codes.", "scales.")))
+                vectors_bytes = n * size * 4
+                out[f"{size}/{mode}"] = {
+                    "scan_mb": round((scan or vectors_bytes) / 2**20, 2),
+                    "vectors_mb": round(vectors_bytes / 2**20, 2),
+                    "recall": round(found / (k * len(exact)), 3),
+                    "latency": percentiles(samples),
+                }
+    finally:
+        store.close()
+    return out
+
+
+def bench_snapshot(service, work, n, args):
+    """Export the corpus to a snapshot and bootstrap a fresh node from it."""
+    path = work / f"snapshot_{n}"
+    start = time.perf_counter()
+    snapshot.export_snapshot(service, path, [service.collection_name])
+    t_export = time.perf_counter() - start
+    size = sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+    node = RAGService(
+        openai_api_key="fake",
+        router_api_key="fake",
+        persist_dir=work / f"restore_{n}" / "chroma",
+        collection_name=service.collection_name,
+        vector_backend=args.backend,
+        mmap_dir=work / f"restore_{n}" / "mmap",
+        lexical_dir=work / f"restore_{n}" / "lexical",
+        embedding_cache_path=work / f"restore_{n}" / "cache.sqlite3",
+    )
+    try:
+        start = time.perf_counter()
+        snapshot.import_snapshot(node, path)
+        t_import = time.perf_counter() - start
+        query = LocalEmbeddings(args.dims).embed_query("bootstrap check")
+        start = time.perf_counter()
+        node.collection().query([query], args.top_k)
+        t_query = time.perf_counter() - start
+    finally:
+        node.close()
+        shutil.rmtree(work / f"restore_{n}", ignore_errors=True)
+        shutil.rmtree(path, ignore_errors=True)
+    return {"snapshot_mb": round(size / 2**20, 2),
+            "export_rows_per_s": rate(n, t_export),
+            "import_rows_per_s": rate(n, t_import),
+            "import_s": round(t_import, 3),
+            "first_query_ms": round(t_query * 1000, 3)}
+
+
+def _post(url, body, stream=False):
+    """POST *body*; return (total_ms, first_byte_ms, first_token_ms)."""
+    req = urllib.request.Request(
+        url + ("?stream=true" if stream else ""),
+        data=json.dumps(body).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    start = time.perf_counter()
+    first_byte = first_token = None
+    with urllib.request.urlopen(req, timeout=120) as resp:
+        if not stream:
+            resp.read()
+        else:
+            for line in resp:
+                now = (time.perf_counter() - start) * 1000
+                if first_byte is None:
+                    first_byte = now
+                if first_token is None and line.startswith(b"event: token"):
+                    first_token = now
+    return (time.perf_counter() - start) * 1000, first_byte, first_token
+
+
+def bench_question(service, queries, args):
+    from flask import Flask
+    from werkzeug.serving import make_server
+
+    from app.routers.question import question_bp
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    app = Flask("bench")
+    app.extensions["rag"] = service
+    app.register_blueprint(question_bp)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.port}/question"
+
+    out = {"clients": args.clients}
+    try:
+        for stream in (False, True):
+            # distinct questions so the embedding cache is not hit
+            bodies = [{"question": f"{queries[i % len(queries)]} #{i}"
+                                   f"{'s' if stream else ''}"}
+                      for i in range(args.requests)]
+            errors = 0
+            results = []
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.clients) as pool:
+                futures = [pool.submit(_post, url, b, stream) for b in bodies]
+                for fut in futures:
+                    try:
+                        results.append(fut.result())
+                    except Exception:
+                        errors += 1
+            elapsed = time.perf_counter() - start
+            entry = {"requests": len(bodies), "errors": errors,
+                     "requests_per_s": rate(len(results), elapsed),
+                     "latency": percentiles([r[0] for r in results])}
+            if stream:
+                entry["ttfb"] = percentiles([r[1] for r in results
+                                             if r[1] is not None])
+                entry["ttft"] = percentiles([r[2] for r in results
+                                             if r[2] is not None])
+            out["stream" if stream else "json"] = entry
+    finally:
+        server.shutdown()
+    return out
+
+
+# ----------------------------------------------------------------------
+def _meta(args):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(),
+            "platform": platform.platform(), "numpy": np.__version__,
+            "cpu_count": os.cpu_count(), "args": vars(args)}
+
+
+def run(args):
+    fake = fake_openai.serve(port=0, latency=args.embed_latency,
+                             chat_latency=args.chat_latency,
+                             token_delay=args.token_delay, dims=args.dims,
+                             throttle=args.throttle)
+    base_url = f"http://127.0.0.1:{fake.server_address[1]}/v1"
+    work = Path(args.workdir or tempfile.mkdtemp(prefix="rag-bench-"))
+    work.mkdir(parents=True, exist_ok=True)
+    results = {"meta": _meta(args), "corpora": {}}
+    try:
+        results["ocr"] = {
+            "single": bench_ocr(work, args, shard_pages=0),
+            "sharded": bench_ocr(work, args, args.ocr_shard_pages),
+        }
+        print("ocr", results["ocr"], flush=True)
+        results["text_layer"] = bench_text_layer(args)
+        print("text_layer", results["text_layer"], flush=True)
+        if args.quant_vectors:
+            results["quantization"] = bench_quantization(work, args)
+            print("quantization", results["quantization"], flush=True)
+        corpus = Corpus(args)
+        for n in args.sizes:
+            service = RAGService(
+                openai_api_key="fake",
+                router_api_key="fake",
+                persist_dir=work / "chroma",
+                collection_name=f"bench_{n}",
+                vector_backend=args.backend,
+                mmap_dir=work / "mmap",
+                lexical_dir=work / "lexical",
+                generation_concurrency=args.clients,
+                embedding_base_url=base_url,
+                chat_model="fake-chat",
+                router_base_url=base_url,
+                max_connections=max(20, 2 * args.clients),
+                embedding_cache_path=work / f"cache_{n}.sqlite3",
+            )
+            try:
+                entry = {}
+                entry["chunking"] = bench_chunking(corpus, n)
+                entry["embedding"] = bench_embedding(
+                    service, corpus, min(n, args.embed_sample), fake
+                )
+                entry["insert"], queries = bench_insert(
+                    service, corpus, n, args, args.queries
+                )
+                entry["retrieval"] = bench_retrieval(service, queries, args)
+                entry["snapshot"] = bench_snapshot(service, work, n, args)
+                if args.requests:
+                    entry["question"] = bench_question(service, queries,
+                                                       args)
+            finally:
+                service.close()
+            results["corpora"][str(n)] = entry
+            print(n, json.dumps(entry), flush=True)
+    finally:
+        fake.shutdown()
+        if not args.workdir:
+            shutil.rmtree(work, ignore_errors=True)
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    Path(args.output).write_text(json.dumps(results, indent=2,
+                                            sort_keys=True) + "\n")
+    print(f"Results written to {args.output}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000",
+                        type=lambda s: [int(x) for x in s.split(",")],
+                        help="comma-separated corpus sizes in chunks")
+    parser.add_argument("--backend", default="chroma",
+                        choices=["chroma", "mmap"])
+    parser.add_argument("--dims", type=int, default=256)
+    parser.add_argument("--output", default="bench/results.json")
+    parser.add_argument("--workdir",
+                        help="keep indexes here instead of a temp dir")
+    # corpus
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--page-chars", type=int, default=4000)
+    parser.add_argument("--page-pool", type=int, default=200)
+    parser.add_argument("--doc-pages", type=int, default=50)
+    parser.add_argument("--write-batch", type=int, default=2048)
+    # fakes
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--chat-latency", type=float, default=0.3)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--throttle", type=float, default=0.0)
+    parser.add_argument("--ocr-latency", type=float, default=0.2)
+    parser.add_argument("--ocr-docs", type=int, default=5)
+    parser.add_argument("--ocr-pages", type=int, default=40)
+    parser.add_argument("--ocr-page-latency", type=float, default=0.05)
+    parser.add_argument("--ocr-image-bytes", type=int, default=0,
+                        help="image per OCR'd page, written to disk")
+    parser.add_argument("--ocr-shard-pages", type=int, default=8)
+    parser.add_argument("--ocr-shard-workers", type=int, default=4)
+    parser.add_argument("--ocr-fail-rate", type=float, default=0.0)
+    parser.add_argument("--pdf", default=str(ROOT / "machinery.pdf"),
+                        help="digital PDF for the text-layer benchmark")
+    # quantization (0 vectors skips it)
+    parser.add_argument("--quant-vectors", type=int, default=50_000)
+    parser.add_argument("--quant-dims", type=int, default=1536)
+    parser.add_argument("--quant-queries", type=int, default=100)
+    parser.add_argument("--rescore", type=int, default=10,
+                        help="shortlist = top-k x this, rescored exactly")
+    # workload
+    parser.add_argument("--embed-sample", type=int, default=5000,
+                        help="chunks sent through the fake embedding API")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200,
+                        help="POST /question calls per mode (0 = skip)")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,227 @@
-from datasets import load_dataset, Dataset
-from dotenv import load_dotenv
-from tqdm import tqdm
+"""Evaluate the running RAG service on neural-bridge/rag-dataset-1200.
+
+Two modes:
+
+* ``answers`` (default) – ask the service for answers and score them with
+  RAGAS.  Questions are sent concurrently through POST /question/batch
+  (falling back to POST /question on older servers) and every answer is
+  cached on disk, keyed by question, retrieval settings and the index
+  version reported by GET /stats, so reruns only pay for what changed.
+* ``retrieval`` – fetch the top-k sources only (no LLM call) and compute
+  recall@k / MRR locally against the dataset contexts.
+
+    python eval/evaluate_rag.py --concurrency 8
+    python eval/evaluate_rag.py --mode retrieval --top-k 10 --retrieval hybrid
+"""
+import argparse
+import hashlib
+import json
 import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-import json
+from datasets import load_dataset
+from dotenv import load_dotenv
+from tqdm import tqdm
 
-from ragas import evaluate
-from ragas.metrics import (
-    context_precision,
-    faithfulness,
-    answer_relevancy
-)
+EVAL_DIR = os.path.dirname(__file__)
 
+load_dotenv(dotenv_path=os.path.join(EVAL_DIR, '..', '.env'))
 
-load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+BUSY_RETRIES = 8  # 503 answers (server busy) retried per request
 
-_OPENAI_KEY = os.getenv("OPENAI_API_KEY")
-if not _OPENAI_KEY:
-    raise RuntimeError("Missing OpenAI API key – set OPENAI_API_KEY in your .env file")
 
-os.environ["OPENAI_API_KEY"] = _OPENAI_KEY
+def load_samples(n_samples, split="test"):
+    ds_full = load_dataset("neural-bridge/rag-dataset-1200", split=split)
+    return ds_full.select(range(n_samples))
 
 
-def main():
-    # 1. Load only the first 50 test examples
-    TEST_SPLIT = "test"
-    N_SAMPLES = 50
-
-    ds_full = load_dataset("neural-bridge/rag-dataset-1200", split=TEST_SPLIT)
-    ds_50 = ds_full.select(range(N_SAMPLES))
-
-    # 2. Ask your local RAG system for answers
-    answers = []
-    for question in tqdm(ds_50["question"], desc="Querying RAG"):
-        response = requests.post(
-            "http://localhost:8000/question",
-            headers={"Content-Type": "application/json"},
-            data=json.dumps({"question": question}),
-            timeout=30
-        )
-        answers.append(response.json()["answer"])
-
-    # 3. Assemble a dataset for RAGAS
+# ---------------------------------------------------------------------------
+# service client
+# ---------------------------------------------------------------------------
+def index_fingerprint(url, timeout):
+    """Index/model description from GET /stats (empty on older servers)."""
+    try:
+        stats = requests.get(f"{url}/stats", timeout=timeout).json()
+    except (requests.RequestException, ValueError):
+        return {}
+    return {"index": stats.get("index"), "models": stats.get("models")}
+
+
+def has_batch_endpoint(url, timeout):
+    """False for servers without POST /question/batch.
+
+    Those are asked one question at a time with their own ``top_k``.
+    """
+    try:
+        response = requests.post(f"{url}/question/batch",
+                                 json={"questions": []}, timeout=timeout)
+    except requests.RequestException:
+        return True  # the questions themselves will report the error
+    return response.status_code != 404
+
+
+def _post(url, body, timeout):
+    """POST *body*; a 503 is retried after the server's Retry-After."""
+    for attempt in range(BUSY_RETRIES + 1):
+        response = requests.post(url, json=body, timeout=timeout)
+        if response.status_code != 503 or attempt == BUSY_RETRIES:
+            break
+        try:
+            delay = float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            delay = 2 ** attempt
+        time.sleep(delay)
+    response.raise_for_status()
+    return response.json()
+
+
+def _post_batch(url, questions, retrieval, top_k, generate, timeout):
+    return _post(
+        f"{url}/question/batch",
+        {"questions": [{"question": q, "retrieval": retrieval}
+                       for q in questions],
+         "top_k": top_k, "generate": generate},
+        timeout,
+    )["results"]
+
+
+def _post_single(url, question, retrieval, timeout):
+    try:
+        return _post(f"{url}/question",
+                     {"question": question, "retrieval": retrieval},
+                     timeout)
+    except (requests.RequestException, ValueError) as exc:
+        return {"error": str(exc)}
+
+
+def ask(questions, args, generate=True, batch=True, on_results=None):
+    """Return one result dict per question, in order.
+
+    ``batch=False`` (see :func:`has_batch_endpoint`) sends one request per
+    question; ``--top-k`` is then not applied.  A request that still fails
+    once its 503 retries are used up gives each of its questions an
+    ``error`` result instead of stopping the run.  *on_results*, if given,
+    is called as ``on_results(start, results)`` as each batch completes,
+    *start* being the position of its first question.
+    """
+    batches = [questions[i:i + args.batch_size]
+               for i in range(0, len(questions), args.batch_size)]
+    results = [None] * len(batches)
+    progress = tqdm(total=len(questions), desc="Querying RAG")
+
+    def run(i):
+        if batch:
+            try:
+                out = _post_batch(args.url, batches[i], args.retrieval,
+                                  args.top_k, generate, args.timeout)
+            except (requests.RequestException, ValueError) as exc:
+                out = [{"error": str(exc)}] * len(batches[i])
+        else:
+            out = [_post_single(args.url, q, args.retrieval, args.timeout)
+                   for q in batches[i]]
+        results[i] = out
+        if on_results is not None:
+            on_results(i * args.batch_size, out)
+        progress.update(len(batches[i]))
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(run, range(len(batches))))
+    progress.close()
+    return [item for batch in results for item in batch]
+
+
+class AnswerCache:
+    """Append-only JSONL file of ``{"key", "answer"}`` records."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as fh:
+                for line in fh:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._data[record["key"]] = record["answer"]
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def put_many(self, items):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock, open(self.path, "a", encoding="utf-8") as fh:
+            for key, answer in items:
+                self._data[key] = answer
+                fh.write(json.dumps({"key": key, "answer": answer}) + "\n")
+
+
+def cache_key(question, args, fingerprint, top_k):
+    """*top_k* is the one applied: ``None`` for the server's default."""
+    raw = json.dumps([question, args.retrieval, top_k, fingerprint],
+                     sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# answers + RAGAS
+# ---------------------------------------------------------------------------
+def evaluate_answers(ds, args):
+    from datasets import Dataset
+    from ragas import evaluate
+    from ragas.metrics import (
+        context_precision,
+        faithfulness,
+        answer_relevancy
+    )
+
+    _OPENAI_KEY = os.getenv("OPENAI_API_KEY")
+    if not _OPENAI_KEY:
+        raise RuntimeError("Missing OpenAI API key – set OPENAI_API_KEY in your .env file")
+
+    os.environ["OPENAI_API_KEY"] = _OPENAI_KEY
+
+    questions = list(ds["question"])
+    fingerprint = index_fingerprint(args.url, args.timeout)
+    batch = has_batch_endpoint(args.url, args.timeout)
+    if not batch:
+        print("⚠️  The server has no /question/batch: asking one question "
+              "at a time with its default top_k (--top-k is not applied)")
+    top_k = args.top_k if batch else None
+    cache = AnswerCache(args.cache) if args.cache else None
+    keys = [cache_key(q, args, fingerprint, top_k) for q in questions]
+    answers = [cache.get(k) if cache else None for k in keys]
+
+    missing = [i for i, a in enumerate(answers) if a is None]
+    print(f"{len(questions) - len(missing)} cached answers, "
+          f"{len(missing)} to generate")
+    def store(start, results):
+        # cached as each batch arrives, so an interrupted run keeps them
+        fresh = []
+        for i, result in zip(missing[start:], results):
+            if result.get("error"):
+                print(f"⚠️  {questions[i]!r}: {result['error']}")
+                answers[i] = ""
+                continue
+            answers[i] = result["answer"]
+            fresh.append((keys[i], result["answer"]))
+        if cache:
+            cache.put_many(fresh)
+
+    if missing:
+        ask([questions[i] for i in missing], args, batch=batch,
+            on_results=store)
+
     rag_eval_ds = Dataset.from_dict({
-        "question": ds_50["question"],
-        "contexts": [[c] for c in ds_50["context"]],
+        "question": questions,
+        "contexts": [[c] for c in ds["context"]],
         "answer": answers,
-        "ground_truth": ds_50["answer"]
+        "ground_truth": ds["answer"]
     })
 
-    # 4. Evaluate
     report = evaluate(
         rag_eval_ds,
         metrics=[context_precision, faithfulness, answer_relevancy],
@@ -70,5 +242,96 @@ def main():
     print(df)
 
 
+# ---------------------------------------------------------------------------
+# retrieval only
+# ---------------------------------------------------------------------------
+_WORD_RE = re.compile(r"\w+")
+
+
+def _shingles(text, n=3):
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < n:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def is_relevant(chunk_text, context_shingles, threshold=0.5):
+    """A chunk is relevant if most of its word 3-grams occur in the context.
+
+    Chunks come from the OCR of the combined PDF, so they rarely match the
+    dataset context verbatim but share most of their wording with it.
+    """
+    chunk = _shingles(chunk_text)
+    if not chunk:
+        return False
+    return len(chunk & context_shingles) / len(chunk) >= threshold
+
+
+def evaluate_retrieval(ds, args):
+    questions = list(ds["question"])
+    contexts = [_shingles(c) for c in ds["context"]]
+    if not has_batch_endpoint(args.url, args.timeout):
+        raise SystemExit("Retrieval-only mode needs POST /question/batch on "
+                         "the server")
+    results = ask(questions, args, generate=False)
+
+    cutoffs = sorted({k for k in (1, 3, 5) if k < args.top_k} | {args.top_k})
+    hits = {k: 0 for k in cutoffs}
+    reciprocal_ranks = []
+    errors = 0
+    for result, context in zip(results, contexts):
+        if result.get("error"):
+            errors += 1
+            reciprocal_ranks.append(0.0)
+            continue
+        rank = next((r for r, src in enumerate(result["sources"], start=1)
+                     if is_relevant(src["text"], context)), None)
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+        for k in cutoffs:
+            hits[k] += rank is not None and rank <= k
+
+    scores = {f"recall@{k}": hits[k] / len(questions) for k in cutoffs}
+    scores["mrr"] = sum(reciprocal_ranks) / len(questions)
+    report = {"retrieval": args.retrieval, "top_k": args.top_k,
+              "samples": len(questions), "errors": errors, "scores": scores,
+              "index": index_fingerprint(args.url, args.timeout)}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"✅  Results saved to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["answers", "retrieval"],
+                        default="answers")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="batch requests in flight")
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--retrieval", default="hybrid",
+                        choices=["hybrid", "vector", "lexical"])
+    parser.add_argument("--top-k", type=int, default=None,
+                        help="sources per question (default 4, retrieval "
+                             "mode 10)")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--cache",
+                        default=os.path.join(EVAL_DIR, ".cache",
+                                             "answers.jsonl"),
+                        help="answer cache file ('' disables it)")
+    parser.add_argument("--output", help="retrieval mode: write scores here")
+    args = parser.parse_args()
+    if args.top_k is None:
+        args.top_k = 10 if args.mode == "retrieval" else 4
+
+    ds = load_samples(args.samples)
+    if args.mode == "retrieval":
+        evaluate_retrieval(ds, args)
+    else:
+        evaluate_answers(ds, args)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,35 @@
+"""Production serving: ``gunicorn "app.main:create_app()"``.
+
+gunicorn reads this file from the working directory.  Each worker process
+builds its own app (clients, pools, caches) and serves requests on a pool
+of threads; the upstream-bound work of a request (embedding, search legs,
+chat completion) waits on sockets, so threads overlap it well.  Every
+worker admits ``MAX_IN_FLIGHT`` requests at once and answers the rest 503
+with ``Retry-After``; a few spare threads keep ``/metrics`` and those 503s
+responsive while all slots are busy.
+
+Environment: ``PORT`` (8000), ``WEB_CONCURRENCY`` (worker processes: 2
+with ``ROLE=query``, else 1), ``WEB_THREADS`` (threads per worker,
+``MAX_IN_FLIGHT`` + 4), ``WORKER_TIMEOUT`` (120).
+"""
+import os
+
+from app.core.config import settings
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# Ingestion jobs and Chroma belong to a single process: only query-only
+# replicas run several workers by default.
+workers = int(os.getenv("WEB_CONCURRENCY",
+                        2 if settings.ROLE == "query" else 1))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", settings.MAX_IN_FLIGHT + 4
+                        if settings.MAX_IN_FLIGHT > 0 else 32))
+
+# A worker that stops heart-beating this long is restarted.  Requests are
+# bounded by the upstream timeouts (EMBEDDING_TIMEOUT, CHAT_TIMEOUT), not by
+# this; streamed answers may legitimately take longer in total.
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "-"
@@ -0,0 +1,94 @@
+"""Shared fixtures: the local fakes of the upstream APIs from ``bench/``."""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT), str(ROOT / "bench")]
+
+import fake_openai  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.main import create_app  # noqa: E402
+from app.services.embedder import _record, _write_vectors  # noqa: E402
+from app.services.service import RAGService  # noqa: E402
+
+
+@pytest.fixture
+def fake_openai_server():
+    """Fake OpenAI embeddings / chat API on a free local port."""
+    server = fake_openai.serve(port=0, dims=16)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def base_url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+@pytest.fixture
+def service(tmp_path, fake_openai_server):
+    """:class:`RAGService` talking to the fake, with its data in *tmp_path*."""
+    service = RAGService(
+        openai_api_key="test",
+        router_api_key="test",
+        vector_backend="mmap",
+        mmap_dir=tmp_path / "mmap",
+        lexical_dir=tmp_path / "lexical",
+        embedding_base_url=base_url(fake_openai_server),
+        router_base_url=base_url(fake_openai_server),
+        embedding_cache_path=tmp_path / "embedding_cache.sqlite3",
+    )
+    yield service
+    service.close()
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch, fake_openai_server):
+    """Build a query replica against the fake; settings override defaults."""
+    apps = []
+
+    def make(**overrides):
+        values = {
+            "ROLE": "query",
+            "WARMUP": False,
+            "OPENAI_API_KEY": "test",
+            "ROUTER_API_KEY": "test",
+            "VECTOR_BACKEND": "mmap",
+            "MMAP_INDEX_DIR": str(tmp_path / "mmap"),
+            "LEXICAL_INDEX_DIR": str(tmp_path / "lexical"),
+            "CHROMA_DIR": str(tmp_path / "chroma"),
+            "UPLOAD_DIR": str(tmp_path / "uploads"),
+            "JOBS_DIR": str(tmp_path / "jobs"),
+            "SNAPSHOT_DIR": str(tmp_path / "snapshots"),
+            "EMBEDDING_CACHE_PATH": str(tmp_path / "cache.sqlite3"),
+            "EMBEDDING_BASE_URL": base_url(fake_openai_server),
+            "ROUTER_BASE_URL": base_url(fake_openai_server),
+            "UPSTREAM_MAX_RETRIES": 0,
+            **overrides,
+        }
+        for name, value in values.items():
+            monkeypatch.setattr(settings, name, value)
+        app = create_app()
+        apps.append(app)
+        _index(app.extensions["rag"])
+        return app
+
+    yield make
+    for app in apps:
+        app.extensions["rag"].close()
+
+
+def _index(service):
+    """Store a few chunks, so questions reach the chat model."""
+    records = [_record({"text": f"Check the pump valve every {n} hours.",
+                        "filename": "manual.pdf", "page_index": n,
+                        "chunk_index": 0})
+               for n in range(3)]
+    vectors = service.embeddings.embed_documents([r[1] for r in records])
+    _write_vectors(service.collection(create=True), list(zip(records,
+                                                             vectors)))
+    service.lexical().add(records)
+    service.refresh()
@@ -0,0 +1,55 @@
+import time
+
+import numpy as np
+
+from app.services.answer_cache import AnswerCache
+
+
+def _vector(seed, dim=8):
+    return np.random.default_rng(seed).normal(size=dim)
+
+
+def _unchanged(filenames):
+    return {name: 1 for name in filenames}
+
+
+def test_hit_needs_the_same_scope():
+    cache = AnswerCache(threshold=0.9, max_entries=4)
+    cache.put(_vector(0), "a", "q", "answer", [], {"doc.pdf": 1})
+
+    assert cache.get(_vector(0) * 2, "a", _unchanged) == ("answer", [])
+    assert cache.get(_vector(0), "b", _unchanged) is None
+    assert cache.get(_vector(1), "a", _unchanged) is None
+
+
+def test_expired_entries_are_skipped_and_their_slots_reused():
+    cache = AnswerCache(threshold=0.9, max_entries=2, ttl=0.05)
+    cache.put(_vector(0), "a", "q0", "old", [], {})
+    cache.put(_vector(1), "a", "q1", "old", [], {})
+    time.sleep(0.1)
+
+    assert cache.get(_vector(0), "a", _unchanged) is None
+    cache.put(_vector(2), "a", "q2", "new", [], {})
+    assert cache.stats()["entries"] == 1
+    assert cache.get(_vector(2), "a", _unchanged) == ("new", [])
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AnswerCache(threshold=0.9, max_entries=2)
+    cache.put(_vector(0), "a", "q0", "zero", [], {})
+    cache.put(_vector(1), "a", "q1", "one", [], {})
+    assert cache.get(_vector(0), "a", _unchanged) is not None
+
+    cache.put(_vector(2), "a", "q2", "two", [], {})
+
+    assert cache.get(_vector(1), "a", _unchanged) is None
+    assert cache.get(_vector(0), "a", _unchanged) == ("zero", [])
+    assert cache.get(_vector(2), "a", _unchanged) == ("two", [])
+
+
+def test_stale_files_drop_the_entry():
+    cache = AnswerCache(threshold=0.9, max_entries=2)
+    cache.put(_vector(0), "a", "q", "answer", [], {"doc.pdf": 1})
+
+    assert cache.get(_vector(0), "a", lambda names: {"doc.pdf": 2}) is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,51 @@
+import openai
+import pytest
+
+from app.services.embedder import AdaptiveLimiter, _embed_batch
+
+
+class RecordingLimiter(AdaptiveLimiter):
+    """Limiter that lets the fake stop throttling after *n_throttled* 429s."""
+
+    def __init__(self, maximum, handler, n_throttled):
+        super().__init__(maximum)
+        self.handler = handler
+        self.n_throttled = n_throttled
+        self.limits = []
+
+    def release(self, throttled=False):
+        super().release(throttled)
+        self.limits.append(self.limit)
+        if throttled and len(self.limits) == self.n_throttled:
+            self.handler.throttle = 0.0
+
+
+def test_429s_shrink_the_window_until_the_batch_succeeds(
+    service, fake_openai_server
+):
+    handler = fake_openai_server.RequestHandlerClass
+    handler.throttle = 1.0
+    limiter = RecordingLimiter(8, handler, n_throttled=3)
+    batch = [(f"id-{i}", f"text {i}", {}) for i in range(3)]
+
+    done, vectors = _embed_batch(service.ingest_embeddings, batch, limiter,
+                                 max_retries=5)
+
+    assert done is batch
+    assert len(vectors) == 3 and len(vectors[0]) == 16
+    # every 429 reached the limiter: the client itself does not retry
+    assert handler.stats == {"requests": 4, "throttled": 3}
+    assert limiter.limits == [4, 2, 1, 2]
+
+
+def test_batch_gives_up_after_max_retries(service, fake_openai_server):
+    handler = fake_openai_server.RequestHandlerClass
+    handler.throttle = 1.0
+    limiter = AdaptiveLimiter(4)
+    batch = [("id", "text", {})]
+
+    with pytest.raises(openai.RateLimitError):
+        _embed_batch(service.ingest_embeddings, batch, limiter,
+                     max_retries=1)
+    assert handler.stats == {"requests": 2, "throttled": 2}
+    assert limiter.limit == 1
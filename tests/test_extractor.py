@@ -0,0 +1,73 @@
+from fake_mistral import FakeMistral, blank_pdf
+from mistralai import models
+
+from app.services import extractor
+
+
+class FlakyMistral(FakeMistral):
+    """Fake whose OCR fails once per shard in *failing*, then succeeds.
+
+    With *relative* the page indices of a shard are numbered from 0, as
+    when the API counts pages within the selection.
+    """
+
+    def __init__(self, failing=(), relative=False, **kwargs):
+        super().__init__(**kwargs)
+        self.failing = set(failing)
+        self.relative = relative
+        self.shards = []
+        process = self.ocr.process
+
+        def flaky_process(document, model, pages=None, **options):
+            with self._lock:
+                self.shards.append(pages)
+                first = pages[0] if pages else 0
+                fail = first in self.failing
+                self.failing.discard(first)
+            if fail:
+                raise models.SDKError("injected OCR failure",
+                                      status_code=503)
+            response = process(document, model, pages=pages, **options)
+            if self.relative:
+                for position, page in enumerate(response.pages):
+                    page.index = position
+            return response
+
+        self.ocr.process = flaky_process
+
+
+def expected_pages(tmp_path, n_pages):
+    """Markdown of every page when the whole document is OCR'd at once."""
+    pdf = tmp_path / "doc.pdf"
+    pages = extractor.extract_pdf(pdf, client=FakeMistral(n_pages=n_pages),
+                                  shard_pages=0)["pages"]
+    return [page["markdown"] for page in pages]
+
+
+def test_shards_are_retried_and_stitched_in_order(tmp_path):
+    (tmp_path / "doc.pdf").write_bytes(blank_pdf(10))
+    client = FlakyMistral(n_pages=10, failing={3, 9})
+
+    pages = extractor.extract_pdf(tmp_path / "doc.pdf", client=client,
+                                  shard_pages=3, shard_workers=2)["pages"]
+
+    assert [page["index"] for page in pages] == list(range(10))
+    assert [page["markdown"] for page in pages] == expected_pages(tmp_path,
+                                                                  10)
+    # four shards, two of them retried once
+    assert len(client.shards) == 6
+    assert client.shards.count([3, 4, 5]) == 2
+    assert client.shards.count([9]) == 2
+    assert client.uploads == {}  # remote copy deleted
+
+
+def test_shard_indices_relative_to_the_selection_are_made_global(tmp_path):
+    (tmp_path / "doc.pdf").write_bytes(blank_pdf(7))
+    client = FlakyMistral(n_pages=7, relative=True)
+
+    pages = extractor.extract_pdf(tmp_path / "doc.pdf", client=client,
+                                  shard_pages=3)["pages"]
+
+    assert [page["index"] for page in pages] == list(range(7))
+    assert [page["markdown"] for page in pages] == expected_pages(tmp_path,
+                                                                  7)
@@ -0,0 +1,34 @@
+import io
+
+from fake_mistral import blank_pdf
+
+from app.services import ingest
+from app.services.ocr_store import OCRStore, save_upload
+
+CHUNK_PARAMS = {"chunk_size": 200, "chunk_overlap": 0}
+
+
+def test_deleting_a_document_removes_its_files(service, tmp_path):
+    uploads = tmp_path / "uploads"
+    store = OCRStore(uploads / ".ocr")
+    digest, pdf = save_upload(io.BytesIO(blank_pdf(2)), uploads)
+    store.save_pages(digest, [{"index": n, "markdown": f"Pump page {n}."}
+                              for n in range(2)])  # no OCR call
+    for filename in ("a.pdf", "b.pdf"):
+        ingest.ingest_pdf(pdf, filename, digest, service, store,
+                          CHUNK_PARAMS)
+
+    # the PDF is still indexed as b.pdf: only a.pdf's chunk log goes
+    n_vectors, n_files = ingest.delete_document(service, store, "a.pdf",
+                                                uploads)
+    assert n_vectors > 0 and n_files == 1
+    assert pdf.is_file() and store.has_ocr(digest)
+
+    n_vectors, n_files = ingest.delete_document(service, store, "b.pdf",
+                                                uploads)
+    assert n_vectors > 0 and n_files == 2
+    assert not pdf.exists() and not store.has_ocr(digest)
+    assert store.manifest(digest) == {"indexed": {}}
+    assert list(uploads.glob("*.chunks.jsonl")) == []
+    assert ingest.delete_document(service, store, "b.pdf",
+                                  uploads) == (0, 0)
@@ -0,0 +1,84 @@
+import pytest
+
+from app.core.config import settings
+from app.services import retriever
+from app.services.embedder import _record, _write_vectors
+
+
+@pytest.fixture
+def indexed(service, monkeypatch):
+    """Collection and BM25 index of a few near-duplicate chunks."""
+    monkeypatch.setattr(settings, "MMR_LAMBDA", 0.5)
+    monkeypatch.setattr(settings, "MMR_FETCH_K", 6)
+    monkeypatch.setattr(settings, "MERGE_ADJACENT_CHUNKS", False)
+    records = [_record({"text": f"Check the pump valve every {n} hours.",
+                        "filename": "manual.pdf", "page_index": n,
+                        "chunk_index": 0})
+               for n in range(8)]
+    vectors = service.embeddings.embed_documents([r[1] for r in records])
+    collection = service.collection(create=True)
+    _write_vectors(collection, list(zip(records, vectors)))
+    service.lexical().add(records)
+    return collection, service.lexical()
+
+
+class CountingStore:
+    """Wraps a store and counts :meth:`vectors` lookups."""
+
+    def __init__(self, store, found=None):
+        self.store = store
+        self.found = found
+        self.looked_up = []
+
+    def query(self, *args, **kwargs):
+        return self.store.query(*args, **kwargs)
+
+    def vectors(self, ids):
+        self.looked_up.extend(ids)
+        found = self.store.vectors(ids)
+        return found if self.found is None else {
+            cid: vec for cid, vec in found.items() if cid in self.found
+        }
+
+
+def test_mmr_uses_the_vectors_returned_by_the_query(service, indexed):
+    store = CountingStore(indexed[0])
+
+    chunks = retriever._similar_chunks("pump valve hours", store,
+                                       service.embeddings, top_k=2,
+                                       mode="vector")
+
+    assert len(chunks) == 2
+    assert store.looked_up == []  # no second round trip
+    assert all("vector" not in chunk for chunk in chunks)
+
+
+def test_bm25_candidates_without_a_vector_are_dropped(service, indexed):
+    collection, lexical = indexed
+    hits = retriever._lexical_search("pump valve hours", lexical, 6)
+    kept = {hit["id"] for hit in hits[1:]}
+    store = CountingStore(collection, found=kept)
+
+    chunks = retriever._select(hits, {}, store, top_k=5)
+
+    assert sorted(store.looked_up) == sorted(hit["id"] for hit in hits)
+    assert len(chunks) == 5
+    assert hits[0]["id"] not in {chunk["id"] for chunk in chunks}
+
+
+def test_batch_answers_are_cached(service, indexed, fake_openai_server):
+    stats = fake_openai_server.RequestHandlerClass.stats
+    questions = [("How often is the valve checked?", "hybrid"),
+                 ("When is the pump valve checked?", "vector")]
+
+    first = retriever.answer_questions(questions, service=service)
+    before = dict(stats)
+    again = retriever.answer_questions(questions, service=service)
+    single = retriever.answer_question(questions[1][0], service=service,
+                                       retrieval="vector")
+
+    assert [r["cached"] for r in first] == [False, False]
+    assert [r["cached"] for r in again] == [True, True]
+    assert [r["answer"] for r in again] == [r["answer"] for r in first]
+    assert single["cached"]
+    assert stats == before  # no embedding or chat call
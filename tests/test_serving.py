@@ -0,0 +1,78 @@
+import socket
+
+import pytest
+
+from conftest import base_url
+
+QUESTION = {"question": "How often is the pump valve checked?"}
+
+
+def _closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_question_is_answered(make_app):
+    response = make_app().test_client().post("/question", json=QUESTION)
+
+    assert response.status_code == 200
+    assert response.json["sources"]
+
+
+def test_requests_over_the_in_flight_limit_get_503(make_app):
+    client = make_app(MAX_IN_FLIGHT=1, RETRY_AFTER=7).test_client()
+
+    # a streamed answer holds its slot until the body is closed
+    stream = client.post("/question?stream=true", json=QUESTION,
+                         buffered=False)
+    assert stream.status_code == 200
+    busy = client.post("/question", json=QUESTION)
+    metrics = client.get("/metrics")
+    stream.close()
+    after = client.post("/question", json=QUESTION)
+
+    assert busy.status_code == 503
+    assert busy.headers["Retry-After"] == "7"
+    assert busy.json == {"detail": "Server busy, retry later"}
+    assert metrics.status_code == 200  # never limited
+    assert after.status_code == 200
+
+
+@pytest.mark.parametrize("setting, latency", [
+    ("CHAT_TIMEOUT", "chat_latency"),
+    ("EMBEDDING_TIMEOUT", "latency"),
+])
+def test_upstream_timeout_is_504(make_app, fake_openai_server, setting,
+                                 latency):
+    app = make_app(**{setting: 0.2})
+    setattr(fake_openai_server.RequestHandlerClass, latency, 1.0)
+
+    response = app.test_client().post("/question",
+                                      json={"question": "Something new?"})
+
+    assert response.status_code == 504
+    assert response.json == {"detail": "Upstream service timed out"}
+
+
+def test_unreachable_upstream_is_502(make_app):
+    app = make_app(
+        ROUTER_BASE_URL=f"http://127.0.0.1:{_closed_port()}/v1"
+    )
+
+    response = app.test_client().post("/question", json=QUESTION)
+
+    assert response.status_code == 502
+    assert response.json == {"detail": "Upstream service unreachable"}
+
+
+def test_upstream_429_is_503_with_its_retry_after(make_app,
+                                                  fake_openai_server):
+    app = make_app()
+    fake_openai_server.RequestHandlerClass.throttle = 1.0
+
+    response = app.test_client().post("/question",
+                                      json={"question": "Something new?"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"  # ceil of the fake's 0.2
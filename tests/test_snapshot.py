@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from app.core.config import settings
+from app.services import snapshot
+from app.services.embedder import _record, _write_vectors
+
+
+def _add(service, filename, tenant=None):
+    """Index two chunks of *filename*; return the collection's name."""
+    name = service.shard_for(filename, tenant)
+    records = [_record({"text": f"{filename} says {n}.", "filename": filename,
+                        "page_index": n, "chunk_index": 0})
+               for n in range(2)]
+    vectors = service.embeddings.embed_documents([r[1] for r in records])
+    _write_vectors(service.collection(name, create=True),
+                   list(zip(records, vectors)))
+    service.lexical(name).add(records)
+    return name
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_collections_absent_from_the_snapshot_are_emptied(service, tmp_path,
+                                                          incremental):
+    base = _add(service, "manual.pdf")
+    tenant = _add(service, "notes.pdf", tenant="acme")
+    old = tmp_path / "old"
+    snapshot.export_snapshot(service, old)
+    new = tmp_path / "new"
+    snapshot.export_snapshot(service, new, names=[base])
+
+    result = snapshot.import_snapshot(service, new,
+                                      since=old if incremental else None)
+
+    assert result[tenant] == {"upserted": 0, "deleted": 2,
+                              "bm25_restored": False}
+    assert result[base]["deleted"] == 0
+    assert service.collection(tenant).count() == 0
+    assert service.lexical(tenant).count() == 0
+    assert service.collection(base).count() == 2
+
+
+def test_admin_import_runs_as_a_job(make_app, monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "secret")
+    app = make_app()
+    client = app.test_client()
+    headers = {"Authorization": "Bearer secret"}
+    exported = client.post("/admin/snapshots", headers=headers).json
+
+    response = client.post(
+        f"/admin/snapshots/{exported['snapshot_id']}/import",
+        headers=headers,
+    )
+    assert response.status_code == 202
+    for _ in range(100):
+        job = client.get(response.json["status_url"], headers=headers).json
+        if job["finished_at"] is not None:
+            break
+        time.sleep(0.05)
+
+    assert job["status"] == "done"
+    assert job["snapshot_id"] == exported["snapshot_id"]
+    assert job["collections"] == {
+        settings.COLLECTION_NAME: {"upserted": 0, "deleted": 0,
+                                   "bm25_restored": False},
+    }
@@ -0,0 +1,53 @@
+import multiprocessing
+
+import numpy as np
+
+from app.services.vectorstore import MmapStore
+
+
+def _vectors(writer, batch, size=20, dim=8):
+    rng = np.random.default_rng(writer * 1000 + batch)
+    vecs = rng.normal(size=(size, dim)).astype(np.float32)
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+def _ids(writer, batch, size=20):
+    return [f"{writer}-{batch}-{i}" for i in range(size)]
+
+
+def _write(directory, writer, n_batches):
+    """Upsert batches; drop and compact away some rows of the previous one."""
+    store = MmapStore(directory, "docs")
+    for batch in range(n_batches):
+        ids = _ids(writer, batch)
+        store.upsert(ids, _vectors(writer, batch), ids,
+                     [{"filename": f"{writer}.pdf"}] * len(ids))
+        if batch:
+            store.delete(_ids(writer, batch - 1)[:5])
+            store.compact()
+    store.close()
+
+
+def test_writers_in_two_processes_keep_each_others_rows(tmp_path):
+    n_batches = 30
+    context = multiprocessing.get_context("fork")
+    writers = [context.Process(target=_write, args=(tmp_path, w, n_batches))
+               for w in range(2)]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join()
+    assert [process.exitcode for process in writers] == [0, 0]
+
+    store = MmapStore(tmp_path, "docs")
+    assert store.count() == 2 * (n_batches * 20 - (n_batches - 1) * 5)
+    for writer in range(2):
+        for batch in range(n_batches):
+            skip = 5 if batch < n_batches - 1 else 0
+            ids = _ids(writer, batch)[skip:]
+            found = store.vectors(ids)
+            assert sorted(found) == sorted(ids)
+            np.testing.assert_allclose(np.stack([found[i] for i in ids]),
+                                       _vectors(writer, batch)[skip:],
+                                       atol=1e-6)
+    store.close()